@@ -0,0 +1,396 @@
+from oacensus.db import db
+from oacensus.exceptions import UserFeedback
+from oacensus.models import create_db_tables
+from oacensus.scraper import Scraper
+from oacensus.version import OACENSUS_VERSION
+from xml.sax.saxutils import escape
+import cPickle as pickle
+import csv
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+
+WORDS = """
+acute adaptive analysis antibody assessment bacterial behaviour biology
+cancer cardiac cell chronic climate clinical cognitive cohort community
+comparative control data development disease dynamics early economic
+effects environmental evidence evolution expression factors field function
+gene genetic global growth health human immune impact infection
+intervention long marine mechanisms model molecular network neural novel
+outcomes patients policy population protein quality randomised regulation
+response review risk role social species structure study survey synthesis
+systems therapy trial tumour variation
+""".split()
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+SCALE_UNITS = {'' : 1, 'k' : 1000, 'm' : 1000**2}
+
+def parse_scale(raw):
+    """
+    Parse a number of records like 500, '1k' or '1M'.
+    """
+    match = re.match("^([0-9.]+)\\s*([km]?)$", str(raw).strip(), re.IGNORECASE)
+    if not match:
+        raise UserFeedback("Can't parse scale '%s', use e.g. '1k' or '1M'." % raw)
+    number, unit = match.groups()
+    return int(float(number) * SCALE_UNITS[unit.lower()])
+
+def fake_title(rng, n_words=8):
+    return " ".join(rng.choice(WORDS) for i in range(n_words)).capitalize()
+
+def fake_issn(i):
+    return "%04d-%04d" % (i // 10000 % 10000, i % 10000)
+
+def fake_doi(i):
+    return "10.%s/bench.%s" % (1000 + i % 9000, i)
+
+def n_journals(n_records):
+    """
+    Article fixtures spread their records over a pool of journals, as real
+    search results do.
+    """
+    return max(1, n_records // 20)
+
+class Fixture(object):
+    """
+    Writes synthetic data in the format a scraper's scrape method leaves in
+    its work directory, so its process method can be run offline.
+
+    Records are generated from a seeded random.Random, so a fixture at a given
+    scale is the same every time it is written.
+    """
+    alias = None
+    settings = {}
+    max_records = None
+
+    def records(self, n_records):
+        """
+        Number of records which will actually be written for n_records.
+        """
+        if self.max_records is not None:
+            return min(n_records, self.max_records)
+        return n_records
+
+    def write(self, dirpath, n_records, seed=0):
+        """
+        Writes the fixture to dirpath and returns the number of records.
+        """
+        n = self.records(n_records)
+        self.write_records(dirpath, n, random.Random(seed))
+        return n
+
+    def write_records(self, dirpath, n, rng):
+        raise NotImplementedError()
+
+class PubmedFixture(Fixture):
+    """
+    PubmedArticleSet XML files of 10,000 articles each, as returned by efetch.
+    """
+    alias = 'pubmed'
+    settings = {'search' : 'oacensus bench'}
+    batch_size = 10000
+
+    article_template = """<PubmedArticle>
+<MedlineCitation Status="MEDLINE" Owner="NLM">
+<PMID Version="1">%(pmid)s</PMID>
+<Article PubModel="Print">
+<Journal>
+<ISSN IssnType="%(issn_type)s">%(issn)s</ISSN>
+<JournalIssue CitedMedium="Print">
+<Volume>%(volume)s</Volume>
+<PubDate><Year>%(year)s</Year><Month>%(month)s</Month></PubDate>
+</JournalIssue>
+<Title>%(journal_title)s</Title>
+<ISOAbbreviation>%(journal_iso)s</ISOAbbreviation>
+</Journal>
+<ArticleTitle>%(title)s</ArticleTitle>
+<ELocationID EIdType="doi" ValidYN="Y">%(doi)s</ELocationID>
+</Article>
+<OtherID Source="NLM">PMC%(pmid)s</OtherID>
+</MedlineCitation>
+<PubmedData><PublicationStatus>ppublish</PublicationStatus></PubmedData>
+</PubmedArticle>
+"""
+
+    def write_records(self, dirpath, n, rng):
+        journals = n_journals(n)
+        for i, start in enumerate(range(0, n, self.batch_size)):
+            filepath = os.path.join(dirpath, "data_%04d.xml" % i)
+            with open(filepath, 'wb') as f:
+                f.write('<?xml version="1.0"?>\n<PubmedArticleSet>\n')
+                for j in range(start, min(n, start + self.batch_size)):
+                    journal = rng.randrange(journals)
+                    f.write(self.article_template % {
+                        'pmid' : 20000000 + j,
+                        'issn_type' : rng.choice(['Print', 'Electronic']),
+                        'issn' : fake_issn(journal),
+                        'volume' : rng.randint(1, 60),
+                        'year' : rng.randint(1990, 2014),
+                        'month' : rng.choice(MONTHS),
+                        'journal_title' : "Journal of %s" % fake_title(random.Random(journal), 3),
+                        'journal_iso' : "J %s" % journal,
+                        'title' : escape(fake_title(rng, rng.randint(6, 14))),
+                        'doi' : fake_doi(j)
+                        })
+                f.write('</PubmedArticleSet>\n')
+
+class DoajFixture(Fixture):
+    """
+    DOAJ journal title CSV.
+    """
+    alias = 'doaj'
+    settings = {'add-new-journals' : True}
+
+    def write_records(self, dirpath, n, rng):
+        with open(os.path.join(dirpath, "doaj.csv"), 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Title', 'Title Alternative', 'Identifier', 'Publisher',
+                'Language', 'ISSN', 'EISSN', 'Keywords', 'Start year', 'Added on date',
+                'Subjects', 'Country', 'Publication fee', 'Further Information',
+                'CC License', 'Content in DOAJ'])
+            for i in range(n):
+                writer.writerow([
+                    "Journal of %s" % fake_title(rng, 3), '',
+                    "http://journal%s.example.org" % i,
+                    "Publisher %s" % rng.randrange(max(1, n // 50)),
+                    'English', fake_issn(i), fake_issn(i + n), '',
+                    rng.randint(1990, 2014), '2013-01-01', '', 'United Kingdom',
+                    rng.choice(['Yes', 'No']), '',
+                    rng.choice(['', 'BY', 'BY-NC', 'BY-SA']), 'Yes'])
+
+class CrossrefJournalsFixture(Fixture):
+    """
+    Crossref journal title list CSV.
+    """
+    alias = 'crossrefjournals'
+
+    def write_records(self, dirpath, n, rng):
+        with open(os.path.join(dirpath, "crossref.csv"), 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['JournalTitle', 'JournalID', 'Publisher', 'pissn',
+                'eissn', 'issn|issn2', 'doi', '(year1)[volume1]issue1,issue2,issue3'])
+            for i in range(n):
+                issn = fake_issn(i)
+                if rng.random() < 0.5:
+                    raw_issn = "%s|%s" % (issn.replace("-", ""), fake_issn(i + n).replace("-", ""))
+                else:
+                    raw_issn = issn.replace("-", "")
+                writer.writerow([
+                    "Journal of %s" % fake_title(rng, 3), i,
+                    "Publisher %s" % rng.randrange(max(1, n // 50)),
+                    issn, '', raw_issn, "10.%s/journal.%s" % (1000 + i % 9000, i), ''])
+
+class WileyFixture(Fixture):
+    """
+    Wiley journal list spreadsheet. The scraper reads at most 65,000 rows of
+    an .xls sheet, so this fixture is capped below that.
+    """
+    alias = 'wiley'
+    settings = {'add-new-journals' : True}
+    max_records = 64000
+
+    def write_records(self, dirpath, n, rng):
+        import xlwt
+        wb = xlwt.Workbook()
+        sheet = wb.add_sheet('Journals')
+        sheet.write(0, 0, 'Wiley Online Library Journals List')
+        headers = ['Code', 'Print ISSN', 'Electronic ISSN', 'Journal DOI', 'Title',
+                'Frequency', 'Volume', 'Issue', 'General Subject Category', 'Subject']
+        for col, header in enumerate(headers):
+            sheet.write(5, col, header)
+        for i in range(n):
+            row = 6 + i
+            values = ['J%s' % i, fake_issn(i), fake_issn(i + n),
+                    "10.1002/(ISSN)%s" % fake_issn(i), "Journal of %s" % fake_title(rng, 3),
+                    rng.randint(1, 12), rng.randint(1, 60), rng.randint(1, 12),
+                    rng.choice(WORDS).capitalize(), rng.choice(WORDS)]
+            for col, value in enumerate(values):
+                sheet.write(row, col, value)
+        wb.save(os.path.join(dirpath, "wiley-journals.xls"))
+
+class GtrFixture(Fixture):
+    """
+    Publication JSON as collected from the RCUK Gateway to Research.
+    """
+    alias = 'gtr'
+    settings = {'search-type' : 'council', 'search' : 'EPSRC'}
+
+    def write_records(self, dirpath, n, rng):
+        journals = n_journals(n)
+        epoch_2014 = 1388534400000
+        with open(os.path.join(dirpath, "gtr-pubs.json"), 'wb') as f:
+            f.write("[")
+            for i in range(n):
+                journal = rng.randrange(journals)
+                pub = {
+                        'id' : hashlib.md5(str(i)).hexdigest(),
+                        'title' : fake_title(rng, rng.randint(6, 14)),
+                        'journalTitle' : "Journal of %s" % fake_title(random.Random(journal), 3),
+                        'issn' : fake_issn(journal),
+                        'doi' : "http://dx.doi.org/%s" % fake_doi(i),
+                        'datePublished' : str(epoch_2014 - rng.randrange(10**12))
+                        }
+                if i > 0:
+                    f.write(",\n")
+                json.dump(pub, f)
+            f.write("]\n")
+
+class BiomedFixture(Fixture):
+    """
+    BioMed Central journal index page and one page per journal holding its
+    ISSN. The real index lists a few hundred journals, so this fixture is
+    capped to keep the number of files manageable.
+    """
+    alias = 'biomed'
+    settings = {'add-new-journals' : True}
+    max_records = 10000
+
+    def write_records(self, dirpath, n, rng):
+        urls = ["http://www.biomedcentral.com/bench%s" % i for i in range(n)]
+        with open(os.path.join(dirpath, "bmc-journal-list.html"), 'wb') as f:
+            f.write("<html><head><title>Journals</title></head><body>\n")
+            f.write('<ul class="journals">\n')
+            for url in urls:
+                f.write('<li><h3><a href="%s">BMC %s</a></h3><p>%s</p></li>\n' % (
+                    url, fake_title(rng, 3), fake_title(rng, 12)))
+            f.write("</ul>\n")
+            f.write('<div id="archived-journals"><ul><li><h3><a href="http://www.biomedcentral.com/archived">Archived</a></h3></li></ul></div>\n')
+            f.write("</body></html>\n")
+
+        for i, url in enumerate(urls):
+            filename = hashlib.md5(url).hexdigest()
+            with open(os.path.join(dirpath, filename), 'wb') as f:
+                f.write('<html><body><div class="journal-info">%s' % fake_title(rng, 20))
+                f.write('<span id="issn">%s</span></div></body></html>\n' % fake_issn(i))
+
+class ElsevierFixture(Fixture):
+    """
+    Journal list as saved by the Elsevier scraper. Its scrape method parses
+    the HTML pages itself and only keeps the journal details, so that is what
+    process reads.
+    """
+    alias = 'elsevier'
+    settings = {'add-new-journals' : True}
+
+    def write_records(self, dirpath, n, rng):
+        journals = [{
+            'title' : "Journal of %s" % fake_title(rng, 3),
+            'issn' : fake_issn(i),
+            'url' : "https://www.elsevier.com/journals/bench/%s" % fake_issn(i)
+            } for i in range(n)]
+        with open(os.path.join(dirpath, "elsevier-journal-list.html"), 'wb') as f:
+            pickle.dump(journals, f)
+
+FIXTURES = dict((fixture.alias, fixture) for fixture in (
+    PubmedFixture(), DoajFixture(), CrossrefJournalsFixture(), WileyFixture(),
+    GtrFixture(), BiomedFixture(), ElsevierFixture()))
+
+def fixture_for(alias):
+    if not alias in FIXTURES:
+        raise UserFeedback("No benchmark fixture for '%s', should be one of %s" % (alias, ", ".join(sorted(FIXTURES))))
+    return FIXTURES[alias]
+
+def write_fixture(alias, dirpath, n_records, seed=0):
+    """
+    Writes a fixture to a new directory at dirpath, which can be used as the
+    'cache' setting of the scraper. Returns the number of records.
+    """
+    os.makedirs(dirpath)
+    return fixture_for(alias).write(dirpath, n_records, seed)
+
+def run_benchmark(alias, n_records, opts, seed=0):
+    """
+    Times the process method of the scraper for alias against a fixture of
+    n_records, using a scratch cache and db which are removed afterwards.
+    Returns a dict of results including the metrics recorded by the scraper.
+    """
+    fixture = fixture_for(alias)
+    tmpdir = tempfile.mkdtemp(prefix="oacensus-bench-")
+    try:
+        bench_opts = dict(opts)
+        bench_opts.update({
+            'cachedir' : os.path.join(tmpdir, 'cache'),
+            'workdir' : os.path.join(tmpdir, 'work'),
+            'progress' : False
+            })
+
+        scraper = Scraper.create_instance(alias, bench_opts)
+        scraper.update_settings(fixture.settings)
+
+        os.makedirs(scraper.work_dir())
+        records = fixture.write(scraper.work_dir(), n_records, seed)
+        scraper.copy_work_dir_to_cache()
+
+        db.init(os.path.join(tmpdir, "bench.sqlite3"))
+        create_db_tables()
+        scraper.run_process()
+
+        result = {
+                'alias' : alias,
+                'scale' : n_records,
+                'records' : records
+                }
+        result.update(scraper.metrics)
+        result['records_per_second'] = records / max(result['process_seconds'], 1e-6)
+        return result
+    finally:
+        db.init(None)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+class BenchHistory(object):
+    """
+    Benchmark results from previous runs, stored one run per line in a JSON
+    lines file so results can be appended without rewriting history.
+    """
+    def __init__(self, benchdir):
+        self.benchdir = benchdir
+
+    def history_path(self):
+        return os.path.join(self.benchdir, "history.jsonl")
+
+    def runs(self):
+        if not os.path.exists(self.history_path()):
+            return []
+        with open(self.history_path(), 'rb') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def previous_seconds(self, alias, records, window=5):
+        """
+        process_seconds from up to window most recent runs of the same
+        benchmark, oldest first.
+        """
+        seconds = []
+        for run in self.runs():
+            for result in run['results']:
+                if result['alias'] == alias and result['records'] == records:
+                    seconds.append(result['process_seconds'])
+        return seconds[-window:]
+
+    def regression(self, result, tolerance):
+        """
+        Returns the baseline (median of recent runs) if result is slower than
+        it by more than tolerance, a fraction, otherwise None.
+        """
+        previous = sorted(self.previous_seconds(result['alias'], result['records']))
+        if not previous:
+            return None
+        baseline = previous[len(previous) // 2]
+        if result['process_seconds'] > baseline * (1 + tolerance):
+            return baseline
+
+    def append(self, results):
+        if not os.path.exists(self.benchdir):
+            os.makedirs(self.benchdir)
+        run = {
+                'started' : datetime.datetime.now().isoformat(),
+                'version' : OACENSUS_VERSION,
+                'results' : results
+                }
+        with open(self.history_path(), 'ab') as f:
+            f.write(json.dumps(run, sort_keys=True) + "\n")
@@ -0,0 +1,419 @@
+from oacensus.exceptions import UserFeedback
+from oacensus.links import LINK_MODES
+from oacensus.links import place_file
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+BLOCK_SIZE = 1024 * 64
+
+class Codec(object):
+    """
+    Base class for the compression used to store blobs.
+    """
+    name = None
+    extension = None
+
+    def compressing_writer(self, f):
+        raise NotImplementedError()
+
+    def decompressing_reader(self, f):
+        raise NotImplementedError()
+
+class NoCompression(Codec):
+    name = 'none'
+    extension = 'raw'
+
+    def compressing_writer(self, f):
+        return f
+
+    def decompressing_reader(self, f):
+        return f
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    extension = 'gz'
+
+    def compressing_writer(self, f):
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6)
+
+    def decompressing_reader(self, f):
+        return gzip.GzipFile(fileobj=f, mode='rb')
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    extension = 'zst'
+
+    def compressing_writer(self, f):
+        return zstandard.ZstdCompressor(level=3).stream_writer(f)
+
+    def decompressing_reader(self, f):
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f), BLOCK_SIZE)
+
+CODECS = dict((codec.name, codec) for codec in (NoCompression(), GzipCodec(), ZstdCodec()))
+
+def codec_for(name):
+    if not name in CODECS:
+        raise UserFeedback("Unknown cache codec '%s', should be one of %s" % (name, ", ".join(sorted(CODECS))))
+    if name == 'zstd' and not ZSTD_AVAILABLE:
+        raise UserFeedback("The zstandard package is required for the zstd cache codec.")
+    return CODECS[name]
+
+class BlobReader(object):
+    """
+    File-like object which streams the decompressed content of a blob.
+    """
+    def __init__(self, raw, stream):
+        self.raw = raw
+        self.stream = stream
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.stream.read(BLOCK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            return "".join(chunks)
+        return self.stream.read(size)
+
+    def readline(self, size=-1):
+        return self.stream.readline(size)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class CacheStore(object):
+    """
+    Content-addressed store for scraped data.
+
+    Each cache entry maps the relative paths of the files a scraper wrote to
+    its work directory onto blobs named by the SHA-1 of their uncompressed
+    content, so identical downloads are only stored once however many
+    entries refer to them. Blobs are compressed with the store's codec.
+
+    Layout under the cache directory:
+
+        entries/<key>.json          manifest for the entry stored under key
+        objects/<ab>/<digest>.<ext> blob content, ext depends on the codec
+
+    The modification time of a manifest is updated whenever the entry is
+    used, which gives the LRU order used by `gc`.
+
+    With a link mode other than 'off', files are stored uncompressed and
+    placed in the store with as little copying as possible: files from a
+    work directory are renamed into place, and files seeded from elsewhere
+    are reflinked, hardlinked or symlinked (see oacensus.links), falling
+    back to a copy. Linked blobs share storage with their source, so the
+    source files must not be modified in place afterwards.
+    """
+    def __init__(self, cachedir, codec='gzip', link='off'):
+        self.cachedir = cachedir
+        self.codec = codec_for(codec)
+        if not link in LINK_MODES:
+            raise UserFeedback("Unknown cache link mode '%s', should be one of %s" % (link, ", ".join(LINK_MODES)))
+        self.link = link
+        self.placed = {}
+
+    def entries_dir(self):
+        return os.path.join(self.cachedir, 'entries')
+
+    def objects_dir(self):
+        return os.path.join(self.cachedir, 'objects')
+
+    def manifest_path(self, key):
+        return os.path.join(self.entries_dir(), "%s.json" % key)
+
+    def blob_path(self, digest, codec):
+        return os.path.join(self.objects_dir(), digest[0:2], "%s.%s" % (digest, codec.extension))
+
+    def ensure_dir(self, dirpath):
+        try:
+            os.makedirs(dirpath)
+        except OSError:
+            if not os.path.isdir(dirpath):
+                raise
+
+    def has_entry(self, key):
+        return os.path.exists(self.manifest_path(key))
+
+    def keys(self):
+        if not os.path.exists(self.entries_dir()):
+            return []
+        return sorted(f[:-len(".json")] for f in os.listdir(self.entries_dir()) if f.endswith(".json"))
+
+    def manifest(self, key):
+        with open(self.manifest_path(key), 'rb') as f:
+            return json.load(f)
+
+    def content_digest(self, key):
+        """
+        Hash of the paths and content digests of the files in the entry,
+        which changes whenever the entry is replaced with different data.
+        Returns None if there is no entry under key.
+        """
+        if not self.has_entry(key):
+            return None
+        h = hashlib.sha1()
+        for relpath, info in sorted(self.manifest(key)['files'].iteritems()):
+            h.update("%s\0%s\n" % (relpath.encode('utf-8'), info['digest']))
+        return h.hexdigest()
+
+    def touch(self, key):
+        """
+        Marks the entry as recently used.
+        """
+        os.utime(self.manifest_path(key), None)
+
+    def filenames(self, key):
+        """
+        Sorted list of relative paths of files in the entry.
+        """
+        return sorted(self.manifest(key)['files'])
+
+    def open(self, key, filename):
+        """
+        Returns a file-like object which streams the decompressed content of
+        filename in the entry. Raises IOError if there is no such file.
+        """
+        files = self.manifest(key)['files']
+        if not filename in files:
+            raise IOError("No file '%s' in cache entry %s" % (filename, key))
+
+        info = files[filename]
+        codec = CODECS[info['codec']]
+        raw = open(self.blob_path(info['digest'], codec), 'rb')
+        return BlobReader(raw, codec.decompressing_reader(raw))
+
+    def existing_blob(self, digest):
+        """
+        Returns the codec of a stored blob with this digest, or None.
+        """
+        for codec in CODECS.values():
+            if os.path.exists(self.blob_path(digest, codec)):
+                return codec
+
+    def add_file(self, filepath, move=False):
+        """
+        Stores the content of filepath as a blob, unless an identical blob is
+        already stored. Returns (digest, codec, size).
+        """
+        if self.link != 'off':
+            return self.link_file(filepath, move)
+
+        tmpdir = os.path.join(self.objects_dir(), 'tmp')
+        self.ensure_dir(tmpdir)
+
+        h = hashlib.sha1()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmpdir)
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                writer = self.codec.compressing_writer(raw)
+                with open(filepath, 'rb') as f:
+                    while True:
+                        block = f.read(BLOCK_SIZE)
+                        if not block:
+                            break
+                        h.update(block)
+                        size += len(block)
+                        writer.write(block)
+                if writer is not raw:
+                    writer.close()
+
+            digest = h.hexdigest()
+            codec = self.existing_blob(digest)
+            if codec is None:
+                codec = self.codec
+                blob_path = self.blob_path(digest, codec)
+                self.ensure_dir(os.path.dirname(blob_path))
+                os.rename(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return (digest, codec, size)
+
+    def link_file(self, filepath, move=False):
+        """
+        Stores filepath as an uncompressed blob using the store's link mode.
+        """
+        h = hashlib.sha1()
+        size = 0
+        with open(filepath, 'rb') as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                h.update(block)
+                size += len(block)
+
+        digest = h.hexdigest()
+        codec = self.existing_blob(digest)
+        if codec is None:
+            codec = CODECS['none']
+            blob_path = self.blob_path(digest, codec)
+            self.ensure_dir(os.path.dirname(blob_path))
+            strategy = place_file(filepath, blob_path, self.link, move)
+            self.placed[strategy] = self.placed.get(strategy, 0) + 1
+
+        return (digest, codec, size)
+
+    def add_directory(self, key, dirpath, alias=None, move=False):
+        """
+        Creates an entry under key containing every file in dirpath. If move
+        is True the directory is removed afterwards.
+
+        Returns a dict counting how many files were placed by each link
+        strategy, which is empty when the link mode is 'off'.
+        """
+        files = {}
+        self.placed = {}
+        for root, dirs, filenames in os.walk(dirpath):
+            for filename in filenames:
+                filepath = os.path.join(root, filename)
+                relpath = os.path.relpath(filepath, dirpath)
+                digest, codec, size = self.add_file(filepath, move)
+                files[relpath] = {
+                        'digest' : digest,
+                        'codec' : codec.name,
+                        'size' : size
+                        }
+
+        self.write_manifest(key, {
+                'alias' : alias,
+                'created' : time.time(),
+                'files' : files
+                })
+
+        if move:
+            shutil.rmtree(dirpath)
+
+        return self.placed
+
+    def write_manifest(self, key, manifest):
+        self.ensure_dir(self.entries_dir())
+        manifest_path = self.manifest_path(key)
+        with open("%s.tmp" % manifest_path, 'wb') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.rename("%s.tmp" % manifest_path, manifest_path)
+
+    def remove_entry(self, key):
+        """
+        Removes the entry's manifest. Its blobs are removed by the next gc if
+        no other entry refers to them.
+        """
+        if self.has_entry(key):
+            os.remove(self.manifest_path(key))
+
+    def blob_sizes(self):
+        """
+        Dict of (digest, extension) -> size on disk for every stored blob.
+        """
+        sizes = {}
+        if not os.path.exists(self.objects_dir()):
+            return sizes
+
+        for prefix in os.listdir(self.objects_dir()):
+            if prefix == 'tmp':
+                continue
+            prefix_dir = os.path.join(self.objects_dir(), prefix)
+            for filename in os.listdir(prefix_dir):
+                digest, ext = filename.split(".", 1)
+                # lstat, so symlinked blobs count as taking no space.
+                sizes[(digest, ext)] = os.lstat(os.path.join(prefix_dir, filename)).st_size
+        return sizes
+
+    def gc(self, max_size=None, max_age=None):
+        """
+        Removes cache entries which have not been used for max_age seconds,
+        then removes least recently used entries until the blobs referred to
+        by the remaining entries take up at most max_size bytes. Finally
+        removes blobs which no entry refers to.
+
+        Returns a tuple of (entries removed, blobs removed, bytes freed).
+        """
+        now = time.time()
+
+        entries = []
+        for key in self.keys():
+            last_used = os.path.getmtime(self.manifest_path(key))
+            blobs = set(
+                    (info['digest'], CODECS[info['codec']].extension)
+                    for info in self.manifest(key)['files'].values())
+            entries.append((last_used, key, blobs))
+        entries.sort()
+
+        sizes = self.blob_sizes()
+
+        refcounts = {}
+        for _, _, blobs in entries:
+            for blob in blobs:
+                refcounts[blob] = refcounts.get(blob, 0) + 1
+        total = sum(sizes.get(blob, 0) for blob in refcounts)
+
+        removed_entries = 0
+        for last_used, key, blobs in entries:
+            too_old = max_age is not None and now - last_used > max_age
+            too_big = max_size is not None and total > max_size
+            if not (too_old or too_big):
+                continue
+
+            self.remove_entry(key)
+            removed_entries += 1
+            for blob in blobs:
+                refcounts[blob] -= 1
+                if refcounts[blob] == 0:
+                    del refcounts[blob]
+                    total -= sizes.get(blob, 0)
+
+        removed_blobs = 0
+        freed = 0
+        for blob, size in sizes.iteritems():
+            if not blob in refcounts:
+                digest, ext = blob
+                os.remove(os.path.join(self.objects_dir(), digest[0:2], "%s.%s" % blob))
+                removed_blobs += 1
+                freed += size
+
+        tmpdir = os.path.join(self.objects_dir(), 'tmp')
+        if os.path.exists(tmpdir):
+            for filename in os.listdir(tmpdir):
+                tmp_path = os.path.join(tmpdir, filename)
+                if now - os.path.getmtime(tmp_path) > 24 * 60 * 60:
+                    os.remove(tmp_path)
+
+        return (removed_entries, removed_blobs, freed)
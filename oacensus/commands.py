@@ -1,14 +1,30 @@
 from modargs import args
+from oacensus.bench import BenchHistory
+from oacensus.bench import FIXTURES
+from oacensus.bench import fixture_for
+from oacensus.bench import parse_scale
+from oacensus.bench import run_benchmark
+from oacensus.bench import write_fixture
+from oacensus.cache import CacheStore
 from oacensus.db import db
 from oacensus.exceptions import ConfigFileFormatProblem
 from oacensus.exceptions import UserFeedback
-from oacensus.models import create_db_tables
+from oacensus.ledger import RunLedger
+from oacensus.metrics import RunMetrics
+from oacensus.replay import Cassette
+from oacensus.replay import ReplayServer
+from oacensus.replay import replay_url
 from oacensus.report import Report
+from oacensus.runner import Pipeline
 from oacensus.scraper import Scraper
 from oacensus.utils import defaults
+from oacensus.utils import format_size
+from oacensus.utils import parse_duration
+from oacensus.utils import parse_size
 import datetime
 import os
 import sys
+import time
 import yaml
 
 default_cmd = 'help'
@@ -38,6 +54,9 @@ Available commands:
 
   help - Prints this help message or help for individual commands, scrapers or reports.
   list - List all available scrapers and reports.
+  cache - Manage the cache of scraped data.
+  bench - Benchmarks scraper process methods against generated data.
+  replay - Records or replays HTTP exchanges for offline scraping.
   run  - Runs the oacensus tool.
   reports - Runs additional reports using data from the last run.
 
@@ -62,7 +81,7 @@ def help_command(
     if on:
         args.help_command(prog, mod, default_cmd, on)
     elif scraper:
-        if scraper in Scraper.plugins:
+        if Scraper.has_alias(scraper):
             print "%s Scraper" % scraper
             instance = Scraper.create_instance(scraper)
             print_help_for_instance(instance)
@@ -70,7 +89,7 @@ def help_command(
             print "No scraper or report matching alias %s was found." % scraper
             sys.exit(1)
     elif report:
-        if report in Report.plugins:
+        if Report.has_alias(report):
             print "%s Report" % report
             instance = Report.create_instance(report)
             print_help_for_instance(instance)
@@ -102,23 +121,33 @@ def list_command():
     print "Scrapers:"
     print ""
 
-    for scraper in Scraper:
-        print "  ", scraper.alias
+    for alias in Scraper.available_aliases():
+        print "  ", alias
 
     print ""
     print "Reports:"
     print ""
-    for report in Report:
-        print "  ", report.alias
+    for alias in Report.available_aliases():
+        print "  ", alias
 
 def run_command(
+        cachecodec=defaults['cachecodec'], # Compression for newly cached data, 'gzip', 'zstd' or 'none'.
         cachedir=defaults['cachedir'], # Directory to store cached scraped data.
+        cachelink=defaults['cachelink'], # Store uncompressed, linking rather than copying files: 'off', 'auto', 'reflink', 'hardlink', 'symlink' or 'copy'.
+        checkpointdir=defaults['checkpointdir'], # Directory to store db checkpoints for incremental runs.
         config=defaults['config'], # YAML file to read configuration from.
+        dbcache=defaults['dbcache'], # SQLite page cache size while processing, e.g. '64M'.
+        dbcommit=defaults['dbcommit'], # Commit every n statements while processing, 0 for one transaction per scraper.
         dbfile=defaults['dbfile'], # Name of sqlite db file.
+        dbjournal=defaults['dbjournal'], # SQLite journal_mode while processing, e.g. 'wal' or 'delete'.
+        dbsync=defaults['dbsync'], # SQLite synchronous setting while processing, 'off', 'normal' or 'full'.
+        metricsdir=defaults['metricsdir'], # Directory to write JSON metrics for each run to.
         profile=defaults['profile'], # Whether to run in profiler (dev only).
         progress=defaults['progress'], # Whether to show progress indicators.
+        rebuild=defaults['rebuild'], # Whether to discard the existing db and reprocess every scraper.
         reports=defaults['reports'], # Reports to run.
         workdir=defaults['workdir'], # Directory to store temp working directories.
+        workers=defaults['workers'], # Number of scrapers which may scrape at the same time.
         ):
     """
     Runs the oacensus scrapers specified in the configuration file.
@@ -128,6 +157,24 @@ def run_command(
     (using data from the cache if available). Data will be stored in a sqlite3
     database. After data has been processed and stored in the database, reports
     may be run which will present the data.
+
+    Scrape phases for uncached scrapers start straight away in up to `workers`
+    background threads, while process phases run one at a time in config
+    order, each waiting only for its own scrape to finish.
+
+    An existing db file is reused where possible. Only scrapers whose cache or
+    settings have changed since the last run, and the scrapers which follow
+    them in the config, are processed again. Use `--rebuild` to start from an
+    empty db.
+
+    Each process phase runs in a single transaction (or commits every
+    `dbcommit` statements) with the journal mode, synchronous setting and
+    page cache given by `dbjournal`, `dbsync` and `dbcache`. Once all
+    scrapers are processed the db is analyzed and returned to a rollback
+    journal with full synchronous writes.
+
+    Timings, cache hits, request counts and row counts for each scraper and
+    report are written to a JSON file in `metricsdir`.
     """
 
     start_time = datetime.datetime.now()
@@ -138,13 +185,7 @@ def run_command(
     with open(config, 'r') as f:
         conf = yaml.safe_load(f.read())
 
-    if os.path.exists(dbfile):
-        print "removing old db file", dbfile
-        os.remove(dbfile)
-
-    db.init(dbfile)
-    create_db_tables()
-
+    scrapers = []
     for item in conf:
         if isinstance(item, basestring):
             alias = item
@@ -154,24 +195,24 @@ def run_command(
             alias = item.keys()[0]
             settings = item[alias]
 
-            if not alias in Scraper.plugins:
+            if not Scraper.has_alias(alias):
                 msg = "Must define a parent of new alias."
                 assert "parent" in settings, msg
 
                 parent_alias = settings['parent']
                 msg = "Parent %s not found in existing plugins." % parent_alias
-                assert parent_alias in Scraper.plugins, msg
+                assert Scraper.has_alias(parent_alias), msg
 
+                Scraper.load_plugin(parent_alias)
                 parent = Scraper.plugins[parent_alias]
                 class_or_class_name, parent_settings = parent
-                new_settings = parent_settings
+                new_settings = dict(parent_settings)
                 new_settings.update(settings)
                 Scraper.register_plugin(alias, class_or_class_name, new_settings)
 
         else:
             raise Exception("Unexpected type %s" % type(item))
 
-        print "running", alias, "scraper"
         scraper = Scraper.create_instance(alias, locals())
 
         try:
@@ -182,24 +223,49 @@ def run_command(
                 msg += "Correct format is\n- alias\n    key1: value1\n    key2: value2"
                 raise ConfigFileFormatProblem(msg)
 
-        if profile:
-            import cProfile
-            profile_filename = "%s-oacensus.prof" % alias
+        scrapers.append(scraper)
+
+    db.configure_writes(dbjournal, dbsync, parse_size(dbcache), dbcommit)
+    run_metrics = RunMetrics(config)
+    ledger = RunLedger(scrapers, dbfile, checkpointdir)
+    n_unchanged = ledger.prepare(rebuild)
+    for position, scraper in enumerate(scrapers[:n_unchanged]):
+        run_metrics.add_scraper(position, scraper, skipped=True)
+    scrapers = scrapers[n_unchanged:]
+
+    if profile:
+        import cProfile
+        for scraper in scrapers:
+            print "running", scraper.alias, "scraper"
+            profile_filename = "%s-oacensus.prof" % scraper.alias
             print "running scraper with cProfile, writing data to", profile_filename
+            ledger.start(scraper)
             cProfile.runctx("scraper.run()", None, locals(), profile_filename)
-        else:
-            scraper.run()
+            ledger.record(scraper)
+    elif scrapers:
+        print "running scrapers", ", ".join(scraper.alias for scraper in scrapers)
+        Pipeline(scrapers, workers, ledger.record, ledger.start).run()
+
+    ledger.prune_checkpoints()
+    db.finish_writes()
+    for position, scraper in enumerate(scrapers, n_unchanged):
+        run_metrics.add_scraper(position, scraper)
 
     print "scraping completed in", datetime.datetime.now() - start_time
     if reports:
-        run_reports(reports)
+        run_reports(reports, run_metrics)
+
+    print "metrics written to", run_metrics.write(metricsdir)
 
-def run_reports(reports):
+def run_reports(reports, run_metrics=None):
     start_time = datetime.datetime.now()
     for report_alias in reports.split():
         print "running report %s" % report_alias
+        report_start = time.time()
         report = Report.create_instance(report_alias)
         report.run()
+        if run_metrics is not None:
+            run_metrics.add_report(report_alias, time.time() - report_start)
     print "reports completed in", datetime.datetime.now() - start_time
 
 def reports_command(
@@ -211,3 +277,157 @@ def reports_command(
 
     db.init(dbfile)
     run_reports(reports)
+
+def cache_command(
+        cachedir=defaults['cachedir'], # Directory where cached scraped data is stored.
+        gc=False, # Whether to garbage collect the cache.
+        maxage=False, # Remove cache entries unused for longer than this, e.g. '30d' or '12h'.
+        maxsize=False, # Remove least recently used entries until cache is this size, e.g. '20G'.
+        ):
+    """
+    Manage the cache of scraped data.
+
+    Without options, prints a summary of the cache. With `-gc`, removes cache
+    entries which are older than `-maxage` or, least recently used first,
+    until the cache is no larger than `-maxsize`, and then removes stored data
+    which no remaining entry refers to.
+
+    Examples:
+
+    `oacensus cache`
+    `oacensus cache -gc -maxsize 20G -maxage 90d`
+    """
+    store = CacheStore(cachedir)
+
+    if gc:
+        max_size = parse_size(maxsize) if maxsize else None
+        max_age = parse_duration(maxage) if maxage else None
+        entries, blobs, freed = store.gc(max_size, max_age)
+        print "removed %s cache entries and %s blobs, freeing %s" % (entries, blobs, format_size(freed))
+
+    keys = store.keys()
+    total = sum(store.blob_sizes().values())
+    print "%s cache entries using %s in %s" % (len(keys), format_size(total), cachedir)
+
+def bench_command(
+        benchdir=defaults['benchdir'], # Directory to keep benchmark history in.
+        cachecodec=defaults['cachecodec'], # Compression to store fixture data with, 'gzip', 'zstd' or 'none'.
+        fixtures=False, # Write fixture directories here instead of running benchmarks.
+        scales='1k 100k 1M', # Numbers of records to benchmark each scraper at.
+        scrapers=False, # Scrapers to benchmark, defaults to every scraper with a fixture.
+        seed=0, # Seed for generating fixture data.
+        tolerance='0.25', # Flag a regression if slower than the recent median by more than this fraction.
+        ):
+    """
+    Benchmarks scraper process methods without any network access.
+
+    For each scraper and scale, generates data in the format the scraper's
+    scrape method would have cached, then times its process method into an
+    empty db. Results are appended to a history file in `benchdir`, and any
+    benchmark which is slower than the median of its recent runs by more than
+    `tolerance` is reported as a regression, with a non-zero exit status.
+
+    Some fixtures are capped below the largest scales where the real data
+    never gets that big. With `-fixtures`, the generated directories are
+    written out instead, for use with a scraper's `cache` setting.
+
+    Examples:
+
+    `oacensus bench -scales 1k`
+    `oacensus bench -scrapers "pubmed doaj" -scales "1k 100k"`
+    `oacensus bench -fixtures bench-data -scales 1k`
+    """
+    if scrapers:
+        aliases = scrapers.split()
+    else:
+        aliases = sorted(FIXTURES)
+
+    for alias in aliases:
+        fixture_for(alias)
+    sizes = [parse_scale(scale) for scale in str(scales).split()]
+
+    if fixtures:
+        for alias in aliases:
+            for size in sizes:
+                dirpath = os.path.join(fixtures, "%s-%s" % (alias, size))
+                records = write_fixture(alias, dirpath, size, seed)
+                print "wrote %s records to %s" % (records, dirpath)
+        return
+
+    history = BenchHistory(benchdir)
+    opts = dict(defaults)
+    opts['cachecodec'] = cachecodec
+
+    results = []
+    regressions = []
+    for alias in aliases:
+        for size in sizes:
+            print "benchmarking %s at %s records" % (alias, size)
+            result = run_benchmark(alias, size, opts, seed)
+            results.append(result)
+
+            print "%s %s: %s records in %.2fs (%.0f records/s, %.2fs in SQL)" % (
+                    s, alias, result['records'], result['process_seconds'],
+                    result['records_per_second'], result['db_seconds'])
+
+            baseline = history.regression(result, float(tolerance))
+            if baseline is not None:
+                print "%s %s: REGRESSION, median of recent runs was %.2fs" % (s, alias, baseline)
+                regressions.append(result)
+
+    history.append(results)
+    print "results appended to", history.history_path()
+
+    if regressions:
+        print "%s benchmarks regressed" % len(regressions)
+        sys.exit(1)
+
+def replay_command(
+        bandwidth=False, # Limit responses to this many bytes per second, e.g. '512K'.
+        cassette=defaults['cassettedir'], # Directory to record exchanges to and replay them from.
+        errorrate='0', # Fraction of requests to answer with an injected error status.
+        errors='503', # Error statuses to inject, chosen at random.
+        host='localhost', # Host to listen on.
+        latency='0', # Seconds to wait before answering each request.
+        port=8001, # Port to listen on.
+        record=False, # Whether to forward requests upstream and record them.
+        scheme='http', # Scheme to use for upstream requests when recording.
+        seed=0, # Seed for choosing which requests get injected errors.
+        verbose=False, # Whether to log each request.
+        ):
+    """
+    Runs a local HTTP server standing in for the hosts scrapers talk to.
+
+    Point a scraper at the server by prefixing its url settings with the
+    server's address, so `http://www.doaj.org/csv` becomes
+    `http://localhost:8001/www.doaj.org/csv`. With `-record`, requests are
+    forwarded to the real host and each exchange is saved to the cassette
+    directory. Without it, responses are replayed from the cassette and
+    requests which weren't recorded get a 404.
+
+    Latency, bandwidth and error injection make it possible to benchmark
+    batching, concurrency and retry behaviour reproducibly.
+
+    Examples:
+
+    `oacensus replay -record`
+    `oacensus replay -latency 0.2 -bandwidth 1M -errorrate 0.05 -errors "429 503"`
+    """
+    server = ReplayServer(
+            (host, port),
+            Cassette(cassette),
+            record=record,
+            scheme=scheme,
+            latency=float(latency),
+            bandwidth=parse_size(bandwidth) if bandwidth else None,
+            error_rate=float(errorrate),
+            error_statuses=[int(status) for status in str(errors).split()],
+            seed=seed,
+            verbose=verbose)
+
+    if record:
+        print "recording exchanges to", cassette
+    else:
+        print "replaying %s recorded exchanges from %s" % (len(server.cassette.keys()), cassette)
+    print "serving on %s, e.g. %s" % (server.url(), replay_url(server.url(), "http://www.doaj.org/csv"))
+    server.serve_forever()
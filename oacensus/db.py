@@ -1,2 +1,129 @@
+from contextlib import contextmanager
 from peewee import SqliteDatabase
-db = SqliteDatabase(None)
+import os
+import time
+
+class TimedSqliteDatabase(SqliteDatabase):
+    """
+    SqliteDatabase which keeps a running total of the time spent executing
+    SQL statements, including commits in autocommit mode.
+
+    Process phases write through write_session, whose pragmas and commit
+    interval are set for the whole run by configure_writes.
+    """
+    sql_seconds = 0.0
+
+    # Settings for write sessions, see configure_writes.
+    write_journal_mode = 'wal'
+    write_synchronous = 'normal'
+    write_cache_size = 64 * 1024 * 1024
+    write_commit_every = 0
+
+    # The transaction of the write session in progress, if any.
+    write_transaction = None
+    statements_since_commit = 0
+
+    def execute_sql(self, *args, **kwargs):
+        self.commit_chunk_if_due()
+        start = time.time()
+        try:
+            return SqliteDatabase.execute_sql(self, *args, **kwargs)
+        finally:
+            self.sql_seconds += time.time() - start
+
+    def commit(self):
+        start = time.time()
+        try:
+            return SqliteDatabase.commit(self)
+        finally:
+            self.sql_seconds += time.time() - start
+
+    def total_changes(self):
+        """
+        Number of rows inserted, updated or deleted on this connection.
+        """
+        return self.get_conn().total_changes
+
+    def configure_writes(self, journal_mode='wal', synchronous='normal',
+            cache_size=64*1024*1024, commit_every=0):
+        """
+        Sets up subsequent write sessions.
+
+        journal_mode and synchronous are SQLite pragma values, cache_size is
+        the page cache size in bytes. If commit_every is 0 each session is a
+        single transaction, otherwise it commits after every commit_every
+        statements.
+        """
+        self.write_journal_mode = journal_mode
+        self.write_synchronous = synchronous
+        self.write_cache_size = int(cache_size)
+        self.write_commit_every = int(commit_every)
+
+    @contextmanager
+    def write_session(self):
+        """
+        Applies the write pragmas and runs the body in a transaction, which is
+        rolled back if the body raises an exception. The WAL is checkpointed
+        afterwards, so the db file can be copied safely.
+        """
+        if self.write_transaction is not None:
+            yield
+            return
+
+        self.pragma('journal_mode', self.write_journal_mode)
+        self.pragma('synchronous', self.write_synchronous)
+        # A negative cache_size is in KiB rather than pages.
+        self.pragma('cache_size', -(self.write_cache_size // 1024))
+
+        with self.transaction() as txn:
+            self.write_transaction = txn
+            self.statements_since_commit = 0
+            try:
+                yield
+            finally:
+                self.write_transaction = None
+
+        self.checkpoint_wal()
+
+    def commit_chunk_if_due(self):
+        """
+        Commits the write session's transaction and starts another one after
+        every write_commit_every statements. Waits while any nested transaction
+        is open so those stay atomic.
+        """
+        txn = self.write_transaction
+        if txn is None or not self.write_commit_every:
+            return
+
+        self.statements_since_commit += 1
+        if self.statements_since_commit > self.write_commit_every and self.transaction_depth() == 1:
+            self.statements_since_commit = 0
+            txn.commit()
+
+    def checkpoint_wal(self):
+        """
+        Copies any changes held in the write-ahead log into the db file.
+        Does nothing if the db isn't in WAL mode.
+        """
+        self.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def finish_writes(self):
+        """
+        Called once all processing is done. Gathers statistics for the query
+        planner and returns the db file to a rollback journal, so the final
+        db is a single self-contained file.
+        """
+        self.execute_sql('ANALYZE')
+        self.pragma('journal_mode', 'delete')
+        self.pragma('synchronous', 'full')
+
+def remove_db_file(dbfile):
+    """
+    Removes a db file along with any write-ahead log left beside it, which
+    must not be applied to a different file put in its place.
+    """
+    for path in [dbfile, "%s-wal" % dbfile, "%s-shm" % dbfile]:
+        if os.path.exists(path):
+            os.remove(path)
+
+db = TimedSqliteDatabase(None)
@@ -0,0 +1,166 @@
+from oacensus.db import db
+from oacensus.db import remove_db_file
+from oacensus.models import ScraperRun
+from oacensus.models import create_db_tables
+from oacensus.models import row_marks
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+# Chain recorded for a scraper whose process method has started but not
+# finished. It never matches a real chain code, so a rerun restores the db
+# from the checkpoint before that scraper, discarding any rows it committed.
+STARTED = "started"
+
+def chain_codes(scrapers):
+    """
+    For each scraper, returns a hash of its hashcode and the digest of its
+    cached data, and those of all scrapers preceding it in config order.
+    Scrapers whose data isn't cached yet never match a recorded chain.
+    """
+    chains = []
+    h = hashlib.md5()
+    for scraper in scrapers:
+        h.update(scraper.hashcode())
+        h.update(scraper.cache_digest() or "uncached")
+        chains.append(h.hexdigest())
+    return chains
+
+class RunLedger(object):
+    """
+    Tracks which scrapers have already been processed into a db file, so a
+    rerun only reprocesses scrapers whose cache or settings have changed, plus
+    the scrapers downstream of them in config order.
+
+    Each time a scraper is processed a ScraperRun row is written to the db,
+    recording its hashcode, settings and the rows it created, and a checkpoint
+    copy of the db file is saved. A placeholder row is written when processing
+    starts, so a scraper which failed after committing some rows is redone. On a rerun the ledger is compared with the
+    current config and the db is rolled back to the checkpoint taken just
+    before the first scraper which has changed or has always_process set.
+    """
+    def __init__(self, scrapers, dbfile, checkpointdir):
+        self.scrapers = scrapers
+        self.dbfile = dbfile
+
+        dbfile_hash = hashlib.md5(os.path.abspath(dbfile)).hexdigest()
+        self.checkpointdir = os.path.join(checkpointdir, dbfile_hash)
+
+    def checkpoint_path(self, chain):
+        return os.path.join(self.checkpointdir, "%s.sqlite3" % chain)
+
+    def processed_chains(self):
+        """
+        Returns the chain codes recorded in the ledger of the db file, in
+        config order.
+        """
+        db.init(self.dbfile)
+        if not ScraperRun.table_exists():
+            return []
+        runs = ScraperRun.select().order_by(ScraperRun.position)
+        return [run.chain for run in runs]
+
+    def prepare(self, rebuild=False):
+        """
+        Brings the db file to the state it was in after processing the longest
+        unchanged run of leading scrapers, and initializes the db.
+
+        Returns the number of leading scrapers which do not need to be run.
+        """
+        n_unchanged = 0
+        chains = chain_codes(self.scrapers)
+
+        if os.path.exists(self.dbfile) and not rebuild:
+            processed = self.processed_chains()
+            for recorded, current, scraper in zip(processed, chains, self.scrapers):
+                if recorded != current or scraper.always_process:
+                    break
+                n_unchanged += 1
+
+            if n_unchanged < len(processed):
+                # The db holds data from scrapers which have since changed.
+                checkpoint = None
+                if n_unchanged > 0:
+                    checkpoint = self.checkpoint_path(chains[n_unchanged-1])
+
+                if checkpoint and os.path.exists(checkpoint):
+                    print "restoring db from checkpoint after %s scraper" % self.scrapers[n_unchanged-1].alias
+                    db.init(None)
+                    remove_db_file(self.dbfile)
+                    shutil.copyfile(checkpoint, self.dbfile)
+                else:
+                    n_unchanged = 0
+
+        if n_unchanged == 0 and os.path.exists(self.dbfile):
+            print "removing old db file", self.dbfile
+            db.init(None)
+            remove_db_file(self.dbfile)
+
+        db.init(self.dbfile)
+        create_db_tables()
+
+        if n_unchanged > 0:
+            print "reusing processed data from %s unchanged scrapers" % n_unchanged
+            if n_unchanged < len(self.scrapers):
+                self.save_checkpoint(chains[n_unchanged-1])
+
+        return n_unchanged
+
+    def save_checkpoint(self, chain):
+        checkpoint = self.checkpoint_path(chain)
+        if os.path.exists(checkpoint):
+            return
+
+        if not os.path.exists(self.checkpointdir):
+            os.makedirs(self.checkpointdir)
+        db.checkpoint_wal()
+        shutil.copyfile(self.dbfile, "%s.tmp" % checkpoint)
+        os.rename("%s.tmp" % checkpoint, checkpoint)
+
+    def write_entry(self, scraper, chain):
+        position = self.scrapers.index(scraper)
+        ScraperRun.delete().where(ScraperRun.position >= position).execute()
+        ScraperRun.create(
+                position = position,
+                alias = scraper.alias,
+                hashcode = scraper.hashcode(),
+                settings = scraper.hashstring(),
+                chain = chain,
+                row_marks = json.dumps(row_marks()),
+                completed_at = datetime.datetime.now()
+                )
+
+    def start(self, scraper):
+        """
+        Adds a placeholder ledger entry for a scraper whose process method is
+        about to run. Must be called outside the process phase's transaction.
+        """
+        self.write_entry(scraper, STARTED)
+
+    def record(self, scraper):
+        """
+        Adds a ledger entry for a scraper whose process method has just run,
+        and checkpoints the db file unless this is the last scraper.
+        """
+        position = self.scrapers.index(scraper)
+        chain = chain_codes(self.scrapers[:position+1])[-1]
+        self.write_entry(scraper, chain)
+
+        # The db file itself serves as the checkpoint for the last scraper.
+        if position < len(self.scrapers) - 1:
+            self.save_checkpoint(chain)
+
+    def prune_checkpoints(self):
+        """
+        Removes checkpoints which don't correspond to the current config.
+        """
+        if not os.path.exists(self.checkpointdir):
+            return
+
+        keep = set(os.path.basename(self.checkpoint_path(chain))
+                for chain in chain_codes(self.scrapers))
+        for filename in os.listdir(self.checkpointdir):
+            if not filename in keep:
+                os.remove(os.path.join(self.checkpointdir, filename))
@@ -0,0 +1,94 @@
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request code for FICLONE on Linux (btrfs, xfs, ...).
+FICLONE = 0x40049409
+
+LINK_MODES = ['off', 'auto', 'reflink', 'hardlink', 'symlink', 'copy']
+
+def reflink(src, dst):
+    """
+    Make dst a copy-on-write clone of src. Raises OSError or IOError if the
+    filesystem doesn't support it.
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported on this platform")
+
+    with open(src, 'rb') as s:
+        with open(dst, 'wb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except IOError:
+                d.close()
+                os.remove(dst)
+                raise
+
+def hardlink(src, dst):
+    os.link(src, dst)
+
+def symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+def copy(src, dst):
+    shutil.copyfile(src, dst)
+
+STRATEGIES = [
+        ('reflink', reflink),
+        ('hardlink', hardlink),
+        ('symlink', symlink),
+        ('copy', copy)
+        ]
+
+def strategies_for(mode):
+    """
+    The strategies to try, in order, for a link mode. Every mode falls back
+    to copying.
+    """
+    if mode == 'auto':
+        return STRATEGIES
+    else:
+        return [(name, fn) for name, fn in STRATEGIES if name in (mode, 'copy')]
+
+def place_file(src, dst, mode='auto', move=False):
+    """
+    Makes the content of src available at dst using as little I/O as
+    possible. If move is True, src may be consumed and an atomic rename is
+    tried first, which only works within a filesystem. Otherwise the
+    strategies for mode are tried in turn.
+
+    dst is written via a temporary name so it never exists half-written.
+    Returns the name of the strategy which succeeded.
+    """
+    tmp = "%s.tmp-%s" % (dst, os.getpid())
+
+    if move:
+        try:
+            os.rename(src, dst)
+            return 'rename'
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    for name, strategy in strategies_for(mode):
+        if name == 'symlink' and move:
+            # The source is about to be removed, a symlink would dangle.
+            continue
+        try:
+            strategy(src, tmp)
+        except (OSError, IOError):
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            if name == 'copy':
+                raise
+            continue
+
+        os.rename(tmp, dst)
+        if move:
+            os.remove(src)
+        return name
@@ -1,17 +1,29 @@
-import oacensus.scrapers.biomedcentral
-import oacensus.scrapers.crossref
-import oacensus.scrapers.doaj
-import oacensus.scrapers.doilist
-import oacensus.scrapers.elsevier
-import oacensus.scrapers.oag
-import oacensus.scrapers.oai
-import oacensus.scrapers.orcids
-import oacensus.scrapers.pubmed
-import oacensus.scrapers.scimago
-import oacensus.scrapers.wiley
-import oacensus.scrapers.rcukgtr
-import oacensus.scrapers.csvfile
+from oacensus.report import Report
+from oacensus.scraper import Scraper
 
-import oacensus.reports.excel_dump
-import oacensus.reports.personal_openness
-import oacensus.reports.institution
+# Modules are only imported when a plugin is first used, so commands which
+# don't need a plugin don't pay for importing its dependencies.
+
+Scraper.register_lazy_plugins({
+    'biomed' : 'oacensus.scrapers.biomedcentral:BiomedCentralJournals',
+    'crossref' : 'oacensus.scrapers.crossref:Crossref',
+    'crossrefjournals' : 'oacensus.scrapers.crossref:CrossrefJournals',
+    'csvfile' : 'oacensus.scrapers.csvfile:CSVFile',
+    'doaj' : 'oacensus.scrapers.doaj:DoajJournals',
+    'doilist' : 'oacensus.scrapers.doilist:DOIList',
+    'elsevier' : 'oacensus.scrapers.elsevier:ElsevierJournals',
+    'gtr' : 'oacensus.scrapers.rcukgtr:GTR',
+    'oag' : 'oacensus.scrapers.oag:OAG',
+    'oai' : 'oacensus.scrapers.oai:OAIPMH',
+    'orcid' : 'oacensus.scrapers.orcids:Orcid',
+    'pubmed' : 'oacensus.scrapers.pubmed:Pubmed',
+    'rcuk' : 'oacensus.scrapers.rcukgtr:GTR',
+    'scimago' : 'oacensus.scrapers.scimago:ScimagoJournals',
+    'wiley' : 'oacensus.scrapers.wiley:WileyScraper'
+    })
+
+Report.register_lazy_plugins({
+    'excel' : 'oacensus.reports.excel_dump:ExcelDump',
+    'institution' : 'oacensus.reports.institution:InstitutionalReport',
+    'personal-openness' : 'oacensus.reports.personal_openness:PersonalOpenness'
+    })
@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class LookupCache(object):
+    """
+    Persistent store of the results of looking up individual keys, such as
+    DOIs, with a remote service, so each key is only looked up again once its
+    result is older than ttl seconds (or never, if ttl is None).
+
+    Results are stored as JSON in their own sqlite file rather than in the
+    oacensus db, so they survive --rebuild and rollbacks to a checkpoint. A
+    result of None records that the service had nothing for that key.
+    """
+    # Keys per query, below SQLite's limit on bound parameters.
+    chunk_size = 500
+
+    def __init__(self, path, ttl=None):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS lookups (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            fetched REAL)""")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        Returns a dict of the fresh results held for any of keys.
+        """
+        keys = list(keys)
+        oldest = 0 if self.ttl is None else time.time() - self.ttl
+        results = {}
+        with self.lock:
+            for i in range(0, len(keys), self.chunk_size):
+                chunk = keys[i:i+self.chunk_size]
+                sql = "SELECT key, value FROM lookups WHERE fetched >= ? AND key IN (%s)"
+                rows = self.conn.execute(sql % ",".join("?" * len(chunk)), [oldest] + chunk)
+                for key, value in rows:
+                    results[key] = json.loads(value)
+        return results
+
+    def missing(self, keys):
+        """
+        Returns those of keys which have no fresh result, in order.
+        """
+        keys = list(keys)
+        found = self.get_many(keys)
+        return [key for key in keys if not key in found]
+
+    def put_many(self, results):
+        """
+        Stores a dict of results, replacing any older results for those keys.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                    "INSERT OR REPLACE INTO lookups (key, value, fetched) VALUES (?, ?, ?)",
+                    [(key, json.dumps(value), now) for key, value in results.iteritems()])
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM lookups").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,175 @@
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+from oacensus.utils import normalize_doi
+import difflib
+import re
+import threading
+import unicodedata
+
+try:
+    import jellyfish
+except ImportError:
+    jellyfish = None
+
+DOI_PATTERN = re.compile("(10\\.\\d{4,9}/\\S+)")
+HANDLE_PATTERN = re.compile("(?:hdl\\.handle\\.net/|^hdl:)(\\S+)", re.IGNORECASE)
+
+# Words too common to tell titles apart, never used as blocking keys.
+STOPWORDS = frozenset("""
+a an and are as at by for from in into is of on or the to with
+""".split())
+
+def normalize_title(title):
+    """
+    Lower case title with accents, punctuation and repeated whitespace
+    removed, so trivially different renderings of a title compare equal.
+    """
+    if not isinstance(title, unicode):
+        title = title.decode('utf-8', 'replace')
+    title = unicodedata.normalize('NFKD', title)
+    title = u"".join(c for c in title if not unicodedata.combining(c))
+    return u" ".join(re.findall(u"\\w+", title.lower(), re.UNICODE))
+
+def title_tokens(normalized_title):
+    """
+    Set of the words in a normalized title which are worth blocking on.
+    """
+    return set(token for token in normalized_title.split()
+            if len(token) > 1 and not token in STOPWORDS)
+
+def find_dois(text):
+    """
+    Normalized DOIs appearing in text, such as a dc:identifier value.
+    """
+    return [normalize_doi(doi.rstrip(".,;)")) for doi in DOI_PATTERN.findall(text)]
+
+def find_handle(text):
+    """
+    Lower case handle in a hdl.handle.net URL or 'hdl:' identifier, or None.
+    """
+    match = HANDLE_PATTERN.search(text.strip())
+    if match:
+        return match.group(1).lower()
+
+def title_similarity(a, b):
+    """
+    Jaro-Winkler similarity of two normalized titles, from 0 to 1. Falls
+    back to difflib's ratio if jellyfish isn't installed.
+    """
+    if jellyfish is not None:
+        return jellyfish.jaro_winkler(a, b)
+    else:
+        return difflib.SequenceMatcher(None, a, b).ratio()
+
+class TitleMatcher(object):
+    """
+    Finds the article whose title best matches a given title.
+
+    Articles are indexed by title token, and a title is only compared with
+    the articles sharing at least two of its tokens (or its only token), so
+    the number of comparisons grows with the size of the blocks rather than
+    the number of articles. Tokens found in more than max_block_size titles
+    aren't used as blocking keys.
+    """
+    # Most candidates scored per title, those sharing most tokens first.
+    max_candidates = 100
+
+    def __init__(self, articles, threshold=0.9, max_block_size=1000):
+        """
+        articles is a list of (article id, title) tuples.
+        """
+        self.threshold = threshold
+        self.titles = {}
+        self.blocks = {}
+        for article_id, title in articles:
+            normalized = normalize_title(title)
+            self.titles[article_id] = normalized
+            for token in title_tokens(normalized):
+                self.blocks.setdefault(token, []).append(article_id)
+
+        for token in [t for t, ids in self.blocks.iteritems() if len(ids) > max_block_size]:
+            del self.blocks[token]
+
+    def candidates(self, normalized_title):
+        """
+        Ids of articles sharing enough blocking tokens with the title.
+        """
+        shared = {}
+        tokens = [t for t in title_tokens(normalized_title) if t in self.blocks]
+        for token in tokens:
+            for article_id in self.blocks[token]:
+                shared[article_id] = shared.get(article_id, 0) + 1
+
+        required = min(2, len(tokens))
+        ranked = sorted((n, article_id) for article_id, n in shared.iteritems() if n >= required)
+        return [article_id for n, article_id in reversed(ranked[-self.max_candidates:])]
+
+    def best_match(self, title):
+        """
+        Returns (article id, score) for the closest article title scoring at
+        least threshold, or None.
+        """
+        normalized = normalize_title(title)
+        best = None
+        for article_id in self.candidates(normalized):
+            candidate = self.titles[article_id]
+            if 2 * min(len(candidate), len(normalized)) < max(len(candidate), len(normalized)):
+                continue
+            score = title_similarity(normalized, candidate)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (article_id, score)
+        return best
+
+    def match_chunk(self, records):
+        """
+        Matches a list of (key, title) tuples, returning (key, article id,
+        score) tuples for those which matched.
+        """
+        matches = []
+        for key, title in records:
+            best = self.best_match(title)
+            if best is not None:
+                matches.append((key,) + best)
+        return matches
+
+    def match_all(self, records, processes=0, chunk_size=1000):
+        """
+        Matches a list of (key, title) tuples in chunks spread over processes
+        worker processes, or one per core if processes is 0. Yields lists of
+        (key, article id, score) tuples as each chunk finishes.
+
+        Worker processes are forked, and a fork only copies the calling
+        thread, so locks held by any other thread (such as the scrape
+        threads of a run_command pipeline) would stay locked in the workers.
+        Chunks are matched in this process instead while other threads are
+        running. Workers never use the db connection they inherit, so an open
+        write transaction is unaffected.
+        """
+        chunks = [records[i:i+chunk_size] for i in range(0, len(records), chunk_size)]
+        processes = min(processes or cpu_count(), len(chunks))
+        if processes > 1 and threading.active_count() > 1:
+            print "  other threads are running, matching titles in a single process"
+            processes = 1
+        if processes <= 1:
+            for chunk in chunks:
+                yield self.match_chunk(chunk)
+            return
+
+        pool = Pool(processes, initializer=_init_worker, initargs=(self,))
+        try:
+            for matches in pool.imap_unordered(_match_chunk, chunks):
+                yield matches
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+# The TitleMatcher used by each worker process in TitleMatcher.match_all.
+_worker_matcher = None
+
+def _init_worker(matcher):
+    global _worker_matcher
+    _worker_matcher = matcher
+
+def _match_chunk(records):
+    return _worker_matcher.match_chunk(records)
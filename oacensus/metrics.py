@@ -0,0 +1,97 @@
+from oacensus.db import db
+from oacensus.models import row_marks
+import datetime
+import json
+import os
+import time
+
+def directory_size(dirpath):
+    total = 0
+    for root, dirs, filenames in os.walk(dirpath):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total
+
+def rows_inserted(before, after):
+    """
+    Number of rows added between two row_marks() snapshots.
+    """
+    return sum((after[table] or 0) - (before[table] or 0) for table in after)
+
+class ProcessMetrics(object):
+    """
+    Context manager which measures a process phase and stores wall time,
+    rows inserted and updated and time spent in SQL in a metrics dict.
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __enter__(self):
+        self.start = time.time()
+        self.sql_seconds = db.sql_seconds
+        self.total_changes = db.total_changes()
+        self.row_marks = row_marks()
+        return self
+
+    def __exit__(self, *args):
+        inserted = rows_inserted(self.row_marks, row_marks())
+        changes = db.total_changes() - self.total_changes
+        self.metrics.update({
+            'process_seconds' : time.time() - self.start,
+            'rows_inserted' : inserted,
+            'rows_updated' : max(0, changes - inserted),
+            'db_seconds' : db.sql_seconds - self.sql_seconds
+            })
+
+class RunMetrics(object):
+    """
+    Collects per-stage timings for a run and writes them as a JSON report.
+
+    Each scraper contributes the metrics dict filled in by Scraper.run: cache
+    hit or miss, scrape wall time, bytes written to the work dir by the
+    scrape, number of HTTP requests and time spent waiting on rate limits,
+    then process wall time, rows inserted and updated and time spent in SQL.
+    Reports contribute render times.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.started = datetime.datetime.now()
+        self.scrapers = []
+        self.reports = []
+
+    def add_scraper(self, position, scraper, skipped=False):
+        info = {
+                'position' : position,
+                'alias' : scraper.alias,
+                'hashcode' : scraper.hashcode(),
+                'skipped' : skipped
+                }
+        info.update(scraper.metrics)
+        self.scrapers.append(info)
+
+    def add_report(self, alias, seconds):
+        self.reports.append({'alias' : alias, 'render_seconds' : seconds})
+
+    def as_dict(self):
+        return {
+                'config' : self.config,
+                'started' : self.started.isoformat(),
+                'total_seconds' : (datetime.datetime.now() - self.started).total_seconds(),
+                'scrapers' : self.scrapers,
+                'reports' : self.reports
+                }
+
+    def write(self, metricsdir):
+        """
+        Writes the report to a timestamped file in metricsdir, and returns
+        the path of the file.
+        """
+        if not os.path.exists(metricsdir):
+            os.makedirs(metricsdir)
+
+        # Microseconds and the pid keep runs started close together apart.
+        filename = "run-%s-%s.json" % (self.started.strftime("%Y%m%d-%H%M%S-%f"), os.getpid())
+        filepath = os.path.join(metricsdir, filename)
+        with open(filepath, 'wb') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+        return filepath
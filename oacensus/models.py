@@ -1,8 +1,51 @@
 from peewee import *
+from itertools import islice
 import sqlite3
 
 from oacensus.db import db
 
+# SQLite builds before 3.32 allow at most 999 bound parameters per statement.
+SQLITE_MAX_VARIABLES = 999
+
+# Number of articles buffered by ArticleList.add_articles before each flush.
+BULK_CHUNK_SIZE = 1000
+
+def insert_rows(model, rows, ignore_duplicates=False):
+    """
+    Inserts rows, a list of dicts of field values, using as few multi-row
+    INSERT statements as the SQLite parameter limit allows, in a single
+    transaction. Returns the ids of the new rows in order.
+
+    If ignore_duplicates is set, rows which would violate a unique index are
+    skipped and no ids are returned.
+    """
+    defaults = dict((f.name, f.default) for f in model._meta.sorted_fields
+            if f is not model._meta.primary_key)
+    per_statement = max(1, SQLITE_MAX_VARIABLES // len(defaults))
+
+    ids = []
+    with db.transaction():
+        for i in range(0, len(rows), per_statement):
+            batch = []
+            for row in rows[i:i+per_statement]:
+                values = defaults.copy()
+                values.update(row)
+                batch.append(values)
+
+            if ignore_duplicates:
+                model.insert_many(batch).on_conflict('IGNORE').execute()
+                continue
+
+            # SQLite gives each new row one more than the highest rowid in
+            # the table, so rows inserted by one statement get consecutive
+            # ids following the current maximum.
+            first_id = (model.select(fn.Max(model.id)).scalar() or 0) + 1
+            model.insert_many(batch).execute()
+            ids.extend(range(first_id, first_id + len(batch)))
+
+    if not ignore_duplicates:
+        return ids
+
 class ModelBase(Model):
     def truncate_title(self, length=40):
         if len(self.title) < length:
@@ -13,21 +56,93 @@ class ModelBase(Model):
     class Meta:
         database = db
 
+class IdentityMap(object):
+    """
+    Base for run-scoped maps which keep one object per row in memory, so
+    rows that many records refer to are looked up once.
+
+    Use a map as a context manager. It is loaded when the outermost context
+    is entered and cleared when it exits, after flushing any pending
+    changes unless there was an exception.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.clear()
+
+    def __enter__(self):
+        self.depth += 1
+        if self.depth == 1:
+            self.load()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                if exc_type is None:
+                    self.flush()
+            finally:
+                self.clear()
+
+    def is_open(self):
+        return self.depth > 0
+
+    def load(self):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def flush(self):
+        pass
+
 class Publisher(ModelBase):
-    name = CharField()
+    name = CharField(unique=True)
 
     def __unicode__(self):
         return u"<Publisher {0}: {1}>".format(self.id, self.name)
 
     @classmethod
     def create_or_update_by_name(cls, name):
-        try:
-            publisher = cls.get(cls.name == name)
-        except Publisher.DoesNotExist:
+        publisher = cls.by_name(name)
+        if publisher is None:
             publisher = Publisher.create(name = name)
+            publisher_map.add(publisher)
 
         return publisher
 
+    @classmethod
+    def by_name(cls, name):
+        if publisher_map.is_open():
+            return publisher_map.get(name)
+
+        try:
+            return cls.get(cls.name == name)
+        except Publisher.DoesNotExist:
+            pass
+
+class PublisherNameMap(IdentityMap):
+    """
+    Run-scoped map from name to Publisher, loaded in one query, which
+    Publisher.by_name and Publisher.create_or_update_by_name go through
+    while it is open.
+    """
+    def load(self):
+        for publisher in Publisher.select():
+            self.add(publisher)
+
+    def clear(self):
+        self.names = {}
+
+    def get(self, name):
+        return self.names.get(name)
+
+    def add(self, publisher):
+        if self.is_open():
+            self.names[publisher.name] = publisher
+
+publisher_map = PublisherNameMap()
+
 class Journal(ModelBase):
     title = CharField(index=True,
         help_text="Name of journal.")
@@ -39,7 +154,7 @@ class Journal(ModelBase):
         help_text="Which scraper populated basic journal information?")
     issn = CharField(null=True, unique=True,
         help_text="ISSN of journal.")
-    eissn = CharField(null=True,
+    eissn = CharField(null=True, index=True,
         help_text="Electronic ISSN (EISSN) of journal.")
     doi = CharField(null=True,
         help_text="DOI for journal.")
@@ -63,7 +178,7 @@ class Journal(ModelBase):
     iso_abbreviation = CharField(null=True)
     medline_ta = CharField(null=True)
     nlm_unique_id = CharField(null=True)
-    issn_linking = CharField(null=True)
+    issn_linking = CharField(null=True, index=True)
 
     def __unicode__(self):
         return u"<Journal {0} [{1}]: {2}>".format(self.id, self.issn, self.truncate_title())
@@ -73,28 +188,93 @@ class Journal(ModelBase):
 
     @classmethod
     def create_or_update_by_issn(cls, args):
-        try:
-            journal = cls.get(cls.issn == args['issn'])
-            for k, v in args.iteritems():
-                if k != 'source':
-                    setattr(journal, k, v)
-            journal.save()
-        except Journal.DoesNotExist:
+        journal = cls.by_issn(args['issn'])
+        if journal is None:
             journal = Journal.create(**args)
+            journal_map.add(journal)
+        else:
+            changed = [k for k, v in args.iteritems()
+                    if not k in ('issn', 'source') and getattr(journal, k) != v]
+            for k in changed:
+                setattr(journal, k, args[k])
+            if changed:
+                journal_map.save(journal)
 
         return journal
 
     @classmethod
     def by_issn(cls, issn):
-        try:
-            return cls.get(cls.issn == issn)
-        except Journal.DoesNotExist:
-            pass
+        """
+        Returns the journal with this ISSN, or failing that this EISSN.
+        """
+        if journal_map.is_open():
+            return journal_map.get(issn)
+
+        for field in (cls.issn, cls.eissn):
+            try:
+                return cls.get(field == issn)
+            except Journal.DoesNotExist:
+                pass
+
+class JournalIdentityMap(IdentityMap):
+    """
+    Run-scoped map from ISSN and EISSN to Journal objects, so each journal is
+    looked up once and written once however many rows refer to it.
+
+    While the map is open, Journal.by_issn and Journal.create_or_update_by_issn
+    go through it. All journals are loaded in one query when it is opened, and
+    changes to existing journals are kept until it is closed and then saved
+    in a single transaction. Scraper.run_process keeps the map open around
+    each process phase.
+    """
+    def load(self):
+        for journal in Journal.select():
+            self.add(journal)
+
+    def clear(self):
+        self.issns = {}
+        self.eissns = {}
+        self.dirty = {}
+
+    def get(self, issn):
+        return self.issns.get(issn) or self.eissns.get(issn)
+
+    def add(self, journal):
+        """
+        Makes a journal which has just been loaded or created findable.
+        """
+        if not self.is_open():
+            return
+        if journal.issn is not None:
+            self.issns[journal.issn] = journal
+        if journal.eissn is not None:
+            self.eissns.setdefault(journal.eissn, journal)
+
+    def save(self, journal):
+        """
+        Saves changes to a journal, straight away if the map is closed.
+        """
+        if not self.is_open():
+            journal.save()
+            return
+        self.add(journal)
+        self.dirty[journal.id] = journal
+
+    def flush(self):
+        """
+        Writes all changed journals to the db.
+        """
+        with db.transaction():
+            for journal_id in sorted(self.dirty):
+                self.dirty[journal_id].save()
+        self.dirty = {}
+
+journal_map = JournalIdentityMap()
 
 class Article(ModelBase):
     title = CharField(
         help_text="Title of article.")
-    doi = CharField(null=True,
+    doi = CharField(null=True, index=True,
         help_text="Digital object identifier for article.")
     date_published = DateField(null=True,
         help_text="Date on which article was published.")
@@ -104,9 +284,9 @@ class Article(ModelBase):
     url = CharField(null=True,
         help_text="Web page for article information (and maybe content).")
 
-    pubmed_id = CharField(null=True)
+    pubmed_id = CharField(null=True, index=True)
     nihm_id = CharField(null=True)
-    pmc_id = CharField(null=True)
+    pmc_id = CharField(null=True, index=True)
 
     free_to_read = BooleanField(null=True,
             help_text="Is article 'free to read' as per CrossRef?")
@@ -118,6 +298,11 @@ class Article(ModelBase):
         return u'{0}'.format(self.truncate_title())
 
     def is_open_access(self):
+        """
+        The article's own open access status if known, otherwise its
+        journal's. Fetches the journal if it wasn't joined in, use
+        ArticleOpenAccess to classify many articles at once.
+        """
         if self.open_access is not None:
             return self.open_access
         elif self.journal is not None:
@@ -125,6 +310,20 @@ class Article(ModelBase):
         else:
             return None
 
+    @classmethod
+    def select_with_open_access(cls):
+        """
+        Select of articles with their effective open access status and its
+        source from the article_open_access view, set as the attributes
+        effective_open_access and effective_open_access_source.
+        """
+        return (cls
+                .select(cls,
+                    ArticleOpenAccess.open_access.alias('effective_open_access'),
+                    ArticleOpenAccess.open_access_source.alias('effective_open_access_source'))
+                .join(ArticleOpenAccess, on=(ArticleOpenAccess.article == cls.id))
+                .naive())
+
     @classmethod
     def create_or_update_by_doi(cls, args):
         try:
@@ -137,62 +336,365 @@ class Article(ModelBase):
 
         return article
 
+    @classmethod
+    def bulk_create(cls, rows):
+        """
+        Creates articles from a list of dicts of field values, returns their ids.
+        """
+        return insert_rows(cls, rows)
+
+class ArticleOpenAccess(ModelBase):
+    """
+    Read-only model over the article_open_access view, which resolves each
+    article's effective open access status in SQL the same way as
+    Article.is_open_access, so reports can filter and count on it in one
+    query.
+    """
+    article = ForeignKeyField(Article, primary_key=True, related_name="open_access_status")
+    open_access = BooleanField(null=True,
+            help_text="Article's open access value if set, otherwise its journal's.")
+    open_access_source = CharField(null=True,
+            help_text="Source of the open access value used.")
+
+    class Meta:
+        db_table = 'article_open_access'
+
+def query_item(query, key):
+    """
+    Indexes or slices query results like a list, fetching only the rows
+    needed with LIMIT and OFFSET.
+    """
+    if isinstance(key, slice):
+        start, stop = key.start or 0, key.stop
+        if key.step in (None, 1) and start >= 0 and (stop is None or stop >= 0):
+            if stop is not None:
+                query = query.limit(max(0, stop - start))
+            return list(query.offset(start))
+
+        # Negative bounds and steps need the length, then the rows spanned.
+        indices = range(*key.indices(query.count()))
+        if not indices:
+            return []
+        first = min(indices)
+        rows = list(query.limit(max(indices) - first + 1).offset(first))
+        return [rows[i - first] for i in indices]
+    if key < 0:
+        key += query.count()
+    results = list(query.limit(1).offset(key)) if key >= 0 else []
+    if not results:
+        raise IndexError(key)
+    return results[0]
+
 class JournalList(ModelBase):
     name = CharField()
 
     def __unicode__(self):
-        args = (len(self.journals()), self.name)
+        args = (self.count(), self.name)
         return u"<Journal List {0}: {1}>".format(*args)
 
     def __len__(self):
-        return self.memberships.count()
+        return self.count()
 
     def __getitem__(self, key):
-        return self.memberships[key].journal
+        return query_item(self.journals_query(), key)
+
+    def __iter__(self):
+        return self.iter_journals()
+
+    def count(self):
+        """
+        Number of journals in the list, counted in SQL.
+        """
+        return self.memberships.count()
+
+    def journals_query(self):
+        """
+        Query for the journals in the list in the order they were added, with
+        their publishers joined in.
+        """
+        return (Journal
+                .select(Journal, Publisher)
+                .join(JournalListMembership)
+                .switch(Journal)
+                .join(Publisher, JOIN.LEFT_OUTER)
+                .where(JournalListMembership.journal_list == self)
+                .order_by(JournalListMembership.id))
+
+    def iter_journals(self):
+        """
+        Iterates over the journals in the list without caching them all.
+        """
+        return self.journals_query().iterator()
 
     def add_journal(self, journal):
-        JournalListMembership(
+        JournalListMembership.insert(
             journal_list = self,
-            journal = journal).save()
+            journal = journal).on_conflict('IGNORE').execute()
 
     def journals(self):
-        return [membership.journal for membership in self.memberships]
+        return list(self.journals_query())
 
 class JournalListMembership(ModelBase):
     journal_list = ForeignKeyField(JournalList, related_name="memberships")
     journal = ForeignKeyField(Journal, related_name="memberships")
 
+    class Meta:
+        indexes = (
+                (('journal_list', 'journal'), True),
+                )
+
 class ArticleList(ModelBase):
     name = CharField()
     orcid = CharField(null=True)
 
     def __unicode__(self):
-        args = (len(self.articles()), self.name)
+        args = (self.count(), self.name)
         return u"<Article List ({0} articles): {1}>".format(*args)
 
     def __len__(self):
-        return self.memberships.count()
+        return self.count()
 
     def __getitem__(self, key):
-        return self.memberships[key].article
+        return query_item(self.articles_query(), key)
+
+    def __iter__(self):
+        return self.iter_articles()
+
+    def count(self):
+        """
+        Number of articles in the list, counted in SQL.
+        """
+        return self.memberships.count()
+
+    def articles_query(self):
+        """
+        Query for the articles in the list in the order they were added, with
+        their journals joined in.
+        """
+        return (Article
+                .select(Article, Journal)
+                .join(ArticleListMembership)
+                .switch(Article)
+                .join(Journal, JOIN.LEFT_OUTER)
+                .where(ArticleListMembership.article_list == self)
+                .order_by(ArticleListMembership.id))
+
+    def iter_articles(self):
+        """
+        Iterates over the articles in the list without caching them all.
+        """
+        return self.articles_query().iterator()
 
     def add_article(self, article):
         ArticleListMembership(
             article_list = self,
             article = article).save()
 
+    def add_articles(self, articles, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Adds articles to the list, creating them first where they are given
+        as dicts of field values rather than saved Article objects.
+
+        articles may be a generator, it is consumed chunk_size items at a
+        time and each chunk is written in a single transaction along with
+        anything the generator itself writes while producing it.
+        """
+        articles = iter(articles)
+        added = 0
+        while True:
+            with db.transaction():
+                chunk = list(islice(articles, chunk_size))
+                if not chunk:
+                    break
+
+                new_rows = []
+                for article in chunk:
+                    if isinstance(article, Article) and article.id is None:
+                        article.save()
+                    if not isinstance(article, Article):
+                        new_rows.append(article)
+
+                new_ids = iter(Article.bulk_create(new_rows))
+                article_ids = [article.id if isinstance(article, Article) else new_ids.next()
+                        for article in chunk]
+
+                insert_rows(ArticleListMembership, [
+                    { 'article_list' : self.id, 'article' : article_id }
+                    for article_id in article_ids], ignore_duplicates=True)
+                added += len(chunk)
+
+        return added
+
     def articles(self):
-        return [membership.article for membership in self.memberships]
+        return list(self.articles_query())
 
 class ArticleListMembership(ModelBase):
     article_list = ForeignKeyField(ArticleList, related_name="memberships")
     article = ForeignKeyField(Article, related_name="memberships")
 
+    class Meta:
+        indexes = (
+                (('article_list', 'article'), True),
+                )
+
+class RepositoryLink(ModelBase):
+    """
+    Link between an article and a record in an institutional repository
+    which holds a copy of it.
+    """
+    article = ForeignKeyField(Article, related_name="repository_links")
+    repository = CharField(
+        help_text="Base url of the repository's OAI-PMH interface.")
+    record = CharField(
+        help_text="OAI identifier of the repository record.")
+    url = CharField(null=True,
+        help_text="Web page for the record in the repository.")
+    license = CharField(null=True,
+        help_text="Rights statement of the record.")
+    match_method = CharField(
+        help_text="How the record was matched to the article: 'doi', 'handle' or 'title'.")
+    score = FloatField(null=True,
+        help_text="Title similarity for title matches.")
+    source = CharField()
+
+    class Meta:
+        indexes = (
+                (('article', 'record'), True),
+                )
+
+class ScraperRun(ModelBase):
+    """
+    Ledger entry recording that a scraper's process method has been applied
+    to this db.
+    """
+    position = IntegerField(
+        help_text="Position of scraper in config file.")
+    alias = CharField(
+        help_text="Alias of scraper.")
+    hashcode = CharField(
+        help_text="Scraper hashcode identifying the cached data which was processed.")
+    settings = TextField(
+        help_text="Scraper hashstring of the settings which were used.")
+    chain = CharField(
+        help_text="Hash of this and all preceding scraper hashcodes in config order.")
+    row_marks = TextField(
+        help_text="JSON dict of highest row id in each table after processing.")
+    completed_at = DateTimeField(
+        help_text="When processing finished.")
+
+    def __unicode__(self):
+        return u"<ScraperRun {0}: {1} [{2}]>".format(self.position, self.alias, self.hashcode)
+
+def data_models():
+    """
+    Models holding scraped data, as opposed to bookkeeping.
+    """
+    return [
+            Article,
+            ArticleList,
+            ArticleListMembership,
+            Journal,
+            JournalList,
+            JournalListMembership,
+            Publisher,
+            RepositoryLink
+            ]
+
+def row_marks():
+    """
+    Returns a dict of the highest row id currently in each data table.
+    """
+    return dict(
+            (model._meta.db_table, model.select(fn.Max(model.id)).scalar())
+            for model in data_models())
+
 def create_db_tables():
-    Article.create_table()
-    ArticleList.create_table()
-    ArticleListMembership.create_table()
-    Journal.create_table()
-    JournalList.create_table()
-    JournalListMembership.create_table()
-    Publisher.create_table()
+    """
+    Creates any missing tables, then migrates tables created by older
+    versions of oacensus.
+    """
+    for model in data_models() + [ScraperRun]:
+        model.create_table(True)
+    migrate_db()
+
+def remove_duplicate_rows(model, fields):
+    """
+    Deletes all but the first row in each group of rows with equal values in
+    fields.
+    """
+    keep = model.select(fn.Min(model.id)).group_by(*fields)
+    return model.delete().where(~(model.id << keep)).execute()
+
+def merge_duplicate_publishers():
+    """
+    Points journals at the first of each set of publishers with the same
+    name, and deletes the others.
+    """
+    first_ids = dict(Publisher
+            .select(Publisher.name, fn.Min(Publisher.id))
+            .group_by(Publisher.name)
+            .tuples())
+    for publisher_id, name in Publisher.select(Publisher.id, Publisher.name).tuples():
+        if publisher_id != first_ids[name]:
+            Journal.update(publisher = first_ids[name]).where(Journal.publisher == publisher_id).execute()
+            Publisher.delete().where(Publisher.id == publisher_id).execute()
+
+def create_missing_indexes():
+    """
+    Creates each index declared on a model which its table doesn't have.
+    """
+    compiler = db.compiler()
+    for model in data_models() + [ScraperRun]:
+        table = model._meta.db_table
+        existing = set(index.name for index in db.get_indexes(table))
+        for fields, unique in model._index_data():
+            fields = [model._meta.fields[f] if isinstance(f, basestring) else f
+                    for f in fields]
+            if not compiler.index_name(table, [f.db_column for f in fields]) in existing:
+                db.create_index(model, fields, unique)
+
+def migrate_to_identifier_indexes():
+    """
+    Adds indexes on identifier columns and unique indexes on publisher names
+    and list memberships.
+    """
+    remove_duplicate_rows(ArticleListMembership,
+            [ArticleListMembership.article_list, ArticleListMembership.article])
+    remove_duplicate_rows(JournalListMembership,
+            [JournalListMembership.journal_list, JournalListMembership.journal])
+    merge_duplicate_publishers()
+    create_missing_indexes()
+
+def create_open_access_view():
+    """
+    Creates the view behind ArticleOpenAccess.
+    """
+    db.execute_sql("""
+        CREATE VIEW IF NOT EXISTS article_open_access AS
+        SELECT
+            article.id AS article_id,
+            CASE WHEN article.open_access IS NOT NULL
+                THEN article.open_access ELSE journal.open_access END AS open_access,
+            CASE WHEN article.open_access IS NOT NULL
+                THEN article.open_access_source ELSE journal.open_access_source END AS open_access_source
+        FROM article
+        LEFT OUTER JOIN journal ON article.journal_id = journal.id
+        """)
+
+# Schema migrations in the order they were added. The db's user_version
+# pragma records how many have been applied, so new migrations must only
+# ever be appended.
+MIGRATIONS = [
+        migrate_to_identifier_indexes,
+        create_open_access_view
+        ]
+
+def migrate_db():
+    """
+    Applies any migrations which the db hasn't had yet.
+    """
+    version = db.pragma('user_version')[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        with db.transaction():
+            migration()
+            db.pragma('user_version', number)
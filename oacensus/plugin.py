@@ -0,0 +1,52 @@
+from cashew import PluginMeta
+
+class LazyPluginMeta(PluginMeta):
+    """
+    PluginMeta which can also know about plugins by alias before the modules
+    defining them have been imported.
+
+    Lazy plugins are registered with a "module.name:ClassName" string. The
+    module is only imported, which registers the class in the usual way, when
+    an instance is first created for one of its aliases.
+    """
+    def __init__(cls, name, bases, attrs):
+        PluginMeta.__init__(cls, name, bases, attrs)
+        if not hasattr(cls, 'lazy_plugins'):
+            cls.lazy_plugins = {}
+
+    def register_lazy_plugins(cls, class_names):
+        """
+        Register a dict of alias -> "module.name:ClassName" without importing
+        any modules.
+        """
+        cls.lazy_plugins.update(class_names)
+
+    def has_alias(cls, alias):
+        return alias in cls.plugins or alias in cls.lazy_plugins
+
+    def available_aliases(cls):
+        return sorted(set(cls.plugins) | set(cls.lazy_plugins), key=str.lower)
+
+    def load_plugin(cls, alias):
+        """
+        Import the module defining the plugin for alias, if necessary.
+        """
+        if not alias in cls.plugins and alias in cls.lazy_plugins:
+            module_name = cls.lazy_plugins[alias].split(":")[0]
+            __import__(module_name)
+
+            if not alias in cls.plugins:
+                msg = "Importing %s did not register a plugin with alias '%s'"
+                raise Exception(msg % (module_name, alias))
+
+    def load_all_plugins(cls):
+        for alias in cls.lazy_plugins:
+            cls.load_plugin(alias)
+
+    def create_instance(cls, alias, *instanceargs, **instancekwargs):
+        cls.load_plugin(alias)
+        return PluginMeta.create_instance(cls, alias, *instanceargs, **instancekwargs)
+
+    def __iter__(cls, *instanceargs):
+        cls.load_all_plugins()
+        return PluginMeta.__iter__(cls, *instanceargs)
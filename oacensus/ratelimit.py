@@ -0,0 +1,76 @@
+import threading
+import time
+import urlparse
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average, and up to burst requests at
+    once after a quiet period.
+
+    Callers reserve a token before each request, so the bucket may go into
+    debt and each caller sleeps until its reserved slot. This keeps callers
+    from different threads in a fair queue without holding the lock while
+    sleeping.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token and returns the number of seconds to wait before using it.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """
+        Blocks until a request may be made, returns the time spent waiting.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class HostRateLimiter(object):
+    """
+    One TokenBucket per host, shared by every scraper and thread in the
+    process, so however many sessions talk to a host they never go over
+    its rate between them. If scrapers ask for different rates for the
+    same host, the lowest is used.
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host, rate, burst=1):
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+                self.buckets[host] = bucket
+            elif rate < bucket.rate or burst < bucket.burst:
+                with bucket.lock:
+                    bucket.rate = min(bucket.rate, float(rate))
+                    bucket.burst = min(bucket.burst, max(1, burst))
+                    bucket.tokens = min(bucket.tokens, bucket.burst)
+            return bucket
+
+    def acquire(self, url, rate, burst=1):
+        """
+        Blocks until a request to url's host is allowed at rate requests per
+        second, returns the time spent waiting.
+        """
+        host = urlparse.urlsplit(url).netloc.lower()
+        return self.bucket(host, rate, burst).acquire()
+
+rate_limiter = HostRateLimiter()
@@ -0,0 +1,235 @@
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+import hashlib
+import json
+import os
+import random
+import requests
+import threading
+import time
+import urllib
+import urlparse
+
+# Headers which describe the encoding of a particular transfer rather than
+# the content, and so aren't recorded or passed on.
+HOP_HEADERS = set([
+    'connection', 'content-encoding', 'content-length', 'keep-alive',
+    'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+    'transfer-encoding', 'upgrade'])
+
+def replay_url(server_url, url):
+    """
+    The url to use in place of url to send a request through the replay
+    server running at server_url, e.g. http://www.doaj.org/csv becomes
+    http://localhost:8001/www.doaj.org/csv
+    """
+    parts = urlparse.urlsplit(url)
+    return "%s/%s%s%s" % (server_url.rstrip("/"), parts.netloc, parts.path,
+            "?%s" % parts.query if parts.query else "")
+
+def upstream_url(path, scheme='http'):
+    """
+    Inverse of replay_url, the first segment of the request path is the
+    host the request is for.
+    """
+    host, _, rest = path.lstrip("/").partition("/")
+    return "%s://%s/%s" % (scheme, host, rest)
+
+def exchange_key(method, url, body=None):
+    """
+    Key identifying a request in a cassette. Query parameters are sorted so
+    the key doesn't depend on the order a client sent them in.
+    """
+    parts = urlparse.urlsplit(url)
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(parts.query, keep_blank_values=True)))
+    h = hashlib.sha1()
+    h.update("%s %s%s?%s" % (method.upper(), parts.netloc, parts.path, query))
+    if body:
+        h.update(hashlib.sha1(body).hexdigest())
+    return h.hexdigest()
+
+class Cassette(object):
+    """
+    Directory of recorded HTTP exchanges. Each exchange is stored as a JSON
+    file holding the request, status and headers, and a file holding the
+    response body, both named by the exchange key.
+    """
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+
+    def info_path(self, key):
+        return os.path.join(self.dirpath, "%s.json" % key)
+
+    def body_path(self, key):
+        return os.path.join(self.dirpath, "%s.body" % key)
+
+    def has_exchange(self, key):
+        return os.path.exists(self.info_path(key))
+
+    def keys(self):
+        if not os.path.exists(self.dirpath):
+            return []
+        return sorted(f[:-len(".json")] for f in os.listdir(self.dirpath) if f.endswith(".json"))
+
+    def save(self, method, url, body, status, headers, content):
+        if not os.path.exists(self.dirpath):
+            os.makedirs(self.dirpath)
+
+        key = exchange_key(method, url, body)
+        with open("%s.tmp" % self.body_path(key), 'wb') as f:
+            f.write(content)
+        os.rename("%s.tmp" % self.body_path(key), self.body_path(key))
+
+        info = {
+                'method' : method,
+                'url' : url,
+                'status' : status,
+                'headers' : [(k, v) for k, v in headers if not k.lower() in HOP_HEADERS],
+                'recorded' : time.time()
+                }
+        with open("%s.tmp" % self.info_path(key), 'wb') as f:
+            json.dump(info, f, indent=2, sort_keys=True)
+        os.rename("%s.tmp" % self.info_path(key), self.info_path(key))
+        return key
+
+    def load(self, key):
+        """
+        Returns (status, headers, content) for a recorded exchange.
+        """
+        with open(self.info_path(key), 'rb') as f:
+            info = json.load(f)
+        with open(self.body_path(key), 'rb') as f:
+            content = f.read()
+        return (info['status'], info['headers'], content)
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Serves a request from the server's cassette, or when recording, by
+    forwarding it upstream and saving the exchange first.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_exchange()
+
+    def do_POST(self):
+        self.handle_exchange()
+
+    def do_HEAD(self):
+        self.handle_exchange()
+
+    def handle_exchange(self):
+        server = self.server
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length) if length else None
+        url = upstream_url(self.path, server.scheme)
+        key = exchange_key(self.command, url, body)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        error_status = server.injected_error()
+        if error_status:
+            self.respond(error_status, [('Retry-After', '1')], "injected error\n")
+        elif server.record:
+            status, headers, content = self.forward(url, body)
+            server.cassette.save(self.command, url, body, status, headers, content)
+            self.respond(status, headers, content)
+        elif server.cassette.has_exchange(key):
+            self.respond(*server.cassette.load(key))
+        else:
+            self.respond(404, [], "no recorded exchange for %s %s\n" % (self.command, url))
+
+    def forward(self, url, body):
+        headers = dict((k, v) for k, v in self.headers.items()
+                if not k.lower() in HOP_HEADERS and k.lower() != 'host')
+        response = requests.request(self.command, url, data=body,
+                headers=headers, allow_redirects=False)
+        return (response.status_code, response.headers.items(), response.content)
+
+    def respond(self, status, headers, content):
+        self.send_response(status)
+        for k, v in headers:
+            if not k.lower() in HOP_HEADERS:
+                self.send_header(k, v)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.write_throttled(content)
+
+    def write_throttled(self, content):
+        """
+        Writes content no faster than the server's bandwidth allows.
+        """
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(content)
+            return
+
+        chunk_size = max(1024, bandwidth // 20)
+        start = time.time()
+        for i in range(0, len(content), chunk_size):
+            self.wfile.write(content[i:i+chunk_size])
+            wait = start + (i + chunk_size) / float(bandwidth) - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server which stands in for the remote hosts scrapers talk to.
+
+    Requests are made to /<host>/<path>, see replay_url. With record=True
+    each request is forwarded to the real host and the exchange saved to the
+    cassette, otherwise responses are replayed from the cassette.
+
+    Responses can be delayed by latency seconds, limited to bandwidth bytes
+    per second, and replaced with an error status for a fraction error_rate
+    of requests, chosen by a seeded random number generator so runs are
+    reproducible.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cassette, record=False, scheme='http',
+            latency=0, bandwidth=None, error_rate=0, error_statuses=(503,),
+            seed=0, verbose=False):
+        HTTPServer.__init__(self, address, ReplayHandler)
+        self.cassette = cassette
+        self.record = record
+        self.scheme = scheme
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.verbose = verbose
+
+    def url(self):
+        host, port = self.server_address
+        return "http://%s:%s" % (host, port)
+
+    def injected_error(self):
+        """
+        Returns an error status to respond with instead of the real response,
+        or None.
+        """
+        if not self.error_rate:
+            return None
+        with self.rng_lock:
+            if self.rng.random() < self.error_rate:
+                return self.rng.choice(self.error_statuses)
+
+    def start(self):
+        """
+        Serves requests in a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
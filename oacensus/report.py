@@ -1,11 +1,12 @@
-from cashew import Plugin, PluginMeta
+from cashew import Plugin
+from oacensus.plugin import LazyPluginMeta
 from oacensus.utils import defaults
 
 class Report(Plugin):
     """
     Parent class for reports.
     """
-    __metaclass__ = PluginMeta
+    __metaclass__ = LazyPluginMeta
 
     def __init__(self, opts=None):
         if opts:
@@ -82,9 +82,9 @@ class InstitutionalReport(JinjaReport):
 
     def template_data(self):
         from oacensus.models import Article
+        from oacensus.models import ArticleOpenAccess
 
-        articles = [a for a in Article.select()]
-        print "length:", len([a for a in articles])
+        print "length:", Article.select().count()
         years = [2007, 2008, 2009, 2010, 2011, 2012, 2013]
         total_articles = []
         have_dois = []
@@ -98,18 +98,18 @@ class InstitutionalReport(JinjaReport):
                                     (Article.date_published >= startdate) &
                                     (Article.date_published < enddate)
                                                 )
-            n_articles = len([a for a in yr_articles])
-            n_doi = len([a for a in yr_articles if a.doi])
-            n_cc_by = len([a for a in yr_articles if a.open_access if a])
-            n_doaj = year#len([a for a in yr_articles if (a.journal.open_access if (a is not None or a.journal is not None) else 0)])
+            n_articles = yr_articles.count()
+            n_doi = yr_articles.where((Article.doi != None) & (Article.doi != '')).count()
+            n_cc_by = yr_articles.where(Article.open_access == True).count()
+            n_doaj = (yr_articles
+                    .join(ArticleOpenAccess, on=(ArticleOpenAccess.article == Article.id))
+                    .where(ArticleOpenAccess.open_access == True)
+                    .count())
 
             total_articles.append(n_articles)
             have_dois.append(n_doi)
             cc_by.append(n_cc_by)
             doaj.append(n_doaj)
-            yr_articles = None
-            startdate = None
-            enddate = None
 
         vals = [years, total_articles, have_dois, cc_by, doaj]
         data = self.format_data(vals)
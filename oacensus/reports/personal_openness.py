@@ -50,14 +50,20 @@ class PersonalOpenness(JinjaReport):
         plt.savefig(filepath)
 
     def template_data(self):
+        from oacensus.models import Article
         from oacensus.models import ArticleList
+        from oacensus.models import ArticleOpenAccess
         orcid_lists = ArticleList.select().where(ArticleList.name % "ORCID*")
 
         lists = []
         for l in orcid_lists:
-            n_articles = len([a for a in l.articles()])
-            n_articles_with_dois = len([a for a in l.articles() if a.doi])
-            n_open_access_articles = len([a for a in l.articles() if a.open_access])
+            n_articles = l.count()
+            n_articles_with_dois = l.articles_query().where((Article.doi != None) & (Article.doi != '')).count()
+            n_open_access_articles = (l.articles_query()
+                    .switch(Article)
+                    .join(ArticleOpenAccess, on=(ArticleOpenAccess.article == Article.id))
+                    .where(ArticleOpenAccess.open_access == True)
+                    .count())
             data = [n_articles, n_articles_with_dois, n_open_access_articles]
 
             dotplot_file = "plot-%s.png" % hashlib.md5(l.name).hexdigest()
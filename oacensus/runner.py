@@ -0,0 +1,94 @@
+import Queue
+import sys
+import threading
+
+class ScrapeJob(object):
+    """
+    The scrape phase of a single scraper, run by a pipeline worker thread.
+    """
+    def __init__(self, scraper):
+        self.scraper = scraper
+        self.done = threading.Event()
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.scraper.ensure_scraped()
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def wait(self):
+        """
+        Block until the scrape has finished, re-raising any error from the
+        worker thread in the calling thread.
+        """
+        # Waiting with a timeout keeps the main thread responsive to Ctrl-C.
+        while not self.done.is_set():
+            self.done.wait(0.1)
+
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+class Pipeline(object):
+    """
+    Runs the scrape phases of scrapers concurrently in worker threads, while
+    process phases run one at a time in config order.
+
+    Each process phase only waits for its own scrape to finish. Scrapers with
+    identical settings share a cache directory so are only scraped once.
+    before_process and after_process, if given, are called with each scraper
+    around its process phase.
+    """
+    def __init__(self, scrapers, workers=1, after_process=None, before_process=None):
+        self.scrapers = scrapers
+        self.workers = max(1, int(workers))
+        self.after_process = after_process
+        self.before_process = before_process
+
+    def start_scrapes(self):
+        jobs = {}
+        queue = Queue.Queue()
+
+        for scraper in self.scrapers:
+            key = scraper.hashcode()
+            if not key in jobs:
+                jobs[key] = ScrapeJob(scraper)
+                queue.put(jobs[key])
+
+        def work():
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                job.run()
+
+        for i in range(min(self.workers, len(jobs))):
+            worker = threading.Thread(target=work, name="scrape-worker-%s" % i)
+            worker.daemon = True
+            worker.start()
+
+        return jobs
+
+    def run(self):
+        """
+        Run all scrapers, returning the results of their process methods.
+        """
+        jobs = self.start_scrapes()
+
+        results = []
+        for scraper in self.scrapers:
+            job = jobs[scraper.hashcode()]
+            job.wait()
+            if job.scraper is not scraper:
+                # Another scraper with the same settings did the scrape, so
+                # this one's data came from the cache.
+                scraper.metrics.update({'cache_hit' : True, 'requests' : 0, 'scrape_seconds' : 0.0})
+            if self.before_process is not None:
+                self.before_process(scraper)
+            results.append(scraper.run_process())
+            if self.after_process is not None:
+                self.after_process(scraper)
+        return results
@@ -1,9 +1,24 @@
-from cashew import Plugin, PluginMeta
+from cashew import Plugin
+from oacensus.cache import CacheStore
+from oacensus.db import db
+from oacensus.lookups import LookupCache
+from oacensus.metrics import ProcessMetrics
+from oacensus.metrics import directory_size
 from oacensus.models import Journal
+from oacensus.models import journal_map
+from oacensus.models import publisher_map
+from oacensus.plugin import LazyPluginMeta
+from oacensus.session import RetrySession
 from oacensus.utils import defaults
+from oacensus.utils import parse_duration
+from oacensus.utils import urlretrieve
+from multiprocessing.pool import ThreadPool
 import hashlib
+import json
 import os
 import shutil
+import threading
+import time
 import chardet
 import codecs
 
@@ -11,13 +26,33 @@ class Scraper(Plugin):
     """
     Parent class for scrapers.
     """
-    __metaclass__ = PluginMeta
+    __metaclass__ = LazyPluginMeta
 
     _settings = {
             'cache': ("Location to copy cache files from.", None),
-            'encoding' : ("Which encoding to use. Can be 'chardet'.", None)
+            'encoding' : ("Which encoding to use. Can be 'chardet'.", None),
+            'timeout' : ("Seconds to wait for a server to accept a connection or send data.", 60),
+            'retries' : ("Number of times to retry requests which fail or get a 429 or 5xx response.", 5),
+            'backoff' : ("Seconds to wait before the first retry, doubling for each further retry.", 1),
+            'rate-limit' : ("Maximum requests per second to any one host, shared with other scrapers. None for no limit.", None),
+            'rate-burst' : ("Number of requests which may be made at once before rate-limit applies.", 1),
+            'concurrency' : ("Number of requests to make at once, for scrapers which support it.", 1),
+            'lookup-ttl' : ("How long results in the lookup cache stay fresh, e.g. '30d'. None to keep them forever.", '30d')
             }
 
+    # Settings which affect how data is fetched but not what is fetched, so
+    # aren't included in the hash.
+    network_settings = ['timeout', 'retries', 'backoff', 'rate-limit', 'rate-burst', 'concurrency',
+            'lookup-ttl']
+
+    # Whether scrape can carry on from work left by an interrupted scrape,
+    # in which case the work dir isn't emptied first. See resume().
+    resumable = False
+
+    # Whether process must run on every rerun even if nothing before it has
+    # changed, e.g. because it fetches data itself. See RunLedger.
+    always_process = False
+
     def __init__(self, opts=None):
         """
         Initialize with command line options (distinct from scraper settings).
@@ -26,6 +61,11 @@ class Scraper(Plugin):
             self._opts = opts
         else:
             self._opts = defaults
+        self.metrics = {}
+        self._session = None
+        self._lookup_caches = {}
+        self._progress_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
 
     def decode_encoded(self, text):
         encoding = self.setting('encoding')
@@ -45,7 +85,7 @@ class Scraper(Plugin):
         """
         Dictionary of settings which should be used to construct hash.
         """
-        return self.setting_values()
+        return self.setting_values(self.network_settings)
 
     def hashstring(self):
         """
@@ -61,25 +101,139 @@ class Scraper(Plugin):
         return hashlib.md5(self.hashstring()).hexdigest()
 
     def run(self):
-        print self.cache_dir()
+        self.ensure_scraped()
+        return self.run_process()
+
+    def ensure_scraped(self):
+        """
+        Make sure scraped content for the current settings is in the cache,
+        calling the scrape method if it is not. Does not touch the db, so it
+        is safe to call from a worker thread.
+        """
+        print "  %s: %s" % (self.alias, self.hashcode())
+        start = time.time()
         if self.is_scraped_content_cached():
-            print "  scraped data is already cached"
+            print "  %s: scraped data is already cached" % self.alias
+            self.metrics.update({'cache_hit' : True, 'requests' : 0})
         else:
-            self.reset_work_dir()
+            self.metrics.update({'cache_hit' : False, 'requests' : 0})
+            if self.resumable:
+                self.ensure_work_dir()
+            else:
+                self.reset_work_dir()
             if self.setting('cache') is not None:
-                print "  using cache location %s..." % self.setting('cache')
-                shutil.copytree(self.setting('cache'), self.cache_dir())
+                print "  %s: using cache location %s..." % (self.alias, self.setting('cache'))
+                placed = self.cache_store().add_directory(self.hashcode(), self.setting('cache'), self.alias)
+                if placed:
+                    summary = ", ".join("%s %s" % (n, name) for name, n in sorted(placed.items()))
+                    print "  %s: seeded cache files by %s" % (self.alias, summary)
             else:
-                print "  calling scrape method..."
+                print "  %s: calling scrape method..." % self.alias
                 self.scrape()
+                self.metrics['bytes_downloaded'] = directory_size(self.work_dir())
+                if self._session is not None:
+                    self.metrics['rate_limited_seconds'] = self._session.rate_limited_seconds
                 self.copy_work_dir_to_cache()
+                self.remove_progress()
+        self.metrics['scrape_seconds'] = time.time() - start
 
-        print "  calling process method..."
-        return self.process()
+    def run_process(self):
+        """
+        Run the process method, assumes scraped content is already cached.
+        """
+        print "  %s: calling process method..." % self.alias
+        self.cache_store().touch(self.hashcode())
+        with ProcessMetrics(self.metrics):
+            with db.write_session():
+                with journal_map, publisher_map:
+                    return self.process()
+
+    def session(self):
+        """
+        HTTP session to make all of this scraper's requests with, so
+        connections are reused and failed requests retried. Responses are
+        counted in metrics.
+        """
+        with self._metrics_lock:
+            if self._session is None:
+                self._session = RetrySession(
+                        timeout=self.setting('timeout'),
+                        retries=self.setting('retries'),
+                        backoff=self.setting('backoff'),
+                        rate=self.setting('rate-limit'),
+                        burst=self.setting('rate-burst'),
+                        pool_size=max(10, self.setting('concurrency')))
+                self._session.hooks['response'].append(self.count_response)
+        return self._session
 
-    def cache_dir(self):
+    def imap(self, fn, items, ordered=True):
         """
-        Location of this object's cache directory.
+        Yields fn(item) for each item, running up to 'concurrency' calls at
+        once in worker threads. Results are in the order of items unless
+        ordered is False, when they are yielded as soon as they are ready.
+        fn must not call imap itself.
+        """
+        concurrency = self.setting('concurrency')
+        if concurrency <= 1:
+            for item in items:
+                yield fn(item)
+            return
+
+        pool = ThreadPool(concurrency)
+        try:
+            if ordered:
+                results = pool.imap(fn, items)
+            else:
+                results = pool.imap_unordered(fn, items)
+            for result in results:
+                yield result
+        finally:
+            pool.terminate()
+
+    def download(self, url, filepath, params=None):
+        """
+        Stream the content at url to filepath.
+        """
+        urlretrieve(url, params, filepath, self.session())
+
+    def count_response(self, response, *args, **kwargs):
+        self.count_request()
+        return response
+
+    def count_request(self):
+        """
+        Adds one to the requests metric. Safe to call from worker threads.
+        """
+        with self._metrics_lock:
+            self.metrics['requests'] = self.metrics.get('requests', 0) + 1
+
+    def cache_store(self):
+        """
+        The content-addressed store holding scraped data.
+        """
+        return CacheStore(
+                self._opts['cachedir'],
+                self._opts['cachecodec'],
+                self._opts['cachelink'])
+
+    def lookup_cache(self, name=None):
+        """
+        Per-key store of lookup results, kept in the cache dir so that reruns
+        only look up keys which are new or stale. Scrapers which make the same
+        lookups share a store by using the same name, which defaults to the
+        scraper's alias. See oacensus.lookups.
+        """
+        name = name or self.alias
+        if not name in self._lookup_caches:
+            ttl = self.setting('lookup-ttl')
+            path = os.path.join(self._opts['cachedir'], "lookups", "%s.sqlite3" % name)
+            self._lookup_caches[name] = LookupCache(path, parse_duration(ttl) if ttl else None)
+        return self._lookup_caches[name]
+
+    def legacy_cache_dir(self):
+        """
+        Location of this object's cache directory in the uncompressed cache
+        layout used by earlier versions.
         """
         return os.path.join(self._opts['cachedir'], self.hashcode())
 
@@ -93,18 +247,38 @@ class Scraper(Plugin):
         """
         When work is completed, populated working directory is moved to cache.
         """
-        shutil.move(self.work_dir(), self.cache_dir())
+        self.cache_store().add_directory(self.hashcode(), self.work_dir(), self.alias, move=True)
         assert self.is_scraped_content_cached()
 
-    def create_cache_dir(self):
-        os.makedirs(self.cache_dir())
-
-    def remove_cache_dir(self):
-        assert os.path.abspath(".") in os.path.abspath(self.cache_dir())
-        shutil.rmtree(self.cache_dir(), ignore_errors=True)
+    def remove_cached_content(self):
+        self.cache_store().remove_entry(self.hashcode())
 
     def is_scraped_content_cached(self):
-        return os.path.exists(self.cache_dir())
+        store = self.cache_store()
+        if not store.has_entry(self.hashcode()) and os.path.isdir(self.legacy_cache_dir()):
+            print "  %s: importing cache directory %s" % (self.alias, self.legacy_cache_dir())
+            store.add_directory(self.hashcode(), self.legacy_cache_dir(), self.alias, move=True)
+        return store.has_entry(self.hashcode())
+
+    def cache_digest(self):
+        """
+        Digest of the content of this object's cached data, or None if it
+        hasn't been scraped.
+        """
+        return self.cache_store().content_digest(self.hashcode())
+
+    def cached_filenames(self):
+        """
+        Sorted list of names of files in this object's cached data.
+        """
+        return self.cache_store().filenames(self.hashcode())
+
+    def open_cached(self, filename):
+        """
+        Returns a file-like object streaming the content of a file from this
+        object's cached data. Raises IOError if the file was not scraped.
+        """
+        return self.cache_store().open(self.hashcode(), filename)
 
     def reset_work_dir(self):
         """
@@ -112,8 +286,86 @@ class Scraper(Plugin):
         """
         assert os.path.abspath(".") in os.path.abspath(self.work_dir())
         shutil.rmtree(self.work_dir(), ignore_errors=True)
+        self.remove_progress()
         os.makedirs(self.work_dir())
 
+    def ensure_work_dir(self):
+        """
+        Ensure the work dir exists, keeping any content already in it.
+        """
+        if not os.path.isdir(self.work_dir()):
+            os.makedirs(self.work_dir())
+
+    def progress_path(self):
+        """
+        Location of the log of completed units of work for a resumable
+        scrape. It sits next to the work dir so it isn't copied to the cache.
+        """
+        return "%s.progress" % self.work_dir().rstrip(os.sep)
+
+    def remove_progress(self):
+        if os.path.exists(self.progress_path()):
+            os.remove(self.progress_path())
+
+    def resume(self, context=None):
+        """
+        Called by a resumable scrape before it starts work. Returns a dict of
+        unit -> data for each unit of work marked as completed by an earlier,
+        interrupted scrape with the same hashcode.
+
+        context is any JSON-serializable description of what the units refer
+        to, e.g. the number of search results. If it differs from the context
+        the interrupted scrape started with, its work is discarded, as is
+        anything left in the work dir without a progress log.
+        """
+        context = json.loads(json.dumps(context))
+        entries = []
+        if os.path.exists(self.progress_path()):
+            with open(self.progress_path(), 'rb') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # Last line was being written when interrupted.
+                        break
+
+        if not entries:
+            # Nothing records what is in the work dir, so it can't be trusted.
+            self.reset_work_dir()
+        elif entries[0].get('context') != context:
+            print "  %s: discarding work from interrupted scrape, context has changed" % self.alias
+            self.reset_work_dir()
+            entries = []
+
+        completed = {}
+        for entry in entries[1:]:
+            completed[entry['unit']] = entry.get('data')
+
+        if completed:
+            print "  %s: resuming, %s units of work already completed" % (self.alias, len(completed))
+        self.metrics['resumed_units'] = len(completed)
+
+        tmp_path = "%s.tmp" % self.progress_path()
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps({'context' : context}) + "\n")
+            for entry in entries[1:]:
+                f.write(json.dumps(entry) + "\n")
+        os.rename(tmp_path, self.progress_path())
+
+        return completed
+
+    def mark_completed(self, unit, data=None):
+        """
+        Records that a unit of work (a string) has been completed, along with
+        any JSON-serializable data the scrape will need when it finishes.
+        Files the unit wrote to the work dir should be complete before this
+        is called. Safe to call from worker threads.
+        """
+        line = json.dumps({'unit' : unit, 'data' : data}) + "\n"
+        with self._progress_lock:
+            with open(self.progress_path(), 'ab') as f:
+                f.write(line)
+
     def scrape(self):
         """
         Fetch remote data and store it in the local cache.
@@ -135,7 +387,13 @@ class ArticleScraper(Scraper):
 class ArticleInfoScraper(Scraper):
     """
     Scrapers which add metadata to existing articles.
+
+    These look up the articles in the db during process, keeping results in
+    a lookup cache, so they are processed on every run to fetch results
+    which were pending or have gone stale.
     """
+    always_process = True
+
     def scrape(self):
         pass
 
@@ -173,12 +431,14 @@ class JournalScraper(Scraper):
     def create_new_journal(self, issn, args):
         args['issn'] = issn
         args['source'] = self.alias
-        return Journal.create(**args)
+        journal = Journal.create(**args)
+        journal_map.add(journal)
+        return journal
 
     def modify_existing_journal(self, journal, issn, args):
         update_journal_fields = self.setting('update-journal-fields')
         for k, v in args.iteritems():
             if k in update_journal_fields:
                 setattr(journal, k, v)
-        journal.save()
+        journal_map.save(journal)
         return journal
@@ -4,7 +4,6 @@ from oacensus.models import Publisher
 from oacensus.scraper import JournalScraper
 import hashlib
 import os
-import urllib
 
 class BiomedCentralJournals(JournalScraper):
     """
@@ -14,6 +13,7 @@ class BiomedCentralJournals(JournalScraper):
     website.
     """
     aliases = ['biomed']
+    resumable = True
 
     _settings = {
             "url" : ("url to scrape", "http://www.biomedcentral.com/journals"),
@@ -25,7 +25,13 @@ class BiomedCentralJournals(JournalScraper):
     def scrape(self):
         limit = self.setting('limit')
         filepath = os.path.join(self.work_dir(), self.setting('data-file'))
-        urllib.urlretrieve(self.setting('url'), filepath)
+
+        # The journal list and each journal page are units of work, so an
+        # interrupted scrape doesn't fetch pages it already has again.
+        completed = self.resume()
+        if not 'journal-list' in completed:
+            self.download(self.setting('url'), filepath)
+            self.mark_completed('journal-list')
 
         with open(filepath, 'rb') as f:
             soup = BeautifulSoup(f)
@@ -37,22 +43,18 @@ class BiomedCentralJournals(JournalScraper):
             journal_url = anchor.get('href')
             journal_filename = hashlib.md5(journal_url).hexdigest()
             journal_filepath = os.path.join(self.work_dir(), journal_filename)
+            if journal_url in completed:
+                continue
 
-            issn_found = False
-            n_attempts = 5
-            for i in range(1, n_attempts):
-                print "  fetching", journal_url, "attempt", i
-                urllib.urlretrieve(journal_url, journal_filepath)
+            print "  fetching", journal_url
+            self.download(journal_url, journal_filepath)
 
-                with open(journal_filepath, 'rb') as f:
-                    journal_soup = BeautifulSoup(f)
-                    issn_span_list = journal_soup.select("#issn")
-                    if issn_span_list:
-                        issn_found = True
-                        break
+            with open(journal_filepath, 'rb') as f:
+                journal_soup = BeautifulSoup(f)
+                if not journal_soup.select("#issn"):
+                    raise Exception("Issn not found in %s." % journal_url)
 
-            if not issn_found:
-                raise Exception("Issn not found in %s after %s tries." % (journal_url, n_attempts))
+            self.mark_completed(journal_url)
 
     def journal_list_iter(self, soup):
         journal_ul = soup.find("ul", class_="journals")
@@ -73,21 +75,19 @@ class BiomedCentralJournals(JournalScraper):
             yield anchor
 
     def process(self):
-        filepath = os.path.join(self.cache_dir(), self.setting('data-file'))
-        with open(filepath, 'rb') as f:
+        with self.open_cached(self.setting('data-file')) as f:
             soup = BeautifulSoup(f)
 
         biomed_list = JournalList.create(name = "BioMedCentral Journals")
-        publisher = Publisher.create(name = "BioMedCentral")
+        publisher = Publisher.create_or_update_by_name("BioMedCentral")
 
         for anchor in self.journal_list_iter(soup):
             journal_url = anchor.get('href')
             self.print_progress("  parsing %s" % journal_url)
             journal_filename = hashlib.md5(journal_url).hexdigest()
-            journal_filepath = os.path.join(self.cache_dir(), journal_filename)
 
             try:
-                with open(journal_filepath, 'rb') as f:
+                with self.open_cached(journal_filename) as f:
                     journal_soup = BeautifulSoup(f)
             except IOError:
                 if self.setting('limit') is None:
@@ -1,13 +1,14 @@
 from oacensus.models import Article
+from oacensus.models import Journal
 from oacensus.models import JournalList
 from oacensus.models import Publisher
 from oacensus.scraper import ArticleInfoScraper
 from oacensus.scraper import JournalScraper
-from oacensus.utils import parse_crossref_coins
+from oacensus.utils import normalize_doi
+from oacensus.utils import parse_crossref_work
 import csv
-import json
+import datetime
 import os
-import requests
 import urllib
 
 class CrossrefJournals(JournalScraper):
@@ -26,15 +27,14 @@ class CrossrefJournals(JournalScraper):
     def scrape(self):
         url = self.setting('csv-url')
         data_file = os.path.join(self.work_dir(), self.setting('data-file'))
-        urllib.urlretrieve(url, data_file)
+        self.download(url, data_file)
 
     def process(self):
-        crossref_data = os.path.join(self.cache_dir(), self.setting('data-file'))
         limit = self.setting('limit')
 
         crossref_list = JournalList.create(name = "Crossref Journals")
 
-        with open(crossref_data, 'rb') as f:
+        with self.open_cached(self.setting('data-file')) as f:
             crossref_reader = csv.DictReader(f)
 
             for i, row in enumerate(crossref_reader):
@@ -63,27 +63,132 @@ class CrossrefJournals(JournalScraper):
 
         return crossref_list
 
-class Crossref(ArticleInfoScraper):
+# Name of the lookup cache holding parsed CrossRef works by DOI, shared by
+# every scraper which looks DOIs up with CrossRef.
+CROSSREF_LOOKUPS = "crossref-works"
+
+def fetch_crossref_works(session, api_url, dois):
+    """
+    Looks up a batch of normalized DOIs with the CrossRef works API, returns
+    a dict of DOI to parsed work, or None for DOIs CrossRef doesn't know.
+    """
+    # Commas separate filters, so DOIs containing them are fetched singly.
+    filtered = [doi for doi in dois if not "," in doi]
+    found = {}
+
+    if filtered:
+        response = session.get(api_url, params = {
+            'filter' : ",".join("doi:%s" % doi for doi in filtered),
+            'rows' : len(filtered)
+            })
+        response.raise_for_status()
+        for work in response.json()['message']['items']:
+            found[normalize_doi(work['DOI'])] = parse_crossref_work(work)
+
+    for doi in dois:
+        if "," in doi:
+            response = session.get("%s/%s" % (api_url, urllib.quote(doi)))
+            if response.status_code != 404:
+                response.raise_for_status()
+                found[doi] = parse_crossref_work(response.json()['message'])
+
+    return dict((doi, found.get(doi)) for doi in dois)
+
+def lookup_crossref_works(scraper, dois):
+    """
+    Returns a dict of DOI to parsed work for normalized dois, fetching only
+    those which aren't fresh in the lookup cache. Uses the scraper's
+    'api-url', 'batch-size' and 'concurrency' settings.
+    """
+    cache = scraper.lookup_cache(CROSSREF_LOOKUPS)
+    missing = cache.missing(dois)
+    scraper.metrics['lookups_cached'] = len(dois) - len(missing)
+    scraper.metrics['lookups_fetched'] = len(missing)
+
+    if missing:
+        print "  %s: looking up %s of %s DOIs" % (scraper.alias, len(missing), len(dois))
+        api_url = scraper.setting('api-url')
+        size = scraper.setting('batch-size')
+        batches = [missing[i:i+size] for i in range(0, len(missing), size)]
+        fetch = lambda batch: fetch_crossref_works(scraper.session(), api_url, batch)
+        for works in scraper.imap(fetch, batches, ordered=False):
+            cache.put_many(works)
+
+    return cache.get_many(dois)
+
+def crossref_journal(work, source):
     """
-    Gets crossref information for all articles with DOIs in the database.
+    Journal matching one of a work's ISSNs, created if there is none.
+    """
+    for issn in work['issn']:
+        journal = Journal.by_issn(issn)
+        if journal is not None:
+            return journal
+
+    if work['issn'] and work['journal_title']:
+        return Journal.create_or_update_by_issn({
+            'issn' : work['issn'][0],
+            'title' : work['journal_title'],
+            'source' : source
+            })
+
+def parse_crossref_date(text):
+    """
+    Date from a parsed work's date_published, missing month or day taken
+    as the first.
+    """
+    parts = [int(part) for part in text.split("-")]
+    return datetime.date(*(parts + [1, 1])[:3])
 
-    Currently this does nothing with the returned data.
+class Crossref(ArticleInfoScraper):
+    """
+    Gets CrossRef information for all articles with DOIs in the database, and
+    fills in their journal, publication date, url and license where these
+    aren't already known.
+
+    DOIs are looked up many at a time using the works API's doi filter, with
+    several requests in flight at once. Parsed results are kept per DOI in
+    the lookup cache, so a rerun only looks up DOIs which are new or whose
+    results are older than lookup-ttl, and the rest of processing is a local
+    join against the cache.
     """
     aliases = ['crossref']
 
     _settings = {
-            'base-url' : ("Base url of crossref API", "http://search.labs.crossref.org/dois")
+            'api-url' : ("CrossRef works API url.", "http://api.crossref.org/works"),
+            'batch-size' : ("Number of DOIs to look up per request.", 50),
+            'concurrency' : 4
             }
 
     def process(self):
-        articles = Article.select().where(Article.doi)
-        for article in articles:
-            response = requests.get(self.setting('base-url'),
-                    params = {'q' : article.doi}
-                    )
-            crossref_info = json.loads(response.text)
-
-            if crossref_info:
-                coins = parse_crossref_coins(crossref_info[0])
-                journal_title = coins['rft.jtitle'][0]
-                print "journal title", journal_title
+        has_doi = (Article.doi != None) & (Article.doi != '')
+        dois = sorted(set(normalize_doi(doi)
+            for doi, in Article.select(Article.doi).where(has_doi).tuples()))
+        works = lookup_crossref_works(self, dois)
+
+        n_updated = 0
+        for article in Article.select().where(has_doi).iterator():
+            work = works.get(normalize_doi(article.doi))
+            if work is None:
+                continue
+
+            changed = []
+            if article.journal_id is None:
+                article.journal = crossref_journal(work, self.alias)
+                if article.journal is not None:
+                    changed.append(Article.journal)
+            if article.date_published is None and work['date_published']:
+                article.date_published = parse_crossref_date(work['date_published'])
+                changed.append(Article.date_published)
+            if article.url is None and work['url']:
+                article.url = work['url']
+                changed.append(Article.url)
+            if article.license is None and work['license']:
+                article.license = work['license']
+                changed.append(Article.license)
+
+            if changed:
+                article.save(only=changed)
+                n_updated += 1
+
+        print "  %s: updated %s of %s articles with DOIs" % (self.alias, n_updated, len(dois))
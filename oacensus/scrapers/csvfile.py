@@ -1,11 +1,10 @@
-from oacensus.models import Article
 from oacensus.models import Journal
 from oacensus.models import ArticleList
 from oacensus.scraper import ArticleScraper
+from oacensus.utils import iter_universal_lines
 import os
 import csv
 import shutil
-import codecs
 from datetime import datetime
 import re
 
@@ -50,14 +49,23 @@ class CSVFile(ArticleScraper):
         shutil.copyfile(self.setting('csv-file'), work_file)
 
     def process(self):
-        data_file = os.path.join(self.cache_dir(), self.setting('data-file'))
-        col_map = self.setting('column-mapping')
         article_list = ArticleList.create(name = self.setting('list-name'))
+        article_list.add_articles(self.parse_articles())
 
-        with codecs.open(data_file, 'rU', encoding=self.setting('encoding')) as f:
-            reader = csv.reader(f)
+        print "  ", article_list
+        return article_list
 
-            headers = reader.next()
+    def parse_articles(self):
+        """
+        Yields a dict of article fields for each row of the CSV file.
+        """
+        encoding = self.setting('encoding')
+        with self.open_cached(self.setting('data-file')) as f:
+            # The csv module only reads byte strings, so it is given the raw
+            # lines and each cell is decoded.
+            reader = csv.reader(iter_universal_lines(f))
+
+            headers = [h.decode(encoding) for h in reader.next()]
             col_map = self.setting('column-mapping')
             attributes = [col_map.get(h) for h in headers]
 
@@ -65,7 +73,7 @@ class CSVFile(ArticleScraper):
                 if len(row) == 0:
                     break # assume we have reached end
 
-                info = dict(zip(attributes, row))
+                info = dict(zip(attributes, [cell.decode(encoding) for cell in row]))
 
                 info.pop(None)
 
@@ -95,15 +103,10 @@ class CSVFile(ArticleScraper):
                 if date_published is None:
                     raise Exception("No date format for %s" % raw_date)
 
-                article = Article.create(
-                        title = title,
-                        source = self.alias,
-                        doi = doi,
-                        journal = journal,
-                        date_published = date_published
-                        )
-
-                article_list.add_article(article)
-
-        print "  ", article_list
-        return article_list
+                yield {
+                        'title' : title,
+                        'source' : self.alias,
+                        'doi' : doi,
+                        'journal' : journal,
+                        'date_published' : date_published
+                        }
@@ -3,7 +3,6 @@ from oacensus.models import Publisher
 from oacensus.scraper import JournalScraper
 import csv
 import os
-import urllib
 
 class DoajJournals(JournalScraper):
     """
@@ -22,15 +21,14 @@ class DoajJournals(JournalScraper):
     def scrape(self):
         url = self.setting('csv-url')
         data_file = os.path.join(self.work_dir(), self.setting('data-file'))
-        urllib.urlretrieve(url, data_file)
+        self.download(url, data_file)
 
     def process(self):
-        doaj_data = os.path.join(self.cache_dir(), self.setting('data-file'))
         limit = self.setting('limit')
         
         doaj_list = JournalList.create(name = "DOAJ Journals")
 
-        with open(doaj_data, 'rb') as f:
+        with self.open_cached(self.setting('data-file')) as f:
             doaj_reader = csv.DictReader(f)
 
             for i, row in enumerate(doaj_reader):
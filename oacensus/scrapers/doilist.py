@@ -1,20 +1,29 @@
-from oacensus.models import Article
 from oacensus.models import ArticleList
 from oacensus.scraper import ArticleScraper
-from oacensus.utils import parse_crossref_coins
+from oacensus.scrapers.crossref import crossref_journal
+from oacensus.scrapers.crossref import lookup_crossref_works
+from oacensus.scrapers.crossref import parse_crossref_date
+from oacensus.utils import normalize_doi
+import hashlib
 import json
 import os
-import requests
-import datetime
 
 class DOIList(ArticleScraper):
     """
     Reads a list of DOIs from an external source. Uses crossref (currently) to retrieve metadata.
+
+    Metadata is looked up during the scrape, several batches of DOIs at once,
+    and saved with the cached DOIs so processing makes no requests. Results
+    are also kept per DOI in the lookup cache shared with the crossref
+    scraper, so when DOIs are added to the file only the new ones are looked
+    up.
     """
     aliases = ['doilist']
 
     _settings = {
-            'base-url' : ("Base url of crossref API", "http://search.labs.crossref.org/dois"),
+            'api-url' : ("CrossRef works API url.", "http://api.crossref.org/works"),
+            'batch-size' : ("Number of DOIs to look up per request.", 50),
+            'concurrency' : 4,
             "doi-file" : ("Path to file containing list of DOIs.", "dois.txt"),
             "doi-list" : ("Specify list of DOIs directly instead of via a file.", None),
             "list-name" : ("Custom list name.", "Custom DOI List"),
@@ -22,59 +31,69 @@ class DOIList(ArticleScraper):
             "source" : ("'source' attribute to use for articles.", "doilist")
             }
 
-    def scrape(self):
+    def hash_settings(self):
+        """
+        Includes a hash of the DOI file's contents, so changes to the file
+        are scraped.
+        """
+        settings = ArticleScraper.hash_settings(self)
+        if self.setting('doi-list') is None and os.path.exists(self.setting('doi-file')):
+            with open(self.setting('doi-file'), 'rb') as f:
+                settings['doi-file-md5'] = hashlib.md5(f.read()).hexdigest()
+        return settings
+
+    def read_dois(self):
         """
         Assume the DOIs are separated by whitespace (tabs, spaces or newlines).
         Subclass this to implement other parsers which read from a local file
         and extract DOIs.
         """
         if self.setting('doi-list') is not None:
-            DOIs = self.setting('doi-list')
+            return self.setting('doi-list')
         else:
             with open(self.setting('doi-file'), 'r') as f:
                 data = f.read()
-                DOIs = [datum.strip() for datum in data.split()]
+                return [datum.strip() for datum in data.split()]
+
+    def scrape(self):
+        DOIs = self.read_dois()
+        works = lookup_crossref_works(self, sorted(set(normalize_doi(doi) for doi in DOIs)))
 
         data_file = os.path.join(self.work_dir(), self.setting('data-file'))
         with open(data_file, 'wb') as f:
-            json.dump(DOIs, f)
+            json.dump({'dois' : DOIs, 'works' : works}, f)
 
     def process(self):
-        data_file = os.path.join(self.cache_dir(), self.setting('data-file'))
-        with open(data_file, 'rb') as f:
-            DOIs = json.load(f)
+        with self.open_cached(self.setting('data-file')) as f:
+            data = json.load(f)
 
         article_list = ArticleList.create(name=self.setting('list-name'))
+        article_list.add_articles(self.parse_articles(data['dois'], data['works']))
 
-        for doi in DOIs:
-            response = requests.get(self.setting('base-url'),
-                    params = {'q' : doi}
-                    )
-            response_list = json.loads(response.text)
-
-            if len(response_list) == 0:
-                print "No responses matched doi %s, skipping." % doi
-            elif len(response_list) > 1:
-                print "Multiple responses matched doi %s, skipping." % doi
-            else:
-                crossref_info = response_list[0]
-                coins = parse_crossref_coins(crossref_info)
+        print "  ", article_list
+        return article_list
 
-                print coins.keys()
-                print coins
-                print crossref_info.keys()
-                year = crossref_info['year']
-                year = int(year) if year is not None else 1900
+    def parse_articles(self, DOIs, works):
+        """
+        Yields a dict of article fields for each DOI which CrossRef knows.
+        """
+        for doi in DOIs:
+            work = works.get(normalize_doi(doi))
 
-                article = Article.create(
-                        title = crossref_info['title'],
-                        doi = doi,
-                        date_published = datetime.date(year, 1, 1),
-                        source = self.setting('source')
-                        )
+            if work is None:
+                print "No CrossRef record matched doi %s, skipping." % doi
+                continue
 
-                #print article
-                article_list.add_article(article)
+            date_published = None
+            if work['date_published']:
+                date_published = parse_crossref_date(work['date_published'])
 
-        print "  ", article_list
-        return article_list
+            yield {
+                    'title' : work['title'] or doi,
+                    'doi' : doi,
+                    'journal' : crossref_journal(work, self.setting('source')),
+                    'date_published' : date_published,
+                    'url' : work['url'],
+                    'license' : work['license'],
+                    'source' : self.setting('source')
+                    }
@@ -5,7 +5,6 @@ from oacensus.scraper import JournalScraper
 import cPickle as pickle
 import os
 import re
-import requests
 import string
 
 class ElsevierJournals(JournalScraper):
@@ -13,6 +12,7 @@ class ElsevierJournals(JournalScraper):
     Scrape journal names from Elsevier website.
     """
     aliases = ['elsevier']
+    resumable = True
 
     _settings = {
             "base-url" : ("Base url to scrape.", "http://www.elsevier.com/journals/title/"),
@@ -24,88 +24,93 @@ class ElsevierJournals(JournalScraper):
             }
 
     def scrape(self):
-        journals = []
         pages = [l for l in string.ascii_lowercase] + self.setting('non-alpha-pages')
 
+        # Each page of the listing is a unit of work, so an interrupted
+        # scrape picks up from the first page it hadn't finished.
+        completed = self.resume()
         for page in pages:
-            self.print_progress("  fetching page %s" % page)
-            url = "%s%s" % (self.setting('base-url'), page)
-
-            response = requests.get(url)
-            soup = BeautifulSoup(response.text)
-
-            journal_list = soup.find('ul', class_="listing")
-            for entry in journal_list.findAll('li'):
-                anchor = entry.find('a')
-                journal_info = {}
-                issn_ok = False
-
-                journal_url = anchor.get('href')
+            if not page in completed:
+                completed[page] = self.scrape_page(page)
+                self.mark_completed(page, completed[page])
 
-                if journal_url.startswith('/'):
-                    journal_url = "https://www.elsevier.com" + journal_url
-
-                journal_info['url'] = journal_url
-                journal_info['title'] = anchor.text.strip()
-
-                if "combined-subscription" in journal_url:
-                    continue
-
-                issn_match = re.search("/([0-9a-z]{4}-[0-9a-z]{4})$", journal_url)
-                if issn_match:
-                    self.print_progress("  don't need to fetch %s" % journal_url)
-                    issn_ok = True
-                    issn = issn_match.groups()[0]
-                    journal_info['issn'] = issn
-                    journals.append(journal_info)
-
-                else:
-                    # ISSN is not in url, need to parse journal page.
-                    #
-                    # Pages don't always load correctly, so use multiple
-                    # attempts so one load failure doesn't mean we have to
-                    # start all over.
-                    attempts = 5
-                    for i in range(1, attempts):
-                        self.print_progress("  fetching %s attempt %s" % (journal_url, i))
-
-                        try:
-                            response = requests.get(journal_url)
-                        except Exception as e:
-                            print e
-                            continue
-
-                        self.print_progress("  fetched. parsing...")
-                        journal_soup = BeautifulSoup(response.text)
-                        if_table = journal_soup.select(".ifContainer .ifTD")
-                        if if_table:
-                            issn_div = if_table[-1]
-                            if "ISSN" in issn_div.text:
-                                issn_ok = True
-                                issn = issn_div.text.replace("ISSN:", "").strip()
-                                journal_info['issn'] = issn
-                                journals.append(journal_info)
-                                break
-
-                        else:
-                            if journal_soup.find('title').text == "Subjects | Elsevier":
-                                issn_ok = True
-                                break
-
-                    if not issn_ok:
-                        raise Exception("Issn not found in %s after %s tries." % (journal_url, attempts))
+        journals = []
+        for page in pages:
+            journals.extend(completed[page])
 
         filepath = os.path.join(self.work_dir(), self.setting('data-file'))
         with open(filepath, 'wb') as f:
             pickle.dump(journals, f)
 
+    def scrape_page(self, page):
+        """
+        Returns info for each journal on a page of the journal listing.
+        """
+        journals = []
+        self.print_progress("  fetching page %s" % page)
+        url = "%s%s" % (self.setting('base-url'), page)
+
+        response = self.session().get(url)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.text)
+
+        journal_list = soup.find('ul', class_="listing")
+        for entry in journal_list.findAll('li'):
+            anchor = entry.find('a')
+            journal_info = {}
+            issn_ok = False
+
+            journal_url = anchor.get('href')
+
+            if journal_url.startswith('/'):
+                journal_url = "https://www.elsevier.com" + journal_url
+
+            journal_info['url'] = journal_url
+            journal_info['title'] = anchor.text.strip()
+
+            if "combined-subscription" in journal_url:
+                continue
+
+            issn_match = re.search("/([0-9a-z]{4}-[0-9a-z]{4})$", journal_url)
+            if issn_match:
+                self.print_progress("  don't need to fetch %s" % journal_url)
+                issn_ok = True
+                issn = issn_match.groups()[0]
+                journal_info['issn'] = issn
+                journals.append(journal_info)
+
+            else:
+                # ISSN is not in url, need to parse journal page. The
+                # session retries pages which fail to load.
+                self.print_progress("  fetching %s" % journal_url)
+                response = self.session().get(journal_url)
+                response.raise_for_status()
+
+                self.print_progress("  fetched. parsing...")
+                journal_soup = BeautifulSoup(response.text)
+                if_table = journal_soup.select(".ifContainer .ifTD")
+                if if_table:
+                    issn_div = if_table[-1]
+                    if "ISSN" in issn_div.text:
+                        issn_ok = True
+                        issn = issn_div.text.replace("ISSN:", "").strip()
+                        journal_info['issn'] = issn
+                        journals.append(journal_info)
+
+                elif journal_soup.find('title').text == "Subjects | Elsevier":
+                    issn_ok = True
+
+                if not issn_ok:
+                    raise Exception("Issn not found in %s." % journal_url)
+
+        return journals
+
     def process(self):
-        filepath = os.path.join(self.cache_dir(), self.setting('data-file'))
-        with open(filepath, 'rb') as f:
+        with self.open_cached(self.setting('data-file')) as f:
             journals = pickle.load(f)
 
         elsevier_list = JournalList.create(name="Elsevier Journals")
-        publisher = Publisher.create(name="Elsevier")
+        publisher = Publisher.create_or_update_by_name("Elsevier")
         for journal_info in journals:
             issn = journal_info['issn']
             params = {
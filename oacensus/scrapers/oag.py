@@ -1,7 +1,8 @@
 from oacensus.models import Article
+from oacensus.models import SQLITE_MAX_VARIABLES
 from oacensus.scraper import ArticleInfoScraper
+from oacensus.utils import normalize_doi
 import json
-import requests
 
 
 class OAG(ArticleInfoScraper):
@@ -11,44 +12,99 @@ class OAG(ArticleInfoScraper):
     Requests information from the OAG API for each article in the oacensus
     database which has a DOI (articles must already be populated from some
     other source).
+
+    License results are kept per DOI in the lookup cache, so only DOIs which
+    are new or whose results are older than lookup-ttl are sent to OAG, in
+    batches of max-items with several batches in flight at once. DOIs which
+    OAG is still processing aren't cached and are asked for again next run.
     """
     aliases = ['oag']
 
     _settings = {
             'base-url' : ("Base url of OAG API", "http://oag.cottagelabs.com/lookup/"),
-            'max-items' : ("Maximum number of items in a single API request.", 1000)
+            'max-items' : ("Maximum number of items in a single API request.", 1000),
+            'concurrency' : 4
             }
 
-    def process(self):
-        api_url = self.setting('base-url')
-        max_items = self.setting('max-items')
-        n_articles = Article.select().count()
-        n_batches = n_articles/max_items+1
+    def result_doi(self, oag_result):
+        identifier = oag_result.get('identifier')
+        if isinstance(identifier, list):
+            identifier = identifier[0] if identifier else None
+        if identifier and identifier.get('id'):
+            return normalize_doi(identifier['id'])
+
+    def license_info(self, license):
+        if license:
+            return {
+                    'open_access' : license[0]['open_access'],
+                    'license' : license[0]['title'].strip()
+                    }
+
+    def fetch_licenses(self, dois):
+        """
+        Posts a batch of DOIs to the OAG API. Returns a dict of DOI to license
+        info, or None where OAG has no license or reported an error.
+        """
+        response = self.session().post(self.setting('base-url'), data = json.dumps(dois))
+        response.raise_for_status()
+        oag_response = response.json()
+
+        licenses = {}
+        for oag_result in oag_response.get('results', []):
+            doi = self.result_doi(oag_result)
+            if doi is not None:
+                licenses[doi] = self.license_info(oag_result.get('license'))
 
-        for i in range(n_batches):
-            self.print_progress("Processing query number %s of %s" % (i, n_batches))
-            articles = Article.select().where(Article.doi).paginate(i, paginate_by=max_items)
-            dois = [article.doi for article in articles]
+        for oag_error in oag_response.get('errors', []):
+            doi = self.result_doi(oag_error)
+            if doi is not None:
+                licenses.setdefault(doi, None)
 
-            response = requests.post(api_url, data = json.dumps(dois))
-            oag_response = json.loads(response.text) 
+        return licenses
 
-            # Make a map using DOIs as keys to easily look up license info later.
-            license_info_by_doi = {}
-            for oag_result in oag_response['results']:
-                license_info_by_doi[oag_result['identifier'][0]['id']] = oag_result['license']
+    def apply_licenses(self, licenses, ids_by_doi):
+        """
+        Writes license info to the articles with each DOI, with one UPDATE
+        for each distinct license. Returns the number of articles updated.
+        """
+        ids_by_license = {}
+        for doi, info in licenses.iteritems():
+            if info is not None:
+                key = (info['open_access'], info['license'])
+                ids_by_license.setdefault(key, []).extend(ids_by_doi[doi])
 
-            for article in articles:
-                license = license_info_by_doi.get(article.doi)
+        for (open_access, license), ids in ids_by_license.iteritems():
+            for i in range(0, len(ids), SQLITE_MAX_VARIABLES - 3):
+                Article.update(
+                        open_access = open_access,
+                        open_access_source = self.alias,
+                        license = license
+                        ).where(Article.id << ids[i:i+SQLITE_MAX_VARIABLES-3]).execute()
+
+        return sum(len(ids) for ids in ids_by_license.itervalues())
+
+    def process(self):
+        ids_by_doi = {}
+        has_doi = (Article.doi != None) & (Article.doi != '')
+        for article_id, doi in Article.select(Article.id, Article.doi).where(has_doi).tuples():
+            ids_by_doi.setdefault(normalize_doi(doi), []).append(article_id)
+
+        dois = sorted(ids_by_doi)
+        max_items = self.setting('max-items')
+        cache = self.lookup_cache()
+        missing = cache.missing(dois)
+        self.metrics['lookups_cached'] = len(dois) - len(missing)
+        self.metrics['lookups_fetched'] = len(missing)
 
-                if not license:
-                    print "  no license info returned for", article
-                    continue
+        batches = [missing[i:i+max_items] for i in range(0, len(missing), max_items)]
+        for i, licenses in enumerate(self.imap(self.fetch_licenses, batches, ordered=False)):
+            self.print_progress("Processed query %s of %s" % (i+1, len(batches)))
+            cache.put_many(licenses)
 
-                self.update_article_with_license_info(article, license)
+        n_updated = 0
+        for i in range(0, len(dois), max_items):
+            batch = dois[i:i+max_items]
+            n_updated += self.apply_licenses(cache.get_many(batch), ids_by_doi)
 
-    def update_article_with_license_info(self, article, license):
-        article.open_access = license[0]['open_access']
-        article.open_access_source = self.alias
-        article.license = license[0]['title'].strip()
-        article.save()
+        print "  %s: license info for %s of %s articles with DOIs" % (
+                self.alias, n_updated, sum(len(ids) for ids in ids_by_doi.itervalues()))
@@ -1,18 +1,48 @@
+from oacensus.matching import TitleMatcher
+from oacensus.matching import find_dois
+from oacensus.matching import find_handle
+from oacensus.models import Article
+from oacensus.models import RepositoryLink
+from oacensus.models import insert_rows
 from oacensus.scraper import Scraper
+from oacensus.utils import normalize_doi
 from oaipmh.client import Client
 from oaipmh.metadata import MetadataRegistry, oai_dc_reader
 import cPickle as pickle
 import os
 import datetime
 
+class BatchClient(Client):
+    """
+    OAI-PMH client whose listRecords returns the first batch of records and
+    a resumption token, rather than a generator over every batch, so a
+    scraper can keep track of how far through the records it has got.
+    """
+    def ListRecords_impl(self, args, tree):
+        return self.buildRecords(args['metadataPrefix'], self.getNamespaces(),
+                self.getMetadataRegistry(), tree)
+
+    def next_batch(self, metadata_prefix, token):
+        """
+        Returns the batch of records for a resumption token and the token for
+        the batch after it, which is None for the last batch.
+        """
+        tree = self.makeRequestErrorHandling(verb='ListRecords', resumptionToken=token)
+        return self.buildRecords(metadata_prefix, self.getNamespaces(),
+                self.getMetadataRegistry(), tree)
+
 class OAIPMH(Scraper):
     """
-    Scrape OAI/PMH repositories.
+    Scrape OAI/PMH repositories and link their records to articles.
+
+    Records are linked to articles with the same DOI or handle, then the
+    remaining records are matched to articles by title (see TitleMatcher).
+    Links are stored as RepositoryLink rows.
 
-    Not finished. Doesn't do anything right now.
     This has some ORA (Oxford University Research Archive) specific stuff in here.
     """
     aliases = ['oai']
+    resumable = True
 
     _settings = {
             'data-file' : ('internal data file for storage', 'oai.pickle'),
@@ -20,14 +50,17 @@ class OAIPMH(Scraper):
             'base-objects-url' : ("URL at which objects can be accessed by uuid.", None),
             'from' : ( "'from' parameter, in \"YYYY-MM-DD\" format", None ),
             'until' : ( "'until' parameter, in \"YYYY-MM-DD\" format", None ),
-            'set' : ("'set' parameter", None)
+            'set' : ("'set' parameter", None),
+            'match-threshold' : ("Minimum similarity of normalized titles for a title match.", 0.9),
+            'max-block-size' : ("Title words found in more articles than this aren't used to find candidate matches.", 1000),
+            'processes' : ("Number of processes for title matching, 0 for one per core.", 0)
           }
 
     def scrape(self):
         registry = MetadataRegistry()
         registry.registerReader('oai_dc', oai_dc_reader)
         url = self.setting('pmh-endpoint')
-        client = Client(url, registry)
+        client = BatchClient(url, registry)
 
         print "  OAI Repository", url
         print "  Available sets:"
@@ -51,73 +84,184 @@ class OAIPMH(Scraper):
             date_args = [int(arg) for arg in oai_until.split("-")]
             kwargs['until'] = datetime.datetime(*date_args)
 
-        records = [r for r in client.listRecords(metadataPrefix='oai_dc', **kwargs)]
+        # Each batch of records is a unit of work, recorded along with the
+        # resumption token for the next batch, so an interrupted scrape
+        # carries on from the last complete batch.
+        completed = self.resume()
+        n_batches = len(completed)
+        if n_batches == 0:
+            records, token = client.listRecords(metadataPrefix='oai_dc', **kwargs)
+            self.save_batch(0, records, token)
+            n_batches = 1
+        else:
+            token = completed[self.batch_unit(n_batches - 1)]
+
+        while token is not None:
+            print "  fetching batch", n_batches
+            records, token = client.next_batch('oai_dc', token)
+            self.save_batch(n_batches, records, token)
+            n_batches += 1
+
+        records = []
+        for i in range(n_batches):
+            with open(self.batch_filepath(i), 'rb') as f:
+                records.extend(pickle.load(f))
 
         data_filepath = os.path.join(self.work_dir(), self.setting('data-file'))
         with open(data_filepath, 'wb') as f:
             print "  picking", len(records), "records"
             pickle.dump(records, f)
 
+        # Batches are only removed once they are safely in the data file,
+        # as the progress log still says they are done.
+        for i in range(n_batches):
+            os.remove(self.batch_filepath(i))
+
+    def batch_unit(self, i):
+        return "batch:%05d" % i
+
+    def batch_filepath(self, i):
+        return os.path.join(self.work_dir(), "oai-batch-%05d.pickle" % i)
+
+    def record_info(self, record):
+        """
+        Picklable copy of the parts of a record we use. Records themselves
+        hold references to lxml elements, which can't be pickled.
+        """
+        header, metadata, _ = record
+        if metadata is None:
+            m = None
+        else:
+            m = dict((k, [unicode(v) for v in values]) for k, values in metadata.getMap().iteritems())
+        return {
+                'identifier' : header.identifier(),
+                'datestamp' : header.datestamp(),
+                'metadata' : m
+                }
+
+    def save_batch(self, i, records, token):
+        with open(self.batch_filepath(i), 'wb') as f:
+            pickle.dump([self.record_info(record) for record in records], f)
+        self.mark_completed(self.batch_unit(i), token)
+
+    def record_match_info(self, record):
+        """
+        Title, identifiers and link details of a record, or None for deleted
+        records and theses.
+        """
+        m = record['metadata']
+        if m is None:
+            # Deleted record.
+            return None
+
+        # Skip over theses.
+        if u'thesis          ' in m.get('type', []):
+            return None
+
+        identifiers = m.get('identifier', []) + m.get('relation', [])
+
+        urn = None
+        dois = set()
+        handles = set()
+        for identifier in identifiers:
+            if identifier.startswith('uuid:'):
+                urn = identifier.strip()
+            elif identifier.startswith('urn:uuid:'):
+                urn = identifier.replace('urn:', '').strip()
+            dois.update(find_dois(identifier))
+            handle = find_handle(identifier)
+            if handle is not None:
+                handles.add(handle)
+
+        base_objects_url = self.setting('base-objects-url')
+        if base_objects_url and urn:
+            url = "%s%s" % (base_objects_url, urn)
+        else:
+            url = next((i.strip() for i in identifiers if i.startswith('http')), None)
+
+        titles = [title.strip() for title in m.get('title', []) if title.strip()]
+        rights = [license.strip() for license in m.get('rights', [])]
+
+        return {
+                'record' : record['identifier'],
+                'title' : titles[0] if titles else None,
+                'dois' : dois,
+                'handles' : handles,
+                'url' : url,
+                'license' : rights[0] if rights else None
+                }
+
+    def link(self, info, article_id, match_method, score=None):
+        return {
+                'article' : article_id,
+                'repository' : self.setting('pmh-endpoint'),
+                'record' : info['record'],
+                'url' : info['url'],
+                'license' : info['license'],
+                'match_method' : match_method,
+                'score' : score,
+                'source' : self.alias
+                }
+
+    def identifier_links(self, infos):
+        """
+        Links for records sharing a DOI or handle with articles. Returns the
+        links and the records which weren't matched.
+        """
+        ids_by_doi = {}
+        ids_by_handle = {}
+        query = Article.select(Article.id, Article.doi, Article.url)
+        for article_id, doi, url in query.tuples():
+            if doi:
+                ids_by_doi.setdefault(normalize_doi(doi), []).append(article_id)
+            handle = url and find_handle(url)
+            if handle:
+                ids_by_handle.setdefault(handle, []).append(article_id)
+
+        links = []
+        unmatched = []
+        for info in infos:
+            matched = set()
+            for doi in info['dois']:
+                for article_id in ids_by_doi.get(doi, []):
+                    if not article_id in matched:
+                        matched.add(article_id)
+                        links.append(self.link(info, article_id, 'doi'))
+            for handle in info['handles']:
+                for article_id in ids_by_handle.get(handle, []):
+                    if not article_id in matched:
+                        matched.add(article_id)
+                        links.append(self.link(info, article_id, 'handle'))
+            if not matched:
+                unmatched.append(info)
+
+        return links, unmatched
+
     def process(self):
-        data_filepath = os.path.join(self.cache_dir(), self.setting('data-file'))
-        with open(data_filepath, 'rb') as f:
+        with self.open_cached(self.setting('data-file')) as f:
             records = pickle.load(f)
 
-        oai_info = []
-        for record in records:
-            header, meta, _ = record
-            m = meta.getMap()
-
-            # Skip over theses.
-            if u'thesis          ' in m['type']:
-                continue
-
-            title = m['title'][0].strip()
-
-            if len(m['date']) > 0:
-                date = m['date'][0].strip()
-            else:
-                date = None
-
-            license = None
-
-            if m['rights']:
-                license = m['rights'][0].strip()
-
-            urn = None
-            for identifier in m['identifier']:
-                if identifier.startswith('uuid:'):
-                    urn = identifier.strip()
-                elif identifier.startswith('urn:uuid:'):
-                    urn = identifier.replace('urn:', '').strip()
-                else:
-                    pass
-
-            object_url = "%s%s" % (self.setting('base-objects-url'), urn)
-
-            oai_info.append({
-                "authors" : "; ".join(author.strip() for author in m['creator']),
-                "title" : title,
-                "url url" : object_url,
-                "license" : license,
-                "date" : date
-            })
-
-        # now what? try to match on titles?
-        # https://pypi.python.org/pypi/jellyfish/0.1.2
-        # http://nltk.googlecode.com/svn/trunk/doc/api/nltk.metrics.distance-module.html
-
-        import jellyfish
-
-        from oacensus.models import Article
-        for article in Article.select():
-            for info in oai_info:
-                try:
-                    jd = jellyfish.jaro_winkler(article.title, info['title'])
-
-                    if jd > 0.8:
-                        print article.title
-                        print info['title']
-                        print "Jaro Winkler Distance:", jd
-                except (UnicodeDecodeError, UnicodeEncodeError):
-                    pass
+        infos = [info for info in (self.record_match_info(r) for r in records) if info is not None]
+
+        links, unmatched = self.identifier_links(infos)
+        insert_rows(RepositoryLink, links, ignore_duplicates=True)
+        print "  %s: matched %s records by DOI or handle" % (self.alias, len(infos) - len(unmatched))
+
+        # Remaining records are matched by title, comparing each title only
+        # with the articles in its blocks of the title token index.
+        matcher = TitleMatcher(
+                Article.select(Article.id, Article.title).tuples(),
+                threshold=self.setting('match-threshold'),
+                max_block_size=self.setting('max-block-size'))
+
+        by_record = dict((info['record'], info) for info in unmatched)
+        titles = [(info['record'], info['title']) for info in unmatched if info['title']]
+        n_matched = 0
+        for matches in matcher.match_all(titles, self.setting('processes')):
+            links = [self.link(by_record[record], article_id, 'title', score)
+                    for record, article_id, score in matches]
+            insert_rows(RepositoryLink, links, ignore_duplicates=True)
+            n_matched += len(links)
+            self.print_progress("Matched %s of %s records by title" % (n_matched, len(titles)))
+
+        print "  %s: matched %s of %s records by title" % (self.alias, n_matched, len(titles))
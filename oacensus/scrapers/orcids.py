@@ -25,36 +25,42 @@ class Orcid(ArticleScraper):
         else:
             orcids = self.setting('orcid')
 
-        responses = [orcid.get(orcd) for orcd in orcids]
+        responses = []
+        for orcd in orcids:
+            responses.append(orcid.get(orcd))
+            self.count_request()
 
         orcid_filepath = os.path.join(self.work_dir(), self.setting('orcid-data-file'))
         with open(orcid_filepath, 'wb') as f:
             pickle.dump(responses, f)
 
     def process(self):
-        orcid_filepath = os.path.join(self.cache_dir(), self.setting('orcid-data-file'))
-        with open(orcid_filepath, 'rb') as f:
+        with self.open_cached(self.setting('orcid-data-file')) as f:
             responses = pickle.load(f)
 
         for response in responses:
             args = (response.orcid, response.given_name, response.family_name)
             list_name = "ORCID %s  Author: %s %s" % args
             article_list = ArticleList.create(name = list_name, orcid = response.orcid)
+            article_list.add_articles(self.publication_articles(response))
 
-            for pub in response.publications:
-                doi = None
-                if pub.external_ids:
-                    for ext_id in pub.external_ids:
-                        if ext_id.type == "DOI":
-                            doi = ext_id.id
-
-                article = Article.create_or_update_by_doi({
-                    'source' : self.alias,
-                    'doi' : doi,
-                    'url' : pub.url,
-                    'title' : pub.title
-                    })
+            return article_list
 
-                article_list.add_article(article)
+    def publication_articles(self, response):
+        """
+        Yields an Article for each publication in an ORCID response, updating
+        any existing article with the same DOI.
+        """
+        for pub in response.publications:
+            doi = None
+            if pub.external_ids:
+                for ext_id in pub.external_ids:
+                    if ext_id.type == "DOI":
+                        doi = ext_id.id
 
-            return article_list
+            yield Article.create_or_update_by_doi({
+                'source' : self.alias,
+                'doi' : doi,
+                'url' : pub.url,
+                'title' : pub.title
+                })
@@ -1,26 +1,33 @@
 from oacensus.exceptions import APIError
-from oacensus.models import Article
 from oacensus.models import ArticleList
 from oacensus.models import Journal
 from oacensus.scraper import ArticleScraper
+from oacensus.utils import iterparse_elements
 import dateutil.parser
 import os
-import requests
-import time
 import xml.etree.ElementTree as ET
 
 class NCBI(ArticleScraper):
     """
     Base class for scrapers querying NCBI databases (including pubmed).
+
+    Batches of results are fetched concurrently. Each completed batch is
+    marked as a completed unit of work, so if a scrape is interrupted the
+    next run only fetches the batches which are missing.
     """
     aliases = []
+    resumable = True
+
+    # Root element of efetch results, used to check a batch is complete.
+    result_set_tag = None
     _settings = {
             "base-url" : ("Base url of API.", "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/"),
             "ncbi-db" : ("Name of NCBI database to query.", None),
             "search" : ("Search query to include.", None),
             "filepattern" : ("Names of files which hold data in cache.", "data_%04d.xml"),
             "ret-max" : ("Maximum number of entries to return in any single query.", 10000),
-            "delay" : ("Time in seconds to delay between API requests.", 1),
+            "rate-limit" : 3,
+            "concurrency" : 3,
             "initial-ret-max" : ("Maximum number of entries to return in the initial query.", 5)
             }
 
@@ -58,7 +65,7 @@ class NCBI(ArticleScraper):
                 'retMax' : self.setting('initial-ret-max')
                 }
 
-        result = requests.get(
+        result = self.session().get(
                 self.search_url(),
                 params=self.search_params(params)
                 )
@@ -81,8 +88,6 @@ class NCBI(ArticleScraper):
         return os.path.join(self.work_dir(), self.setting('filepattern') % i)
 
     def fetch_batch(self, i, retstart, retmax, web_env, query_key):
-        self.print_progress("waiting requested delay time...")
-        time.sleep(self.setting('delay'))
         msg = "fetching values %s through %s..." % (retstart, retstart+retmax-1)
         self.print_progress(msg)
 
@@ -94,29 +99,35 @@ class NCBI(ArticleScraper):
                 'retmode' : 'xml'
                 }
 
-        result = requests.get(
-                self.fetch_url(),
-                params=self.search_params(params),
-                stream=True
-                )
+        # Download under a temporary name so a batch file only exists once
+        # it is complete.
+        tmp_path = "%s.part" % self.data_filepath(i)
+        self.download(self.fetch_url(), tmp_path, self.search_params(params))
+
+        if self.result_set_tag is not None:
+            with open(tmp_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 1024))
+                if not "</%s>" % self.result_set_tag in f.read():
+                    raise APIError("Incomplete results fetching values %s through %s." % (retstart, retstart+retmax-1))
 
-        with open(self.data_filepath(i), "wb") as f:
-            for block in result.iter_content(1024):
-                if not block:
-                    break
-                f.write(block)
+        os.rename(tmp_path, self.data_filepath(i))
+        return i
 
     def scrape(self):
         count, web_env, query_key = self.initial_search()
-
-        i = 0
-        retstart = 0
         retmax = self.setting('ret-max')
 
-        while retstart < count:
-            self.fetch_batch(i, retstart, retmax, web_env, query_key)
-            retstart += retmax
-            i += 1
+        # Batches from an earlier scrape are only any use if the search still
+        # returns the same results.
+        completed = self.resume({'count' : count, 'retmax' : retmax})
+        batches = [i for i in range(0, (count + retmax - 1) // retmax) if not str(i) in completed]
+
+        def fetch(i):
+            return self.fetch_batch(i, i * retmax, retmax, web_env, query_key)
+
+        for i in self.imap(fetch, batches, ordered=False):
+            self.mark_completed(str(i))
 
     def parse_date(self, entry):
         if entry is not None:
@@ -141,25 +152,27 @@ class Pubmed(NCBI):
     articles returned from pubmed matching the [required] search query.
     """
     aliases = ['pubmed']
+    result_set_tag = "PubmedArticleSet"
     _settings = {
             "ncbi-db" : "pubmed"
             }
 
     def process(self):
-
         article_list = ArticleList.create(
                 name = "pubmed search: %s" % self.setting('search')
                 )
+        article_list.add_articles(self.parse_articles())
 
-        for filename in os.listdir(self.cache_dir()):
-            filepath = os.path.join(self.cache_dir(), filename)
-            with open(filepath, 'rb') as f:
-                tree = ET.parse(f)
-                root = tree.getroot()
-                assert root.tag == "PubmedArticleSet"
-                for pubmed_article in root:
-                    assert pubmed_article.tag == "PubmedArticle"
+        print "  ", article_list
+        return article_list
 
+    def parse_articles(self):
+        """
+        Yields a dict of article fields for each article in the cached batches.
+        """
+        for filename in self.cached_filenames():
+            with self.open_cached(filename) as f:
+                for pubmed_article in iterparse_elements(f, "PubmedArticle"):
                     pubmed_data = pubmed_article.find("PubmedData")
                     medline_citation = pubmed_article.find("MedlineCitation")
                     article_entry = medline_citation.find("Article")
@@ -212,30 +225,25 @@ class Pubmed(NCBI):
                     pubmed_id = medline_citation.findtext("PMID")
 
                     nihm_id = None
-                    pcm_id = None
+                    pmc_id = None
                     for other_id in medline_citation.findall("OtherID"):
                         other_id_text = other_id.text
                         if other_id_text.startswith("NIHM"):
                             nihm_id = other_id_text
                         elif other_id_text.startswith("PMC"):
-                            pcm_id = other_id_text
+                            pmc_id = other_id_text
                         else:
                             pass
 
                     assert title is not None
 
-                    article = Article.create(
-                            title = title,
-                            source = self.alias,
-                            doi = doi,
-                            journal = journal,
-                            date_published = date_published,
-                            pubmed_id = pubmed_id,
-                            nihm_id = nihm_id,
-                            pcm_id = pcm_id
-                            )
-
-                    article_list.add_article(article)
-
-        print "  ", article_list
-        return article_list
+                    yield {
+                            'title' : title,
+                            'source' : self.alias,
+                            'doi' : doi,
+                            'journal' : journal,
+                            'date_published' : date_published,
+                            'pubmed_id' : pubmed_id,
+                            'nihm_id' : nihm_id,
+                            'pmc_id' : pmc_id
+                            }
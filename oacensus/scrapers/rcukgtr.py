@@ -2,8 +2,6 @@ from oacensus.exceptions import APIError
 from oacensus.scraper import Scraper
 import dateutil.parser
 import os
-import requests
-import time
 import json
 import datetime
 import re
@@ -15,57 +13,118 @@ class GTR(Scraper):
     Base class for scrapers querying RCUK Gateway to Research
     """
     aliases = ['gtr', 'rcuk']
+    resumable = True
     _settings = {
             "base-url" : ("Base URL of API", "http://gtr.rcuk.ac.uk/gtr/api/"),
             "base-headers" : ("HTTP Accept settings", {'Accept' : 'application/vnd.rcuk.gtr.json-v1'}),
             "data-file" : ("Name of cache file for data", "gtr-pubs.json"),
-            "delay" : ("Time in seconds between API requests.", 0.5),
+            "rate-limit" : 2,
+            "concurrency" : 8,
             "search-type" : ("One of 'person', 'project', 'council', or 'organisation'.", None),
             "search" : ("Term to search for. Must be a name, project code, council abbreviation, or GTR organisation ID.", None),
             "testing" : ("Reduce number of live API calls for testing purposes", False)
             }
 
-    def fetch_articles_for_project(self, gtr_project_id):
+    def fetch_page(self, url, page=1, params=None):
         """
-        Obtain articles given a GTR Project ID
+        Fetch a single page of a GtR API listing, returns the decoded JSON.
         """
-        self.print_progress("waiting for delay period")
-        time.sleep (self.setting('delay'))
-        msg = "collecting articles for project %s" % (gtr_project_id)
-        self.print_progress(msg)
-
-        url = "%sprojects/%s/outcomes/publications" % (self.setting('base-url'),
-                                                       gtr_project_id)
-
-        result = requests.get(url, headers = self.setting('base-headers'))
-
-        totalpages = result.json().get('totalPages')
-        publications = []
-        publications.extend(result.json().get('publication'))
-
-        params = {}
-        page = 2
-        while page <= totalpages:
+        params = dict(params or {})
+        if page > 1:
             params['p'] = page
-            result = requests.get(
+
+        result = self.session().get(
                     url,
                     params = params,
                     headers = self.setting('base-headers')
                             )
-            publications.extend(result.json().get('publication'))
+        result.raise_for_status()
+        return result.json()
+
+    def last_page(self, data):
+        """
+        Number of the last page to fetch for a listing, given its first page.
+        """
+        totalpages = data.get('totalPages') or 1
+        if self.setting('testing') == True:
+            return min(totalpages, 4)
+        return totalpages
+
+    def fetch_all_pages(self, url, params=None):
+        """
+        Yields the decoded JSON of each page of a listing. Once the first page
+        says how many there are, the rest are fetched concurrently.
+        """
+        first = self.fetch_page(url, 1, params)
+        yield first
+
+        pages = range(2, self.last_page(first) + 1)
+        for data in self.imap(lambda page: self.fetch_page(url, page, params), pages):
+            yield data
+
+    def publications_url(self, gtr_project_id):
+        return "%sprojects/%s/outcomes/publications" % (self.setting('base-url'),
+                                                        gtr_project_id)
 
-            if self.setting('testing') == True and page > 3:
-                page = totalpages
-            page+=1
+    def fetch_articles_for_project(self, gtr_project_id):
+        """
+        Obtain articles given a GTR Project ID
+        """
+        msg = "collecting articles for project %s" % (gtr_project_id)
+        self.print_progress(msg)
 
+        publications = []
+        for data in self.fetch_all_pages(self.publications_url(gtr_project_id)):
+            publications.extend(data.get('publication') or [])
         return publications
 
+    def fetch_articles_for_projects(self, project_ids):
+        """
+        Yields (project id, publications) for each project once all of its
+        pages have arrived.
+
+        The first page for each project is fetched concurrently, then the
+        remaining pages of all projects which have more than one, so the
+        concurrency is spread across the whole harvest rather than a single
+        project at a time.
+        """
+        def first_page(gtr_project_id):
+            return (gtr_project_id, self.fetch_page(self.publications_url(gtr_project_id)))
+
+        def later_page(project_page):
+            gtr_project_id, page = project_page
+            return (gtr_project_id, page, self.fetch_page(self.publications_url(gtr_project_id), page))
+
+        later_pages = []
+        pending = {}
+        for i, (gtr_project_id, data) in enumerate(self.imap(first_page, project_ids)):
+            self.print_progress("collected articles for project %s of %s" % (i + 1, len(project_ids)))
+            last_page = self.last_page(data)
+            if last_page == 1:
+                yield (gtr_project_id, data.get('publication') or [])
+            else:
+                pending[gtr_project_id] = {1 : data.get('publication') or []}
+                for page in range(2, last_page + 1):
+                    later_pages.append((gtr_project_id, page))
+
+        if later_pages:
+            self.print_progress("collecting %s further pages of articles" % len(later_pages))
+
+        expected = dict((gtr_project_id, 1) for gtr_project_id in pending)
+        for gtr_project_id, page in later_pages:
+            expected[gtr_project_id] += 1
+
+        for gtr_project_id, page, data in self.imap(later_page, later_pages, ordered=False):
+            pages = pending[gtr_project_id]
+            pages[page] = data.get('publication') or []
+            if len(pages) == expected[gtr_project_id]:
+                del pending[gtr_project_id]
+                yield (gtr_project_id, [pub for n in sorted(pages) for pub in pages[n]])
+
     def get_project_id_from_grant_code(self, grantreference):
         """
         Obtain the GTR ID for a project from the RCUK grant code.
         """
-        self.print_progress("waiting for delay period")
-        time.sleep (self.setting('delay'))
         msg = "collecting GTR ID for project %s" % (grantreference)
         self.print_progress(msg)
 
@@ -75,7 +134,7 @@ class GTR(Scraper):
                 }
 
         url = "%sprojects?" % (self.setting('base-url'))
-        result = requests.get(
+        result = self.session().get(
                     url,
                     params = params,
                     headers = self.setting('base-headers')
@@ -89,8 +148,6 @@ class GTR(Scraper):
         """
         Obtain the GTR Project IDs for a specific funder.
         """
-        self.print_progress("waiting for delay period")
-        time.sleep (self.setting('delay'))
         msg = "collecting GTR IDs for %s" % (funder)
         self.print_progress(msg)
 
@@ -101,75 +158,31 @@ class GTR(Scraper):
                 }
 
         url = "%sfunds?" % (self.setting('base-url'))
-        result = requests.get(
-                    url,
-                    params = params,
-                    headers = self.setting('base-headers')
-                            )
-
-        totalpages = result.json().get('totalPages')
         projects = []
-        for fund in result.json().get('fund'):
-            for link in fund.get('links').get('link'):
-                if link.get('rel') == 'FUNDED':
-                    projects.append(self.gtr_url_to_id(link.get('href')))
-
-        page = 2
-        while page <= totalpages:
-            params['p'] = page
-            result = requests.get(
-                    url,
-                    params = params,
-                    headers = self.setting('base-headers')
-                            )
-            for fund in result.json().get('fund'):
+        for data in self.fetch_all_pages(url, params):
+            for fund in data.get('fund'):
                 for link in fund.get('links').get('link'):
                     if link.get('rel') == 'FUNDED':
                         projects.append(self.gtr_url_to_id(link.get('href')))
-            if self.setting('testing') == True and page > 3:
-                page = totalpages
-            page+=1
 
         return projects
 
-
     def get_project_ids_from_org_id(self, org_id):
         """
         Obtain GTR Grant IDs for an organisation ID
         """
 
-        self.print_progress("waiting for delay period")
-        time.sleep (self.setting('delay'))
         msg = "collecting GTR grant IDs for %s" % (org_id)
         self.print_progress(msg)
 
         url = "%sorganisations/%s/projects" % (self.setting('base-url'),
                                                 org_id)
 
-        params={}
-        result = requests.get(
-                    url,
-                    headers = self.setting('base-headers')
-                            )
-        totalpages = result.json().get('totalPages')
         projects = []
-        for proj in result.json().get('project'):
-            projects.append(proj.get('id'))
-
-        page = 2
-        while page <= totalpages:
-            params['p'] = page
-            result = requests.get(
-                    url,
-                    headers = self.setting('base-headers')
-                            )
-            for proj in result.json().get('project'):
+        for data in self.fetch_all_pages(url):
+            for proj in data.get('project'):
                 projects.append(proj.get('id'))
 
-            if self.setting('testing') == True and page > 3:
-                page = totalpages
-            page+=1
-
         return projects
 
     def gtr_url_to_id(self, href):
@@ -184,47 +197,74 @@ class GTR(Scraper):
         doi = DOI_REGEX.findall(href)[0]
         return doi
 
-    def scrape(self):
+    def search_project_ids(self):
         """
-        Scrape method for various search types
+        GTR IDs of the projects matching the search.
         """
-
         current_request = self.setting('search-type')
         current_search_term = self.setting('search')
         if current_request == 'council':
-            result = self.get_project_ids_from_funder_name(current_search_term)
-            current_request = 'project_from_id'
-            project_list = result
+            return self.get_project_ids_from_funder_name(current_search_term)
 
         if current_request == 'organisation':
-            result = self.get_project_ids_from_org_id(current_search_term)
-            current_request = 'project_from_id'
-            project_list = result
+            return self.get_project_ids_from_org_id(current_search_term)
 
         if current_request == 'project':
-            project_id = self.get_project_id_from_grant_code(current_search_term)
-            current_request = 'project_from_id'
-            project_list = [project_id]
-
-        if current_request == 'project_from_id':
-            publications = []
-            for project in project_list:
-                publications.extend(self.fetch_articles_for_project(project))
+            return [self.get_project_id_from_grant_code(current_search_term)]
 
         if current_request == 'person':
             raise NotImplementedError #TODO
 
+    def scrape(self):
+        """
+        Scrape method for various search types
+
+        The project list and each project's publications are units of work,
+        so an interrupted harvest carries on with the projects it hadn't
+        finished. Each project's publications are written to their own file
+        in the work dir as they arrive, and joined into the data file at the
+        end one file at a time.
+        """
+        completed = self.resume()
+        if 'projects' in completed:
+            project_list = completed['projects']
+        else:
+            project_list = self.search_project_ids()
+            self.mark_completed('projects', project_list)
+
+        positions = {}
+        for i, gtr_project_id in enumerate(project_list):
+            positions.setdefault(gtr_project_id, i)
+        remaining = [p for p in project_list if not "project:%s" % p in completed]
+        for gtr_project_id, publications in self.fetch_articles_for_projects(remaining):
+            with open(self.project_filepath(positions[gtr_project_id]), 'wb') as f:
+                json.dump(publications, f)
+            self.mark_completed("project:%s" % gtr_project_id)
+
         data_file = os.path.join(self.work_dir(), self.setting('data-file'))
         with open(data_file, 'wb') as f:
-            json.dump(publications, f)
+            f.write("[")
+            first = True
+            for gtr_project_id in project_list:
+                with open(self.project_filepath(positions[gtr_project_id]), 'rb') as project_file:
+                    publications = json.load(project_file)
+                for pub in publications:
+                    if not first:
+                        f.write(",\n")
+                    json.dump(pub, f)
+                    first = False
+            f.write("]\n")
+
+        for i in set(positions.itervalues()):
+            os.remove(self.project_filepath(i))
+
+    def project_filepath(self, i):
+        return os.path.join(self.work_dir(), "gtr-project-%05d.json" % i)
 
     def process(self):
         from oacensus.models import ArticleList
-        from oacensus.models import Article
-        from oacensus.models import Journal
 
-        data_file = os.path.join(self.cache_dir(), self.setting('data-file'))
-        with open(data_file, 'rb') as f:
+        with self.open_cached(self.setting('data-file')) as f:
             publications = json.load(f)
 
         article_list = ArticleList.create(
@@ -233,6 +273,16 @@ class GTR(Scraper):
                                 self.setting('search')
                                                 )
                                         )
+        article_list.add_articles(self.parse_articles(publications))
+
+        print "  ", article_list
+        return article_list
+
+    def parse_articles(self, publications):
+        """
+        Yields a dict of article fields for each journal publication.
+        """
+        from oacensus.models import Journal
 
         for pub in publications:
             journal_title = pub.get('journalTitle') if pub.get('journalTitle') is not 'null' else None
@@ -262,17 +312,12 @@ class GTR(Scraper):
 
                 assert title is not None
 
-                article = Article.create(
-                                title = title,
-                                source = self.alias,
-                                doi = doi,
-                                journal = journal,
-                                date_published = date_published
-                                )
-
-                article_list.add_article(article)
-
-        print "  ", article_list
-        return article_list
+                yield {
+                        'title' : title,
+                        'source' : self.alias,
+                        'doi' : doi,
+                        'journal' : journal,
+                        'date_published' : date_published
+                        }
 
 
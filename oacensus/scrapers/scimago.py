@@ -1,6 +1,5 @@
 from bs4 import BeautifulSoup
 from oacensus.scraper import JournalScraper
-from oacensus.utils import urlretrieve
 import os
 
 class ScimagoJournals(JournalScraper):
@@ -33,12 +32,10 @@ class ScimagoJournals(JournalScraper):
 
         filepath = os.path.join(self.work_dir(), self.setting('filename'))
         url = self.setting('base-url')
-        urlretrieve(url, params, filepath)
+        self.download(url, filepath, params)
 
     def process(self):
-        filepath = os.path.join(self.cache_dir(), self.setting('filename'))
-
-        with open(filepath, 'rb') as f:
+        with self.open_cached(self.setting('filename')) as f:
             soup = BeautifulSoup(f)
 
         for i, row in enumerate(soup.find_all("tr")):
@@ -2,7 +2,6 @@ from oacensus.models import JournalList
 from oacensus.models import Publisher
 from oacensus.scraper import JournalScraper
 import os
-import urllib
 import xlrd
 
 class WileyScraper(JournalScraper):
@@ -18,12 +17,11 @@ class WileyScraper(JournalScraper):
 
     def scrape(self):
         filepath = os.path.join(self.work_dir(), self.setting('data-file'))
-        urllib.urlretrieve(self.setting('url'), filepath)
+        self.download(self.setting('url'), filepath)
 
     def process(self):
-        filepath = os.path.join(self.cache_dir(), self.setting('data-file'))
-
-        wb = xlrd.open_workbook(filepath, on_demand=True)
+        with self.open_cached(self.setting('data-file')) as f:
+            wb = xlrd.open_workbook(file_contents=f.read(), on_demand=True)
         sheet = wb.sheet_by_index(0)
 
         headers = sheet.row_values(self.setting('header-row'), 0, 15)
@@ -41,7 +39,7 @@ class WileyScraper(JournalScraper):
         assert headers[subject_col] == "General Subject Category"
 
         journal_list = JournalList.create(name="Wiley Journals")
-        publisher = Publisher.create(name="Wiley")
+        publisher = Publisher.create_or_update_by_name("Wiley")
 
         start = self.setting('header-row') + 1
         found_end = False
@@ -0,0 +1,95 @@
+from oacensus.ratelimit import rate_limiter
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import NewConnectionError
+import random
+import requests
+import threading
+import time
+
+# Statuses which mean the server is overloaded or briefly unavailable, so
+# the same request may well succeed if tried again a little later.
+RETRY_STATUSES = set([429, 500, 502, 503, 504])
+
+# Methods which can be sent again after a connection failed part way through
+# a request, as sending them twice has the same effect as sending them once.
+IDEMPOTENT_METHODS = set(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'])
+
+def failed_to_connect(error):
+    """
+    Whether a requests exception means the request never reached the server.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+class RetrySession(requests.Session):
+    """
+    requests Session which keeps connections to each host alive in a pool,
+    applies a default timeout, and retries requests which fail with a
+    connection error, a timeout or one of RETRY_STATUSES. Requests with
+    methods which aren't idempotent, such as POST, are only retried after a
+    connection error if they never reached the server.
+
+    Retries wait for an exponentially increasing delay starting at backoff
+    seconds, with random jitter so concurrent clients don't retry in step,
+    or for as long as a Retry-After header asks if that is longer.
+
+    If rate is set, every attempt first waits for the host's shared token
+    bucket, see oacensus.ratelimit.
+    """
+    def __init__(self, timeout=60, retries=5, backoff=1.0, max_backoff=120, pool_size=10,
+            rate=None, burst=1):
+        requests.Session.__init__(self)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.burst = burst
+        self.rate_limited_seconds = 0.0
+        self.stats_lock = threading.Lock()
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def backoff_delay(self, attempt, response=None):
+        """
+        Seconds to wait before retry number attempt (counting from 0).
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, min(self.max_backoff, int(retry_after)))
+
+        return delay
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            if self.rate:
+                waited = rate_limiter.acquire(url, self.rate, self.burst)
+                with self.stats_lock:
+                    self.rate_limited_seconds += waited
+
+            try:
+                response = requests.Session.request(self, method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retryable = method.upper() in IDEMPOTENT_METHODS or failed_to_connect(e)
+                if attempt >= self.retries or not retryable:
+                    raise
+                response = None
+            else:
+                if not response.status_code in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                response.close()
+
+            time.sleep(self.backoff_delay(attempt, response))
+            attempt += 1
@@ -1,27 +1,129 @@
-import urlparse
+from oacensus.exceptions import UserFeedback
+import re
 import requests
+import urlparse
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 defaults = {
+    'benchdir' : '.oacensus/bench/',
+    'cachecodec' : 'gzip',
     'cachedir' : '.oacensus/cache/',
+    'cachelink' : 'off',
+    'cassettedir' : '.oacensus/cassettes/',
+    'checkpointdir' : '.oacensus/checkpoints/',
     'config' : 'oacensus.yaml',
+    'dbcache' : '64M',
+    'dbcommit' : 0,
     'dbfile' : 'oacensus.sqlite3',
+    'dbjournal' : 'wal',
+    'dbsync' : 'normal',
+    'metricsdir' : '.oacensus/metrics/',
     'profile' : False,
     'progress' : False,
+    'rebuild' : False,
     'reports' : '',
-    'workdir' : '.oacensus/work/'
+    'workdir' : '.oacensus/work/',
+    'workers' : 4
 }
 
-def urlretrieve(url, params, filepath):
+def urlretrieve(url, params, filepath, session=requests):
     """
     Write url reusults to a file, using python-requetss for nice handling of params.
     """
-    result = requests.get(url, params=params, stream=True)
+    result = session.get(url, params=params, stream=True)
+    result.raise_for_status()
     with open(filepath, "wb") as f:
         for block in result.iter_content(1024):
             if not block:
                 break
             f.write(block)
 
+def iterparse_elements(f, tag):
+    """
+    Yields each element named tag in an XML file as soon as it has been
+    parsed, and discards it once the caller is finished with it, so memory
+    use stays flat however large the file is. Elements with other names are
+    skipped. Uses lxml if it is installed, otherwise cElementTree.
+    """
+    if lxml_etree is not None:
+        for event, elem in lxml_etree.iterparse(f, events=('end',), tag=tag, huge_tree=True):
+            yield elem
+            elem.clear()
+            # Also drop earlier siblings, including skipped elements.
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    else:
+        context = ET.iterparse(f, events=('start', 'end'))
+        event, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag == tag:
+                yield elem
+                root.clear()
+
+def iter_universal_lines(f, block_size=64*1024):
+    """
+    Yields the lines of a byte stream as universal newlines mode would,
+    treating '\\r\\n', '\\r' and '\\n' as line endings and ending each line
+    with '\\n'. Unlike decoded text, nothing else counts as a line break.
+    """
+    pending = ""
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        pending += block
+        # A trailing carriage return may be the first half of a CRLF.
+        end = len(pending) - 1 if pending.endswith("\r") else len(pending)
+        lines = re.split("\r\n|\r|\n", pending[:end])
+        for line in lines[:-1]:
+            yield line + "\n"
+        pending = lines[-1] + pending[end:]
+
+    lines = re.split("\r\n|\r|\n", pending)
+    for line in lines[:-1]:
+        yield line + "\n"
+    if lines[-1]:
+        yield lines[-1]
+
+SIZE_UNITS = {'' : 1, 'K' : 1024, 'M' : 1024**2, 'G' : 1024**3, 'T' : 1024**4}
+DURATION_UNITS = {'' : 1, 's' : 1, 'm' : 60, 'h' : 60*60, 'd' : 24*60*60, 'w' : 7*24*60*60}
+
+def parse_size(raw):
+    """
+    Parse a size like 500, '200M' or '1.5G' into a number of bytes.
+    """
+    match = re.match("^([0-9.]+)\\s*([KMGT]?)B?$", str(raw).strip(), re.IGNORECASE)
+    if not match:
+        raise UserFeedback("Can't parse size '%s', use e.g. '500M' or '20G'." % raw)
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+def parse_duration(raw):
+    """
+    Parse a duration like 3600, '12h' or '30d' into a number of seconds.
+    """
+    match = re.match("^([0-9.]+)\\s*([smhdw]?)$", str(raw).strip())
+    if not match:
+        raise UserFeedback("Can't parse duration '%s', use e.g. '12h' or '30d'." % raw)
+    number, unit = match.groups()
+    return float(number) * DURATION_UNITS[unit]
+
+def format_size(n_bytes):
+    for unit in ['', 'K', 'M', 'G']:
+        if n_bytes < 1024:
+            return "%.1f%sB" % (n_bytes, unit)
+        n_bytes /= 1024.0
+    return "%.1fTB" % n_bytes
+
 def trunc(s, length=40):
     if len(s) < length:
         return s
@@ -36,3 +138,32 @@ def parse_coins(raw_coins):
 
 def parse_crossref_coins(crossref_info):
     return parse_coins(crossref_coins(crossref_info))
+
+def normalize_doi(doi):
+    """
+    Lower case DOI without any resolver or 'doi:' prefix, for use as a key.
+    DOIs are case insensitive.
+    """
+    doi = doi.strip()
+    doi = re.sub("^(https?://(dx\\.)?doi\\.org/|doi:)", "", doi, flags=re.IGNORECASE)
+    return doi.lower()
+
+def parse_crossref_work(work):
+    """
+    Picks the fields oacensus uses out of a work record from the CrossRef API.
+    """
+    date_parts = work.get('issued', {}).get('date-parts') or [[]]
+    date_parts = [part for part in date_parts[0] if part is not None]
+
+    licenses = [l.get('URL') for l in work.get('license', []) if l.get('URL')]
+
+    return {
+            'doi' : work['DOI'],
+            'title' : (work.get('title') or [None])[0],
+            'journal_title' : (work.get('container-title') or [None])[0],
+            'issn' : work.get('ISSN', []),
+            'publisher' : work.get('publisher'),
+            'date_published' : "-".join("%02d" % part for part in date_parts) or None,
+            'url' : work.get('URL'),
+            'license' : licenses[0] if licenses else None
+            }
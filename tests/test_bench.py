@@ -0,0 +1,40 @@
+from oacensus.bench import BenchHistory
+from oacensus.bench import FIXTURES
+from oacensus.bench import parse_scale
+from oacensus.bench import run_benchmark
+from oacensus.commands import defaults
+from oacensus.db import db
+from oacensus.models import create_db_tables
+import shutil
+import tempfile
+
+def test_parse_scale():
+    assert parse_scale(500) == 500
+    assert parse_scale('1k') == 1000
+    assert parse_scale('1M') == 1000000
+
+def test_benchmark_every_fixture():
+    try:
+        for alias in sorted(FIXTURES):
+            result = run_benchmark(alias, 20, defaults)
+            assert result['records'] == 20
+            assert result['rows_inserted'] >= 20, alias
+    finally:
+        db.init(":memory:")
+        create_db_tables()
+
+def test_history_flags_regressions():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        history = BenchHistory(tmpdir)
+        for seconds in [1.0, 1.1, 0.9]:
+            history.append([{'alias' : 'doaj', 'records' : 1000, 'process_seconds' : seconds}])
+
+        fast = {'alias' : 'doaj', 'records' : 1000, 'process_seconds' : 1.2}
+        slow = {'alias' : 'doaj', 'records' : 1000, 'process_seconds' : 1.5}
+        other = {'alias' : 'doaj', 'records' : 10, 'process_seconds' : 1.5}
+        assert history.regression(fast, 0.25) is None
+        assert history.regression(slow, 0.25) == 1.0
+        assert history.regression(other, 0.25) is None
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,78 @@
+from oacensus.cache import CacheStore
+import os
+import shutil
+import tempfile
+import time
+
+def write_files(dirpath, files):
+    os.makedirs(dirpath)
+    for filename, content in files.iteritems():
+        with open(os.path.join(dirpath, filename), 'wb') as f:
+            f.write(content)
+
+def test_round_trip_and_dedup():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = CacheStore(os.path.join(tmpdir, 'cache'))
+        content = "line one\nline two\n" * 1000
+
+        write_files(os.path.join(tmpdir, 'a'), {'data.txt' : content, 'other.txt' : 'x'})
+        write_files(os.path.join(tmpdir, 'b'), {'copy.txt' : content})
+        store.add_directory('a', os.path.join(tmpdir, 'a'), move=True)
+        store.add_directory('b', os.path.join(tmpdir, 'b'), move=True)
+
+        assert not os.path.exists(os.path.join(tmpdir, 'a'))
+        assert store.filenames('a') == ['data.txt', 'other.txt']
+        with store.open('b', 'copy.txt') as f:
+            assert f.readline() == "line one\n"
+            assert f.read() == content[len("line one\n"):]
+
+        # Identical content is only stored once, and compressed.
+        sizes = store.blob_sizes()
+        assert len(sizes) == 2
+        assert sum(sizes.values()) < len(content)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_gc_removes_least_recently_used():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = CacheStore(os.path.join(tmpdir, 'cache'), 'none')
+        for key in ['old', 'new']:
+            write_files(os.path.join(tmpdir, key), {'data.txt' : key * 100})
+            store.add_directory(key, os.path.join(tmpdir, key), move=True)
+
+        an_hour_ago = time.time() - 3600
+        os.utime(store.manifest_path('old'), (an_hour_ago, an_hour_ago))
+
+        entries, blobs, freed = store.gc(max_size=400)
+        assert (entries, blobs, freed) == (1, 1, 300)
+        assert store.keys() == ['new']
+
+        entries, blobs, freed = store.gc(max_age=60)
+        assert store.keys() == ['new']
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_link_modes_avoid_copying():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = CacheStore(os.path.join(tmpdir, 'cache'), link='hardlink')
+
+        seed_dir = os.path.join(tmpdir, 'seed')
+        write_files(seed_dir, {'data.txt' : 'seed data'})
+        placed = store.add_directory('seeded', seed_dir)
+        assert placed == {'hardlink' : 1}
+        assert os.path.exists(os.path.join(seed_dir, 'data.txt'))
+        digest = store.manifest('seeded')['files']['data.txt']['digest']
+        blob_path = store.blob_path(digest, store.existing_blob(digest))
+        assert os.stat(blob_path).st_ino == os.stat(os.path.join(seed_dir, 'data.txt')).st_ino
+
+        work_dir = os.path.join(tmpdir, 'work')
+        write_files(work_dir, {'data.txt' : 'work data'})
+        placed = store.add_directory('promoted', work_dir, move=True)
+        assert placed == {'rename' : 1}
+        with store.open('promoted', 'data.txt') as f:
+            assert f.read() == 'work data'
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,108 @@
+from oacensus.commands import defaults
+from oacensus.db import db
+from oacensus.models import Article
+from oacensus.models import create_db_tables
+from oacensus.replay import Cassette
+from oacensus.replay import ReplayServer
+from oacensus.replay import replay_url
+from oacensus.scraper import Scraper
+import datetime
+import json
+import shutil
+import tempfile
+import urllib
+
+import oacensus.load_plugins
+
+API = "http://crossref.test/works"
+
+WORK = {
+        'DOI' : "10.1234/Known",
+        'title' : ["A Known Article"],
+        'container-title' : ["Journal of Lookups"],
+        'ISSN' : ["9999-0001"],
+        'issued' : { 'date-parts' : [[2012, 6]] },
+        'URL' : "http://dx.doi.org/10.1234/Known",
+        'license' : [{ 'URL' : "http://creativecommons.org/licenses/by/3.0/" }]
+        }
+
+def test_lookups_are_batched_and_cached():
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    db.init(":memory:")
+    create_db_tables()
+    try:
+        params = {'filter' : "doi:10.1234/known,doi:10.1234/unknown", 'rows' : 2}
+        content = json.dumps({'message' : {'items' : [WORK]}})
+        cassette = Cassette(tmpdir)
+        cassette.save('GET', "%s?%s" % (API, urllib.urlencode(params)), None, 200, [], content)
+
+        server = ReplayServer(('localhost', 0), cassette)
+        server.start()
+
+        known = Article.create(title = "Known", source = "test", doi = "10.1234/KNOWN")
+        Article.create(title = "Unknown", source = "test", doi = "10.1234/unknown")
+
+        opts = dict(defaults, cachedir = tmpdir)
+        for expected_requests in [1, 0]:
+            crossref = Scraper.create_instance('crossref', opts)
+            crossref.update_settings({
+                'api-url' : replay_url(server.url(), API)
+                })
+            crossref.metrics['requests'] = 0
+            crossref.run()
+            assert crossref.metrics['requests'] == expected_requests
+            assert crossref.metrics['lookups_fetched'] == expected_requests * 2
+            crossref.session().close()
+
+        known = Article.get(Article.id == known.id)
+        assert known.journal.issn == "9999-0001"
+        assert known.date_published == datetime.date(2012, 6, 1)
+        assert known.license == "http://creativecommons.org/licenses/by/3.0/"
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
+        db.init(":memory:")
+        create_db_tables()
+
+def test_doilist_fetches_only_new_dois():
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    db.init(":memory:")
+    create_db_tables()
+    try:
+        cassette = Cassette(tmpdir)
+        for dois, items in [(["10.1234/known"], [WORK]), (["10.1234/unknown"], [])]:
+            params = {'filter' : ",".join("doi:%s" % doi for doi in dois), 'rows' : len(dois)}
+            content = json.dumps({'message' : {'items' : items}})
+            cassette.save('GET', "%s?%s" % (API, urllib.urlencode(params)), None, 200, [], content)
+
+        server = ReplayServer(('localhost', 0), cassette)
+        server.start()
+
+        doi_file = "%s/dois.txt" % tmpdir
+        opts = dict(defaults, cachedir = tmpdir)
+        for line in ["10.1234/Known\n", "10.1234/unknown\n"]:
+            with open(doi_file, 'a') as f:
+                f.write(line)
+
+            doilist = Scraper.create_instance('doilist', opts)
+            doilist.update_settings({
+                'api-url' : replay_url(server.url(), API),
+                'doi-file' : doi_file
+                })
+            article_list = doilist.run()
+            assert doilist.metrics['requests'] == 1
+            assert doilist.metrics['lookups_fetched'] == 1
+            assert len(article_list) == 1
+            assert article_list[0].journal.title == "Journal of Lookups"
+            doilist.session().close()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
+        db.init(":memory:")
+        create_db_tables()
@@ -37,3 +37,29 @@ def test_scrape():
 
     article = article_list.articles()[10]
     assert article.date_published == datetime.date(2009,1,12)
+
+def test_scrape_encoded_file():
+    import os
+    import tempfile
+    fd, csv_file = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(u"title,doi,date_published,journal,issn,notes\r\n".encode('latin-1'))
+            f.write(u"Caf\xe9 culture,10.5555/cafe,2010,Revue \xe9tudes,1234-5678,\r\n".encode('latin-1'))
+            # Decodes to a Unicode line separator, which must not end the row.
+            f.write(u"Next\x85line,10.5555/nel,2010,Revue \xe9tudes,1234-5678,\r\n".encode('latin-1'))
+
+        csv = Scraper.create_instance('csvfile', defaults)
+        csv.update_settings({
+            'csv-file' : csv_file,
+            'encoding' : 'latin-1',
+            'list-name' : "Encoded List"
+            })
+        article_list = csv.run()
+
+        [article, nel_article] = article_list.articles()
+        assert article.title == u"Caf\xe9 culture"
+        assert article.journal.title == u"Revue \xe9tudes"
+        assert nel_article.title == u"Next\x85line"
+    finally:
+        os.remove(csv_file)
@@ -0,0 +1,65 @@
+from oacensus.commands import defaults
+from oacensus.replay import Cassette
+from oacensus.replay import ReplayServer
+from oacensus.replay import replay_url
+from oacensus.scraper import Scraper
+import json
+import os
+import shutil
+import tempfile
+
+import oacensus.load_plugins
+
+API = "http://gtr.test/gtr/api/"
+
+def record(cassette, path, data):
+    cassette.save('GET', API + path, None, 200, [('Content-Type', 'application/json')], json.dumps(data))
+
+def test_concurrent_harvest():
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    try:
+        cassette = Cassette(tmpdir)
+        record(cassette, "organisations/ORG/projects", {'totalPages' : 2, 'project' : [{'id' : 'P1'}]})
+        record(cassette, "organisations/ORG/projects?p=2", {'totalPages' : 2, 'project' : [{'id' : 'P2'}]})
+        record(cassette, "projects/P1/outcomes/publications",
+                {'totalPages' : 3, 'publication' : [{'title' : 'p1-1'}]})
+        record(cassette, "projects/P1/outcomes/publications?p=2",
+                {'totalPages' : 3, 'publication' : [{'title' : 'p1-2'}]})
+        record(cassette, "projects/P1/outcomes/publications?p=3",
+                {'totalPages' : 3, 'publication' : [{'title' : 'p1-3'}]})
+        record(cassette, "projects/P2/outcomes/publications",
+                {'totalPages' : 1, 'publication' : [{'title' : 'p2-1'}, {'title' : 'p2-2'}]})
+
+        server = ReplayServer(('localhost', 0), cassette)
+        server.start()
+
+        gtr = Scraper.create_instance('gtr', defaults)
+        gtr.update_settings({
+            'base-url' : replay_url(server.url(), API),
+            'search-type' : 'organisation',
+            'search' : 'ORG',
+            'concurrency' : 4,
+            'rate-limit' : None
+            })
+        gtr.reset_work_dir()
+        gtr.scrape()
+
+        with open(os.path.join(gtr.work_dir(), gtr.setting('data-file')), 'rb') as f:
+            publications = json.load(f)
+        titles = [pub['title'] for pub in publications]
+        assert titles == ['p1-1', 'p1-2', 'p1-3', 'p2-1', 'p2-2']
+        assert gtr.metrics['requests'] == 6
+        assert os.listdir(gtr.work_dir()) == [gtr.setting('data-file')]
+
+        # Publications are kept in the work dir, not the progress log.
+        with open(gtr.progress_path(), 'rb') as f:
+            entries = [json.loads(line) for line in f]
+        assert [e['data'] for e in entries if e.get('unit', '').startswith('project:')] == [None, None]
+        gtr.remove_progress()
+        gtr.session().close()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
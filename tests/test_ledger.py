@@ -0,0 +1,138 @@
+from oacensus.commands import defaults
+from oacensus.db import db
+from oacensus.ledger import RunLedger
+from oacensus.models import Publisher
+from oacensus.models import create_db_tables
+from oacensus.runner import Pipeline
+from oacensus.scraper import Scraper
+import shutil
+import tempfile
+import os
+
+class PublisherTestScraper(Scraper):
+    """
+    Scraper which creates a publisher named by its settings.
+    """
+    aliases = ['publishertestscraper']
+    _settings = {
+            'publisher' : ("Name of publisher to create.", None)
+            }
+
+    def scrape(self):
+        pass
+
+    def process(self):
+        return Publisher.create(name=self.setting('publisher'))
+
+def make_scrapers(names):
+    scrapers = []
+    for name in names:
+        scraper = Scraper.create_instance('publishertestscraper', defaults)
+        scraper.update_settings({'publisher' : name})
+        scrapers.append(scraper)
+    return scrapers
+
+def run_with_ledger(tmpdir, names):
+    scrapers = make_scrapers(names)
+    ledger = RunLedger(scrapers, os.path.join(tmpdir, "test.sqlite3"), tmpdir)
+    n_unchanged = ledger.prepare()
+    Pipeline(scrapers[n_unchanged:], 1, ledger.record, ledger.start).run()
+    return n_unchanged
+
+def test_incremental_rerun():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        assert run_with_ledger(tmpdir, ['a', 'b', 'c']) == 0
+        assert run_with_ledger(tmpdir, ['a', 'b', 'c']) == 3
+        assert run_with_ledger(tmpdir, ['a', 'x', 'c']) == 1
+        assert [p.name for p in Publisher.select().order_by(Publisher.id)] == ['a', 'x', 'c']
+
+        assert run_with_ledger(tmpdir, ['a', 'x', 'c', 'd']) == 3
+        assert run_with_ledger(tmpdir, ['a', 'x', 'c', 'e']) == 3
+        assert [p.name for p in Publisher.select().order_by(Publisher.id)] == ['a', 'x', 'c', 'e']
+    finally:
+        shutil.rmtree(tmpdir)
+        db.init(":memory:")
+        create_db_tables()
+
+class ContentTestScraper(Scraper):
+    """
+    Scraper which downloads the current value of 'content', and creates a
+    publisher named by it.
+    """
+    aliases = ['contenttestscraper']
+    content = None
+
+    def scrape(self):
+        with open(os.path.join(self.work_dir(), "content.txt"), 'wb') as f:
+            f.write(ContentTestScraper.content)
+
+    def process(self):
+        with self.open_cached("content.txt") as f:
+            return Publisher.create(name=f.read())
+
+def test_rescraped_cache_is_reprocessed():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        opts = dict(defaults, cachedir=os.path.join(tmpdir, "cache"))
+        def run():
+            scrapers = [Scraper.create_instance('contenttestscraper', opts)]
+            ledger = RunLedger(scrapers, os.path.join(tmpdir, "test.sqlite3"), tmpdir)
+            n_unchanged = ledger.prepare()
+            Pipeline(scrapers[n_unchanged:], 1, ledger.record, ledger.start).run()
+            return scrapers[0], n_unchanged
+
+        ContentTestScraper.content = "old"
+        scraper, n_unchanged = run()
+        assert run()[1] == 1
+
+        # Same settings, but the cache entry is dropped and scraped again.
+        ContentTestScraper.content = "new"
+        scraper.cache_store().remove_entry(scraper.hashcode())
+        assert run()[1] == 0
+        assert [p.name for p in Publisher.select()] == ['new']
+    finally:
+        shutil.rmtree(tmpdir)
+        db.init(":memory:")
+        create_db_tables()
+
+class CrashingTestScraper(Scraper):
+    """
+    Scraper whose process method fails after some of its rows have been
+    committed.
+    """
+    aliases = ['crashingtestscraper']
+
+    def scrape(self):
+        pass
+
+    def process(self):
+        for i in range(3):
+            Publisher.create(name="partial %s" % i)
+        raise ValueError("process failed")
+
+def test_partly_committed_process_is_discarded():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        run_with_ledger(tmpdir, ['a'])
+
+        scrapers = make_scrapers(['a']) + [Scraper.create_instance('crashingtestscraper', defaults)]
+        ledger = RunLedger(scrapers, os.path.join(tmpdir, "test.sqlite3"), tmpdir)
+        n_unchanged = ledger.prepare()
+        db.configure_writes(commit_every=1)
+        try:
+            Pipeline(scrapers[n_unchanged:], 1, ledger.record, ledger.start).run()
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError"
+        finally:
+            db.configure_writes()
+        assert Publisher.select().where(Publisher.name.startswith("partial")).count() > 0
+
+        assert run_with_ledger(tmpdir, ['a', 'b']) == 1
+        assert [p.name for p in Publisher.select().order_by(Publisher.id)] == ['a', 'b']
+    finally:
+        shutil.rmtree(tmpdir)
+        db.init(":memory:")
+        create_db_tables()
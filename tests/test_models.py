@@ -1,7 +1,15 @@
+from oacensus.db import db
 from oacensus.models import Article
+from oacensus.models import ArticleList
 from oacensus.models import Journal
 from oacensus.models import JournalList
 from oacensus.models import JournalListMembership
+from oacensus.models import ArticleListMembership
+from oacensus.models import ArticleOpenAccess
+from oacensus.models import create_db_tables
+from oacensus.models import Publisher
+from oacensus.models import journal_map
+from oacensus.models import publisher_map
 
 def test_find_or_create():
     journal = Journal.create_or_update_by_issn({"issn" : "abc", "title" : "The Journal", "source" : "test"})
@@ -61,3 +69,94 @@ def test_add_journal_to_list():
 
     journal_list.add_journal(journal)
     assert journal_list.journals()[0] == journal
+
+def test_add_articles():
+    article_list = ArticleList.create(name = "Bulk List")
+    existing = Article.create(title = "Existing Article", source = "test")
+
+    def articles():
+        yield existing
+        for i in range(150):
+            yield { 'title' : "Article %s" % i, 'source' : "test", 'doi' : "10.1/%s" % i }
+
+    assert article_list.add_articles(articles(), chunk_size=100) == 151
+    assert len(article_list) == 151
+
+    titles = [article.title for article in article_list.articles()]
+    assert titles[0] == "Existing Article"
+    assert titles[1:] == ["Article %s" % i for i in range(150)]
+    assert Article.get(Article.doi == "10.1/149").title == "Article 149"
+
+    assert article_list.count() == 151
+    assert article_list[1].title == "Article 0"
+    assert article_list[-1].title == "Article 149"
+    assert [a.title for a in article_list[1:3]] == ["Article 0", "Article 1"]
+    for key in [slice(148, None), slice(-3, None), slice(None, -148), slice(10, 2),
+            slice(1, 20, 5), slice(-1, -5, -2), slice(None, None, -50)]:
+        assert [a.title for a in article_list[key]] == titles[key]
+    assert [a.title for a in article_list.iter_articles()] == titles
+    assert [a.title for a in article_list] == titles
+
+def test_journal_identity_map():
+    journal = Journal.create(title = "Mapped Journal", source = "test", issn = "1111-1111", eissn = "2222-2222")
+
+    with journal_map:
+        assert Journal.by_issn("2222-2222") is Journal.by_issn("1111-1111")
+        updated = Journal.create_or_update_by_issn({"issn" : "1111-1111", "title" : "Renamed Journal"})
+        assert updated is Journal.by_issn("1111-1111")
+        assert Journal.get(Journal.id == journal.id).title == "Mapped Journal"
+
+        created = Journal.create_or_update_by_issn({"issn" : "3333-3333", "title" : "New Journal", "source" : "test"})
+        assert Journal.by_issn("3333-3333") is created
+
+    assert Journal.get(Journal.id == journal.id).title == "Renamed Journal"
+    assert Journal.by_issn("2222-2222").title == "Renamed Journal"
+
+def test_publisher_name_map():
+    with publisher_map:
+        publisher = Publisher.create_or_update_by_name("Mapped Publisher")
+        assert Publisher.create_or_update_by_name("Mapped Publisher") is publisher
+    assert Publisher.create_or_update_by_name("Mapped Publisher").id == publisher.id
+    assert Publisher.select().where(Publisher.name == "Mapped Publisher").count() == 1
+
+def test_migration_adds_indexes_to_old_db():
+    db.init(":memory:")
+    try:
+        create_db_tables()
+        for name in ["article_doi", "articlelistmembership_article_list_id_article_id", "publisher_name"]:
+            db.execute_sql("DROP INDEX %s" % name)
+        db.pragma('user_version', 0)
+
+        article_list = ArticleList.create(name = "Old List")
+        article = Article.create(title = "Old Article", source = "test")
+        for i in range(2):
+            ArticleListMembership.create(article_list = article_list, article = article)
+            publisher = Publisher.create(name = "Old Publisher")
+            Journal.create(title = "Old Journal %s" % i, source = "test", publisher = publisher)
+
+        create_db_tables()
+
+        indexes = set(index.name for table in ["article", "articlelistmembership", "publisher"]
+                for index in db.get_indexes(table))
+        assert "article_doi" in indexes
+        assert "articlelistmembership_article_list_id_article_id" in indexes
+        assert "publisher_name" in indexes
+        assert len(article_list) == 1
+        assert [j.publisher.id for j in Journal.select()] == [Publisher.get().id] * 2
+    finally:
+        db.init(":memory:")
+        create_db_tables()
+
+def test_effective_open_access():
+    journal = Journal.create(title = "OA Journal", source = "test", open_access = True, open_access_source = "doaj")
+    inherits = Article.create(title = "Inherits", source = "test", journal = journal)
+    overrides = Article.create(title = "Overrides", source = "test", journal = journal,
+            open_access = False, open_access_source = "oag")
+
+    for article in Article.select_with_open_access().where(Article.id << [inherits.id, overrides.id]):
+        assert article.effective_open_access == article.is_open_access()
+
+    status = ArticleOpenAccess.get(ArticleOpenAccess.article == inherits)
+    assert (status.open_access, status.open_access_source) == (True, "doaj")
+    status = ArticleOpenAccess.get(ArticleOpenAccess.article == overrides)
+    assert (status.open_access, status.open_access_source) == (False, "oag")
@@ -0,0 +1,68 @@
+from oacensus.commands import defaults
+from oacensus.replay import Cassette
+from oacensus.replay import ReplayServer
+from oacensus.replay import replay_url
+from oacensus.scraper import Scraper
+import os
+import shutil
+import tempfile
+import urllib
+
+import oacensus.load_plugins
+
+API = "http://ncbi.test/entrez/eutils"
+
+SEARCH_RESULT = """<eSearchResult><Count>5</Count><WebEnv>ENV</WebEnv><QueryKey>1</QueryKey></eSearchResult>"""
+
+def record_batch(cassette, retstart):
+    params = {'db' : 'pubmed', 'retMax' : 2, 'WebEnv' : 'ENV', 'query_key' : '1',
+            'RetStart' : retstart, 'usehistory' : 'y', 'retmode' : 'xml'}
+    content = "<PubmedArticleSet><!-- %s --></PubmedArticleSet>" % retstart
+    cassette.save('GET', "%s/efetch.fcgi?%s" % (API, urllib.urlencode(params)), None, 200, [], content)
+
+def test_interrupted_scrape_resumes():
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    try:
+        cassette = Cassette(tmpdir)
+        search_params = {'db' : 'pubmed', 'retMax' : 5, 'term' : 'test', 'usehistory' : 'y'}
+        cassette.save('GET', "%s/esearch.fcgi?%s" % (API, urllib.urlencode(search_params)),
+                None, 200, [], SEARCH_RESULT)
+        record_batch(cassette, 0)
+        record_batch(cassette, 4)
+
+        server = ReplayServer(('localhost', 0), cassette)
+        server.start()
+
+        pubmed = Scraper.create_instance('pubmed', defaults)
+        pubmed.update_settings({
+            'base-url' : replay_url(server.url(), API),
+            'search' : 'test',
+            'ret-max' : 2,
+            'concurrency' : 1,
+            'rate-limit' : None
+            })
+        pubmed.remove_cached_content()
+
+        # The second batch wasn't recorded, so the scrape fails part way.
+        failed = False
+        try:
+            pubmed.ensure_scraped()
+        except Exception as e:
+            failed = "404" in str(e)
+        assert failed
+        assert os.path.exists(pubmed.progress_path())
+        assert not pubmed.is_scraped_content_cached()
+
+        record_batch(cassette, 2)
+        pubmed.metrics = {}
+        pubmed.ensure_scraped()
+        assert pubmed.metrics['requests'] == 3
+        assert pubmed.cached_filenames() == ['data_0000.xml', 'data_0001.xml', 'data_0002.xml']
+        assert not os.path.exists(pubmed.progress_path())
+        pubmed.session().close()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
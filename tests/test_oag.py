@@ -0,0 +1,131 @@
+from oacensus.commands import defaults
+from oacensus.db import db
+from oacensus.models import Article
+from oacensus.models import create_db_tables
+from oacensus.replay import Cassette
+from oacensus.replay import ReplayServer
+from oacensus.replay import replay_url
+from oacensus.scraper import Scraper
+import json
+import shutil
+import tempfile
+
+import oacensus.load_plugins
+
+API = "http://oag.test/lookup/"
+
+def test_licenses_are_cached_per_doi():
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    db.init(":memory:")
+    create_db_tables()
+    try:
+        content = json.dumps({
+            'results' : [{
+                'identifier' : [{ 'id' : "10.5555/OPEN", 'type' : "doi" }],
+                'license' : [{ 'open_access' : True, 'title' : "CC BY " }]
+                }],
+            'errors' : [{ 'identifier' : { 'id' : "10.5555/bad" } }],
+            'processing' : [{ 'identifier' : { 'id' : "10.5555/pending" } }]
+            })
+        cassette = Cassette(tmpdir)
+        body = json.dumps(["10.5555/bad", "10.5555/open", "10.5555/pending"])
+        cassette.save('POST', API, body, 200, [], content)
+        cassette.save('POST', API, json.dumps(["10.5555/pending"]), 200, [], json.dumps({'results' : []}))
+
+        server = ReplayServer(('localhost', 0), cassette)
+        server.start()
+
+        open_ids = [Article.create(title = "Open %s" % i, source = "test", doi = "10.5555/open").id
+                for i in range(2)]
+        Article.create(title = "Bad", source = "test", doi = "10.5555/bad")
+        Article.create(title = "Pending", source = "test", doi = "10.5555/pending")
+
+        opts = dict(defaults, cachedir = tmpdir)
+        for expected_fetched in [3, 1]:
+            oag = Scraper.create_instance('oag', opts)
+            oag.update_settings({'base-url' : replay_url(server.url(), API)})
+            oag.run()
+            assert oag.metrics['lookups_fetched'] == expected_fetched
+            oag.session().close()
+
+        for article in Article.select().where(Article.id << open_ids):
+            assert article.open_access
+            assert article.license == "CC BY"
+            assert article.open_access_source == "oag"
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
+        db.init(":memory:")
+        create_db_tables()
+
+def test_rerun_asks_again_for_pending_dois():
+    from oacensus.commands import run_command
+    import glob
+    import os
+    import yaml
+
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    try:
+        cassette = Cassette(tmpdir)
+        cassette.save('POST', API, json.dumps(["10.5555/open", "10.5555/pending"]), 200, [],
+                json.dumps({
+                    'results' : [{
+                        'identifier' : [{ 'id' : "10.5555/open" }],
+                        'license' : [{ 'open_access' : True, 'title' : "CC BY" }]
+                        }],
+                    'processing' : [{ 'identifier' : { 'id' : "10.5555/pending" } }]
+                    }))
+        cassette.save('POST', API, json.dumps(["10.5555/pending"]), 200, [],
+                json.dumps({
+                    'results' : [{
+                        'identifier' : [{ 'id' : "10.5555/pending" }],
+                        'license' : [{ 'open_access' : False, 'title' : "All rights reserved" }]
+                        }]
+                    }))
+
+        server = ReplayServer(('localhost', 0), cassette)
+        server.start()
+
+        csv_file = os.path.join(tmpdir, "articles.csv")
+        with open(csv_file, 'wb') as f:
+            f.write("title,doi,date_published,journal,issn,notes\n")
+            f.write("Open,10.5555/open,2014,Journal,1234-5678,\n")
+            f.write("Pending,10.5555/pending,2014,Journal,1234-5678,\n")
+
+        config = os.path.join(tmpdir, "oacensus.yaml")
+        with open(config, 'wb') as f:
+            yaml.safe_dump([
+                {'csvfile' : {'csv-file' : csv_file}},
+                {'oag' : {'base-url' : replay_url(server.url(), API)}}
+                ], f)
+
+        metricsdir = os.path.join(tmpdir, "metrics")
+        fetched = []
+        for i in range(2):
+            run_command(
+                    config=config,
+                    cachedir=os.path.join(tmpdir, "cache"),
+                    checkpointdir=os.path.join(tmpdir, "checkpoints"),
+                    dbfile=os.path.join(tmpdir, "oacensus.sqlite3"),
+                    metricsdir=metricsdir)
+
+            latest = sorted(glob.glob(os.path.join(metricsdir, "*.json")), key=os.path.getmtime)[-1]
+            with open(latest, 'rb') as f:
+                scrapers = json.load(f)['scrapers']
+            assert [s['skipped'] for s in scrapers] == [i > 0, False]
+            fetched.append(scrapers[1]['lookups_fetched'])
+
+        assert fetched == [2, 1]
+        licenses = dict((a.doi, a.license) for a in Article.select())
+        assert licenses == {"10.5555/open" : "CC BY", "10.5555/pending" : "All rights reserved"}
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        db.init(":memory:")
+        create_db_tables()
+        shutil.rmtree(tmpdir)
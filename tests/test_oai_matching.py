@@ -0,0 +1,111 @@
+from oacensus.commands import defaults
+from oacensus.db import db
+from oacensus.matching import TitleMatcher
+from oacensus.matching import normalize_title
+from oacensus.models import Article
+from oacensus.models import RepositoryLink
+from oacensus.models import create_db_tables
+from oacensus.scraper import Scraper
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+
+import oacensus.load_plugins
+
+def test_normalize_title():
+    assert normalize_title(u"  The Caf\xe9: a  Study! ") == u"the cafe a study"
+
+def test_title_matcher_blocks_and_matches():
+    matcher = TitleMatcher([
+        (1, u"Open access and the census of publications"),
+        (2, u"A census of bird populations"),
+        (3, u"Something else entirely")
+        ])
+    assert sorted(matcher.candidates(u"the census of publications open access")) == [1]
+    assert matcher.best_match(u"Open Access and the Census of Publications.")[0] == 1
+    assert matcher.best_match(u"Unrelated title") is None
+
+    records = [(i, u"Something else entirely") for i in range(5)]
+    matches = [m for chunk in matcher.match_all(records, processes=2, chunk_size=2) for m in chunk]
+    assert sorted(key for key, article_id, score in matches) == range(5)
+
+def test_no_fork_while_other_threads_run():
+    import oacensus.matching
+    import threading
+
+    def no_pool(*args, **kwargs):
+        assert False, "forked a pool while another thread was running"
+
+    matcher = TitleMatcher([(1, u"Something else entirely")])
+    records = [(i, u"Something else entirely") for i in range(5)]
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    pool = oacensus.matching.Pool
+    oacensus.matching.Pool = no_pool
+    try:
+        matches = [m for chunk in matcher.match_all(records, processes=2, chunk_size=2) for m in chunk]
+        assert len(matches) == 5
+    finally:
+        oacensus.matching.Pool = pool
+        stop.set()
+        thread.join()
+
+def record(identifier, title, identifiers):
+    return {
+            'identifier' : identifier,
+            'datestamp' : None,
+            'metadata' : {
+                'title' : [title],
+                'identifier' : identifiers,
+                'rights' : [u"CC BY"],
+                'type' : [u"Journal article"]
+                }
+            }
+
+def test_records_are_linked_to_articles():
+    tmpdir = tempfile.mkdtemp()
+    db.init(":memory:")
+    create_db_tables()
+    try:
+        by_doi = Article.create(title = "Some title", source = "test", doi = "10.5555/ABC")
+        by_handle = Article.create(title = "Another title", source = "test",
+                url = "http://hdl.handle.net/1234/5678")
+        by_title = Article.create(title = "Matching repository records to articles", source = "test")
+        Article.create(title = "Nothing in the repository", source = "test")
+
+        records = [
+                record("oai:r:1", u"Different title", [u"doi:10.5555/abc"]),
+                record("oai:r:2", u"Different again", [u"hdl:1234/5678"]),
+                record("oai:r:3", u"Matching Repository Records to Articles", [u"uuid:3"]),
+                record("oai:r:4", u"Unrelated", []),
+                {'identifier' : "oai:r:5", 'datestamp' : None, 'metadata' : None}
+                ]
+
+        opts = dict(defaults, cachedir = tmpdir)
+        oai = Scraper.create_instance('oai', opts)
+        oai.update_settings({
+            'pmh-endpoint' : "http://repository.test/oai",
+            'base-objects-url' : "http://repository.test/objects/",
+            'processes' : 1
+            })
+        oai.reset_work_dir()
+        with open(os.path.join(oai.work_dir(), oai.setting('data-file')), 'wb') as f:
+            pickle.dump(records, f)
+        oai.copy_work_dir_to_cache()
+
+        oai.process()
+        oai.process()
+
+        links = dict((link.record, link) for link in RepositoryLink.select())
+        assert sorted(links) == ["oai:r:1", "oai:r:2", "oai:r:3"]
+        assert (links["oai:r:1"].article.id, links["oai:r:1"].match_method) == (by_doi.id, 'doi')
+        assert (links["oai:r:2"].article.id, links["oai:r:2"].match_method) == (by_handle.id, 'handle')
+        assert (links["oai:r:3"].article.id, links["oai:r:3"].match_method) == (by_title.id, 'title')
+        assert links["oai:r:3"].url == "http://repository.test/objects/uuid:3"
+        assert links["oai:r:3"].license == "CC BY"
+    finally:
+        db.init(":memory:")
+        create_db_tables()
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,25 @@
+from oacensus.report import Report
+from oacensus.scraper import Scraper
+import oacensus.load_plugins
+import inspect
+
+def check_lazy_plugins(plugin_class):
+    for alias, class_name in plugin_class.lazy_plugins.items():
+        plugin_class.load_plugin(alias)
+        module_name, name = class_name.split(":")
+        klass = plugin_class.get_reference_to_class(plugin_class.plugins[alias][0])
+        assert klass.__name__ == name
+        assert klass.__module__ == module_name
+        assert alias in klass.aliases
+
+def test_lazy_scraper_plugins_match_modules():
+    check_lazy_plugins(Scraper)
+
+def test_lazy_report_plugins_match_modules():
+    check_lazy_plugins(Report)
+
+def test_all_scraper_modules_registered():
+    Scraper.load_all_plugins()
+    for alias, (klass, settings) in Scraper.plugins.items():
+        if inspect.getmodule(klass).__name__.startswith("oacensus.scrapers"):
+            assert alias in Scraper.lazy_plugins
@@ -0,0 +1,34 @@
+from oacensus.ratelimit import HostRateLimiter
+from oacensus.ratelimit import TokenBucket
+import threading
+import time
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(rate=20, burst=2)
+    start = time.time()
+    waits = [bucket.acquire() for i in range(6)]
+    elapsed = time.time() - start
+    assert waits[:2] == [0, 0]
+    assert 0.18 < elapsed < 0.5
+
+def test_rate_shared_across_threads():
+    limiter = HostRateLimiter()
+    start = time.time()
+
+    def make_requests():
+        for i in range(3):
+            limiter.acquire("http://example.org/%s" % i, 20)
+
+    threads = [threading.Thread(target=make_requests) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 9 requests at 20 per second, the first of which needn't wait.
+    assert time.time() - start >= 0.38
+
+    # A lower rate for the same host wins, other hosts are independent.
+    assert limiter.bucket("example.org", 5).rate == 5
+    assert limiter.bucket("example.org", 50).rate == 5
+    assert limiter.bucket("other.org", 50).rate == 50
@@ -0,0 +1,59 @@
+from oacensus.replay import Cassette
+from oacensus.replay import ReplayServer
+from oacensus.replay import replay_url
+import os
+import requests
+import shutil
+import tempfile
+import time
+
+def test_record_then_replay():
+    tmpdir = tempfile.mkdtemp()
+    servers = []
+    try:
+        # Stands in for the real remote host.
+        upstream_cassette = Cassette(os.path.join(tmpdir, 'upstream'))
+        upstream_cassette.save('GET', 'http://example.org/csv?b=2&a=1', None,
+                200, [('Content-Type', 'text/csv')], "a,b\n1,2\n")
+        upstream = ReplayServer(('localhost', 0), upstream_cassette)
+        servers.append(upstream)
+        upstream.start()
+
+        recorder = ReplayServer(('localhost', 0), Cassette(os.path.join(tmpdir, 'recorded')), record=True)
+        servers.append(recorder)
+        recorder.start()
+        upstream_host = upstream.url().split("//")[1]
+        via_recorder = replay_url(recorder.url(), "http://%s/example.org/csv" % upstream_host)
+        response = requests.get(via_recorder, params={'a' : 1, 'b' : 2})
+        assert response.status_code == 200
+        assert response.text == "a,b\n1,2\n"
+        assert len(recorder.cassette.keys()) == 1
+
+        replayer = ReplayServer(('localhost', 0), Cassette(os.path.join(tmpdir, 'recorded')), latency=0.1)
+        servers.append(replayer)
+        replayer.start()
+        start = time.time()
+        response = requests.get(replay_url(replayer.url(), "http://%s/example.org/csv?a=1&b=2" % upstream_host))
+        assert time.time() - start >= 0.1
+        assert response.text == "a,b\n1,2\n"
+        assert response.headers['Content-Type'] == 'text/csv'
+
+        missing = requests.get(replay_url(replayer.url(), "http://example.org/other"))
+        assert missing.status_code == 404
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
+
+def test_error_injection():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        server = ReplayServer(('localhost', 0), Cassette(tmpdir), error_rate=1.0, error_statuses=[429])
+        server.start()
+        response = requests.get(replay_url(server.url(), "http://example.org/csv"))
+        assert response.status_code == 429
+        server.shutdown()
+        server.server_close()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -1,3 +1,5 @@
+from oacensus.models import Publisher
+from oacensus.report import Report
 from oacensus.scraper import Scraper
 from oacensus.commands import defaults
 
@@ -20,3 +22,205 @@ def test_hashcode():
 def test_run():
     scraper = Scraper.create_instance('testscraper', defaults)
     scraper.run()
+
+class OrderedTestScraper(Scraper):
+    """
+    Scraper which records the order in which phases are called.
+    """
+    aliases = ['orderedtestscraper']
+    _settings = {
+            'label' : ("Label to record.", None)
+            }
+    calls = []
+
+    def scrape(self):
+        OrderedTestScraper.calls.append(('scrape', self.setting('label')))
+
+    def process(self):
+        OrderedTestScraper.calls.append(('process', self.setting('label')))
+        return self.setting('label')
+
+def test_pipeline_processes_in_config_order():
+    from oacensus.runner import Pipeline
+    import shutil
+    import tempfile
+
+    # A fresh cache, so every distinct scraper has to scrape.
+    tmpdir = tempfile.mkdtemp()
+    try:
+        opts = dict(defaults, cachedir=tmpdir)
+        scrapers = []
+        for label in ['a', 'b', 'c', 'b']:
+            scraper = Scraper.create_instance('orderedtestscraper', opts)
+            scraper.update_settings({'label' : label})
+            scrapers.append(scraper)
+
+        OrderedTestScraper.calls = []
+        results = Pipeline(scrapers, 3).run()
+
+        assert results == ['a', 'b', 'c', 'b']
+        processed = [label for phase, label in OrderedTestScraper.calls if phase == 'process']
+        assert processed == results
+
+        # Scrapers with identical settings share a single scrape.
+        scraped = [label for phase, label in OrderedTestScraper.calls if phase == 'scrape']
+        assert sorted(scraped) == ['a', 'b', 'c']
+    finally:
+        shutil.rmtree(tmpdir)
+
+class ResumableTestScraper(Scraper):
+    """
+    Scraper which writes a file per unit of work, failing part way through
+    the first time it is run.
+    """
+    aliases = ['resumabletestscraper']
+    resumable = True
+    _settings = {
+            'label' : ("Label to record.", None)
+            }
+    fail_at = None
+    scraped = []
+
+    def scrape(self):
+        import os
+        completed = self.resume({'units' : 4})
+        for unit in ['a', 'b', 'c', 'd']:
+            if unit in completed:
+                continue
+            if unit == self.fail_at:
+                raise KeyboardInterrupt()
+            ResumableTestScraper.scraped.append(unit)
+            with open(os.path.join(self.work_dir(), unit), 'wb') as f:
+                f.write(unit)
+            self.mark_completed(unit, unit.upper())
+
+    def process(self):
+        return self.cached_filenames()
+
+def test_interrupted_scrape_resumes():
+    import os
+    scraper = Scraper.create_instance('resumabletestscraper', defaults)
+    scraper.update_settings({'label' : str(id(scraper))})
+
+    ResumableTestScraper.fail_at = 'c'
+    ResumableTestScraper.scraped = []
+    try:
+        scraper.run()
+        assert False
+    except KeyboardInterrupt:
+        pass
+    assert not scraper.is_scraped_content_cached()
+
+    ResumableTestScraper.fail_at = None
+    assert scraper.run() == ['a', 'b', 'c', 'd']
+    assert ResumableTestScraper.scraped == ['a', 'b', 'c', 'd']
+    assert not os.path.exists(scraper.progress_path())
+
+def test_stale_work_dir_is_discarded():
+    import os
+    scraper = Scraper.create_instance('resumabletestscraper', defaults)
+    scraper.update_settings({'label' : "stale-%s" % id(scraper)})
+
+    # Left over from an earlier scrape which kept no progress log.
+    scraper.ensure_work_dir()
+    with open(os.path.join(scraper.work_dir(), 'stale'), 'wb') as f:
+        f.write('stale')
+
+    ResumableTestScraper.fail_at = None
+    assert scraper.run() == ['a', 'b', 'c', 'd']
+
+class FailingTestScraper(Scraper):
+    """
+    Scraper whose process method fails after writing to the db.
+    """
+    aliases = ['failingtestscraper']
+
+    def scrape(self):
+        pass
+
+    def process(self):
+        Publisher.create(name="Half Processed")
+        raise ValueError("process failed")
+
+def test_failed_process_is_rolled_back():
+    scraper = Scraper.create_instance('failingtestscraper', defaults)
+    try:
+        scraper.run()
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+    assert Publisher.select().where(Publisher.name == "Half Processed").count() == 0
+
+class MetricsTestScraper(Scraper):
+    """
+    Scraper which adds an article, for checking run metrics.
+    """
+    aliases = ['metricstestscraper']
+    _settings = {
+            'label' : ("Label to record.", None)
+            }
+
+    def scrape(self):
+        pass
+
+    def process(self):
+        from oacensus.models import Article
+        Article.create(title=self.setting('label'), source=self.alias)
+
+class MetricsTestReport(Report):
+    """
+    Report which does nothing, for checking run metrics.
+    """
+    aliases = ['metricstestreport']
+
+    def run(self):
+        pass
+
+def test_run_metrics_are_written():
+    from oacensus.commands import run_command
+    from oacensus.db import db
+    from oacensus.models import create_db_tables
+    import json
+    import os
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config = os.path.join(tmpdir, "oacensus.yaml")
+        with open(config, 'wb') as f:
+            for i in range(2):
+                f.write("- metricstestscraper:\n    label: metrics\n")
+
+        metricsdir = os.path.join(tmpdir, "metrics")
+        run_command(
+                config=config,
+                cachedir=os.path.join(tmpdir, "cache"),
+                checkpointdir=os.path.join(tmpdir, "checkpoints"),
+                dbfile=os.path.join(tmpdir, "oacensus.sqlite3"),
+                metricsdir=metricsdir,
+                reports="metricstestreport",
+                workers=2)
+
+        [filename] = os.listdir(metricsdir)
+        with open(os.path.join(metricsdir, filename), 'rb') as f:
+            metrics = json.load(f)
+
+        scrapers = metrics['scrapers']
+        assert [s['alias'] for s in scrapers] == ['metricstestscraper'] * 2
+        assert [s['cache_hit'] for s in scrapers] == [False, True]
+        for s in scrapers:
+            for key in ['scrape_seconds', 'requests', 'process_seconds',
+                    'rows_inserted', 'rows_updated', 'db_seconds']:
+                assert key in s, key
+            assert s['rows_inserted'] == 1
+
+        [report] = metrics['reports']
+        assert report['alias'] == 'metricstestreport'
+        assert report['render_seconds'] >= 0
+    finally:
+        db.init(":memory:")
+        create_db_tables()
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,107 @@
+from oacensus.commands import defaults
+from oacensus.replay import Cassette
+from oacensus.replay import ReplayServer
+from oacensus.replay import replay_url
+from oacensus.scraper import Scraper
+from oacensus.session import RetrySession
+import shutil
+import tempfile
+
+import tests.test_scraper
+
+def test_retries_with_backoff():
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    try:
+        cassette = Cassette(tmpdir)
+        cassette.save('GET', 'http://example.org/data', None, 200, [], "data")
+        server = ReplayServer(('localhost', 0), cassette, error_rate=0.5, error_statuses=[429, 503])
+        server.start()
+        url = replay_url(server.url(), "http://example.org/data")
+
+        session = RetrySession(retries=10, backoff=0.001, max_backoff=0.01)
+        for i in range(5):
+            assert session.get(url).text == "data"
+        session.close()
+
+        # Gives up and returns the last response once retries are used up.
+        server.error_rate = 1.0
+        scraper = Scraper.create_instance('testscraper', defaults)
+        scraper.update_settings({'retries' : 2, 'backoff' : 0.001})
+        scraper.session().max_backoff = 0.01
+        response = scraper.session().get(url)
+        assert response.status_code in (429, 503)
+        assert scraper.metrics['requests'] == 3
+        scraper.session().close()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
+
+def test_network_settings_not_hashed():
+    scraper = Scraper.create_instance('testscraper', defaults)
+    hashcode = scraper.hashcode()
+    scraper.update_settings({'retries' : 0, 'timeout' : 5})
+    assert scraper.hashcode() == hashcode
+
+def test_concurrent_requests_are_counted():
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    try:
+        cassette = Cassette(tmpdir)
+        cassette.save('GET', 'http://example.org/data', None, 200, [], "data")
+        server = ReplayServer(('localhost', 0), cassette)
+        server.start()
+        url = replay_url(server.url(), "http://example.org/data")
+
+        scraper = Scraper.create_instance('testscraper', defaults)
+        scraper.update_settings({'concurrency' : 8, 'rate-limit' : 10000, 'rate-burst' : 10})
+        bodies = list(scraper.imap(lambda i: scraper.session().get(url).text, range(200)))
+        assert bodies == ["data"] * 200
+        assert scraper.metrics['requests'] == 200
+        scraper.session().close()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmpdir)
+
+def test_posts_are_not_resent_after_connection_drops():
+    import requests
+    import socket
+    import threading
+
+    # Accepts connections and closes them without responding.
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(5)
+    connections = []
+    def serve():
+        while True:
+            try:
+                conn, addr = listener.accept()
+            except socket.error:
+                return
+            conn.recv(65536)
+            connections.append(conn)
+            conn.close()
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    url = "http://localhost:%s/" % listener.getsockname()[1]
+    session = RetrySession(retries=2, backoff=0.001, max_backoff=0.01)
+    try:
+        for method, attempts in [('POST', 1), ('GET', 3)]:
+            del connections[:]
+            try:
+                session.request(method, url, data="x")
+            except requests.ConnectionError:
+                pass
+            else:
+                assert False, "expected ConnectionError"
+            assert len(connections) == attempts, (method, len(connections))
+    finally:
+        session.close()
+        listener.close()
@@ -0,0 +1,35 @@
+from oacensus.utils import iter_universal_lines
+from oacensus.utils import iterparse_elements
+import StringIO
+import oacensus.utils
+
+XML = """<?xml version="1.0"?>
+<PubmedArticleSet>
+<PubmedArticle><MedlineCitation><PMID>1</PMID></MedlineCitation></PubmedArticle>
+<PubmedBookArticle><BookDocument><PMID>2</PMID></BookDocument></PubmedBookArticle>
+<PubmedArticle><MedlineCitation><PMID>3</PMID></MedlineCitation></PubmedArticle>
+</PubmedArticleSet>
+"""
+
+def check_iterparse():
+    pmids = [elem.findtext("MedlineCitation/PMID")
+            for elem in iterparse_elements(StringIO.StringIO(XML), "PubmedArticle")]
+    assert pmids == ['1', '3']
+
+def test_iterparse_elements():
+    check_iterparse()
+
+def test_iterparse_elements_without_lxml():
+    lxml_etree = oacensus.utils.lxml_etree
+    oacensus.utils.lxml_etree = None
+    try:
+        check_iterparse()
+    finally:
+        oacensus.utils.lxml_etree = lxml_etree
+
+def test_iter_universal_lines():
+    data = "a\r\nb\rc\n\nd\x85e\r"
+    for block_size in [1, 2, 1024]:
+        lines = list(iter_universal_lines(StringIO.StringIO(data), block_size))
+        assert lines == ["a\n", "b\n", "c\n", "\n", "d\x85e\n"]
+    assert list(iter_universal_lines(StringIO.StringIO("x\r\ny"))) == ["x\n", "y"]